@@ -0,0 +1,107 @@
+import argparse
+import datetime
+import gc
+import logging
+import random
+import time
+import tracemalloc
+
+import pytz
+
+from ..scraper.items import SmuttyImage, SmuttyVideo, SmuttyImageRecord, SmuttyVideoRecord
+
+
+def parsed_fields(count, tag_vocabulary, seed=0):
+    """
+    Field values as parsing yields them, every string being a new object
+    """
+    rnd = random.Random(seed)
+    vocabulary = ["tag{0}".format(i) for i in range(tag_vocabulary)]
+    last_updated = datetime.datetime.now(pytz.UTC)
+    for item_id in range(count):
+        fields = {
+            "item_id": 1000000 + item_id,
+            "submitter": "user{0}".format(rnd.randrange(10000)),
+            "sub_page": "/s/{0}/".format(1000000 + item_id),
+            "tags": ["".join(tag) for tag in rnd.sample(vocabulary, rnd.randrange(1, 8))],
+            "last_updated": last_updated,
+        }
+        if rnd.random() < 0.2:
+            fields.update({
+                "poster_url": "https://example.com/posters/{0}.jpg".format(item_id),
+                "video_url": "https://example.com/videos/{0}.mp4".format(item_id),
+                "video_mime": "".join("video/mp4"),
+            })
+        else:
+            fields["image_url"] = "https://example.com/images/{0}.jpg".format(item_id)
+        yield fields
+
+
+def build_scrapy_item(fields):
+    item_class = SmuttyVideo if "video_url" in fields else SmuttyImage
+    return item_class(dict(fields, tags=set(fields["tags"])))
+
+
+def build_record(fields):
+    record_class = SmuttyVideoRecord if "video_url" in fields else SmuttyImageRecord
+    return record_class(**fields)
+
+
+def scrapy_item_orm_arguments(item):
+    # as the pipeline did: copy into a dict, tags being replaced, then keyword arguments
+    wrapped = {k: v if k != 'tags' else set(item['tags']) for k, v in item.items()}
+    return dict(**wrapped)
+
+
+def record_orm_arguments(record):
+    return dict(((field, getattr(record, field)) for field in record.FIELDS))
+
+
+def measure(fields, build, orm_arguments):
+    """
+    Returns retained bytes and allocated blocks of the items, allocated blocks
+    of their conversion, and elapsed time of both
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    before = tracemalloc.take_snapshot()
+    items = [build(item_fields) for item_fields in fields]
+    after = tracemalloc.take_snapshot()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    build_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    arguments = [orm_arguments(item) for item in items]
+    converted = tracemalloc.take_snapshot()
+    conversion_blocks = sum(stat.count_diff for stat in converted.compare_to(after, "filename"))
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    del arguments
+    return retained, build_blocks, conversion_blocks, elapsed
+
+
+def main():
+    """
+    Compares memory and allocations of scrapy items and compact records,
+    from parsed fields to ORM constructor arguments, per 10k items
+    """
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Smutty item representation benchmark")
+    parser.add_argument("-n", "--item-count", type=int, default=10000)
+    parser.add_argument("-t", "--tag-vocabulary", type=int, default=500)
+    args = parser.parse_args()
+
+    fields = list(parsed_fields(args.item_count, args.tag_vocabulary))
+    scale = 10000 / args.item_count
+    paths = {
+        "scrapy.Item": (build_scrapy_item, scrapy_item_orm_arguments),
+        "compact record": (build_record, record_orm_arguments),
+    }
+    for name, (build, orm_arguments) in paths.items():
+        retained, build_blocks, conversion_blocks, elapsed = measure(fields, build, orm_arguments)
+        logging.info("%-14s per 10k items: retained=%.0fkB allocations=%d+%d time=%.3fs", name,
+                     retained * scale / 1024, build_blocks * scale, conversion_blocks * scale, elapsed * scale)
+
+
+if __name__ == "__main__":
+    main()
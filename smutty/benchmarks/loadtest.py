@@ -0,0 +1,103 @@
+import argparse
+import logging
+import tempfile
+import time
+
+from path import Path
+
+from ..config import ConfigurationFile
+from ..filetools import IntegerStateFile
+
+from .mocksite import MockSite
+
+
+LOADTEST_SCRAPER_CONFIG = """
+[scraper]
+current_scraper_page = {state_dir}/current_scraper_page.state
+highest_scraper_id = {state_dir}/highest_scraper_id.state
+lowest_scraper_id = {state_dir}/lowest_scraper_id.state
+page_url = {page_url}
+"""
+
+
+def count_rows(database):
+    import sqlalchemy
+
+    from ..models import Item, association_item_tag
+
+    session = database.session
+    item_count = session.query(sqlalchemy.func.count(Item.item_id)).scalar()
+    tag_link_count = session.query(sqlalchemy.func.count()).select_from(association_item_tag).scalar()
+    database.release()
+    return item_count, tag_link_count
+
+
+def main():
+    """
+    Drives the spider and the database pipeline against a local mock site,
+    without download delay, and reports throughput
+    Items are really inserted, so the configuration must point to a scratch database
+    """
+    import scrapy.crawler
+
+    from ..db import DatabaseSession
+    from ..models import ensure_all_tables
+    from ..scraper.app import build_settings
+    from ..scraper.spiders import SmuttySpider
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Smutty scraper load test")
+    parser.add_argument("-c", "--page-count", type=int, default=100)
+    parser.add_argument("-n", "--items-per-page", type=int, default=25)
+    parser.add_argument("-v", "--video-ratio", type=float, default=0.2)
+    parser.add_argument("-l", "--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("-a", "--arrival-rate", type=float, default=0.0, help="new items per second during the crawl")
+    parser.add_argument("-t", "--top-id", type=int, default=1000000, help="newest item id when the crawl starts")
+    parser.add_argument("config", metavar="CONFIG", nargs='?', default=ConfigurationFile.DEFAULT_CONFIG_FILE,
+                        help="configuration whose database section is used")
+    args = parser.parse_args()
+
+    config = ConfigurationFile(args.config)
+    database = DatabaseSession.from_config(config)
+    ensure_all_tables(database.engine)
+
+    site = MockSite(args.page_count, args.items_per_page, args.video_ratio, args.latency, args.arrival_rate,
+                    args.top_id)
+    site.start()
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        # database section is kept, scraper states are thrown away
+        config_path = Path(state_dir) / "smutty.conf"
+        database_lines = "".join("{0} = {1}\n".format(key, value) for key, value in config.get('database').items())
+        scraper_lines = LOADTEST_SCRAPER_CONFIG.format(state_dir=state_dir, page_url=site.page_url)
+        config_path.write_text("[database]\n" + database_lines + scraper_lines)
+        loadtest_config = ConfigurationFile(config_path)
+        IntegerStateFile(loadtest_config.get('scraper', 'current_scraper_page')).set(1)
+
+        settings = build_settings(loadtest_config)
+        settings.set("DOWNLOAD_DELAY", 0)
+        settings.set("SMUTTY_DATABASE", database)
+
+        items_before, tag_links_before = count_rows(database)
+        process = scrapy.crawler.CrawlerProcess(settings)
+        crawler = process.create_crawler(SmuttySpider)
+        process.crawl(crawler)
+        start = time.perf_counter()
+        process.start()  # it blocks here until finished
+        elapsed = time.perf_counter() - start
+        items_after, tag_links_after = count_rows(database)
+
+    site.stop()
+    database.dispose()
+
+    pages = crawler.stats.get_value('response_received_count', 0)
+    items = crawler.stats.get_value('item_scraped_count', 0)
+    rows = (items_after - items_before) + (tag_links_after - tag_links_before)
+    logging.info("Crawled %d pages and %d items in %.2fs", pages, items, elapsed)
+    logging.info("%.1f pages/s, %.1f items/s, %.1f database rows/s (items and tag links)",
+                 pages / elapsed, items / elapsed, rows / elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import http.server
+import logging
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+
+
+class MockSite:
+    """
+    Generated listing pages, newest items first, with the markup parsed by the spider
+    Items keep arriving while crawling, shifting older items to later pages as the real site does
+    """
+
+    PAGE_PATH = "/"
+
+    TAGS = ["amateur", "outdoor", "selfie", "couple", "blonde", "brunette", "redhead", "vintage", "art", "gif"]
+
+    def __init__(self, page_count=100, items_per_page=25, video_ratio=0.2, latency=0.0, arrival_rate=0.0,
+                 top_id=1000000, seed=0):
+        self.page_count = page_count
+        self.items_per_page = items_per_page
+        self.video_ratio = video_ratio
+        self.latency = latency
+        self.arrival_rate = arrival_rate
+        self._initial_top_id = top_id
+        self._seed = seed
+        self._started_at = time.time()
+        self._server = None
+        self._thread = None
+
+    def __repr__(self):
+        return "{0}({page_count}, {items_per_page}, {video_ratio}, {latency}, {arrival_rate})".format(
+            self.__class__.__name__, **self.__dict__)
+
+    @property
+    def top_id(self):
+        return self._initial_top_id + int((time.time() - self._started_at) * self.arrival_rate)
+
+    @property
+    def lowest_id(self):
+        """
+        Items below are not listed, so that crawls reach an empty page
+        """
+        return self._initial_top_id - self.page_count * self.items_per_page
+
+    @property
+    def page_url(self):
+        host, port = self._server.server_address
+        return "http://{0}:{1}{2}?view=new&home=1&page={{0}}&h=&lazy=1".format(host, port, self.PAGE_PATH)
+
+    def item_html(self, item_id):
+        # items are derived from their id, so that they do not change between requests
+        rnd = random.Random(self._seed * 1000003 + item_id)
+        submitter = "user{0}".format(rnd.randrange(1000))
+        tags = "".join('<a href="/h/{0}/">#{0}</a> '.format(tag) for tag in rnd.sample(self.TAGS, rnd.randrange(1, 5)))
+        if rnd.random() < self.video_ratio:
+            content = (
+                '<video poster="https://mock.example.com/posters/{0}.jpg">'
+                '<source src="https://mock.example.com/videos/{0}.mp4" type="video/mp4"></video>'
+            ).format(item_id)
+        else:
+            content = '<img src="https://mock.example.com/images/{0}.jpg">'.format(item_id)
+        return (
+            '<div id="item_{0}">'
+            '<div class="top"><img onclick="App.user(1)" alt="{1}" src="/avatar.png">'
+            '<a onclick="App.txtr({0})" href="#">comments</a></div>'
+            '<div class="center"><a href="/s/{0}/">{2}</a></div>'
+            '<div class="bottom">{3}</div>'
+            '</div>'
+        ).format(item_id, submitter, content, tags)
+
+    def page_html(self, page_number):
+        first_id = self.top_id - (page_number - 1) * self.items_per_page
+        item_ids = [item_id for item_id in range(first_id, first_id - self.items_per_page, -1)
+                    if item_id > self.lowest_id]
+        items = "".join(self.item_html(item_id) for item_id in item_ids)
+        return '<html><body><div id="container_chart">{0}</div></body></html>'.format(items).encode()
+
+    def handler_class(self):
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                if url.path != site.PAGE_PATH or "page" not in query:
+                    self.send_error(404)
+                    return
+                if site.latency:
+                    time.sleep(site.latency)
+                body = site.page_html(int(query["page"][0]))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Mock site: " + format, *args)
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Serves pages from a background thread, port 0 picking a free one
+        """
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self._server = Server((host, port), self.handler_class())
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info("Mock site serving %s", self.page_url)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    """
+    Serves a mock site until interrupted
+    """
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Smutty mock site")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-c", "--page-count", type=int, default=100)
+    parser.add_argument("-n", "--items-per-page", type=int, default=25)
+    parser.add_argument("-v", "--video-ratio", type=float, default=0.2)
+    parser.add_argument("-l", "--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("-a", "--arrival-rate", type=float, default=0.0, help="new items per second")
+    args = parser.parse_args()
+
+    site = MockSite(args.page_count, args.items_per_page, args.video_ratio, args.latency, args.arrival_rate)
+    site.start(port=args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        site.stop()
+
+
+if __name__ == "__main__":
+    main()
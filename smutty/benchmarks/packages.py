@@ -0,0 +1,100 @@
+import argparse
+import datetime
+import io
+import json
+import logging
+import lzma
+import random
+import time
+
+import pytz
+
+from ..exporter.serializers import CompactItemEncoder, LzmaJsonlPackageSerializer
+
+
+def export_items(count, tag_vocabulary, video_ratio=0.2, seed=0):
+    """
+    Items of one block as the exporter reads them from the database,
+    media urls being spread over dated directories
+    """
+    rnd = random.Random(seed)
+    vocabulary = ["tag{0}".format(i) for i in range(tag_vocabulary)]
+    start = datetime.datetime(2018, 1, 1, tzinfo=pytz.UTC)
+    items = []
+    for offset in range(count):
+        item_id = 1000000 + offset
+        day = (start + datetime.timedelta(minutes=offset)).strftime("%Y/%m/%d")
+        item = {
+            "item_id": item_id,
+            "submitter": "user{0}".format(rnd.randrange(10000)),
+            "sub_page": "/s/{0}/".format(item_id),
+            "tags": sorted(rnd.sample(vocabulary, rnd.randrange(1, 8))),
+            "last_updated": start + datetime.timedelta(seconds=offset * 7, microseconds=rnd.randrange(1000000)),
+        }
+        if rnd.random() < video_ratio:
+            item["poster_url"] = "https://cdn.example.com/posters/{0}/{1}.jpg".format(day, item_id)
+            item["video_url"] = "https://cdn.example.com/videos/{0}/{1}.mp4".format(day, item_id)
+            item["video_mime"] = rnd.choice(("video/mp4", "video/mp4", "video/webm"))
+        else:
+            item["image_url"] = "https://cdn.example.com/images/{0}/{1}.jpg".format(day, item_id)
+        items.append(item)
+    return items
+
+
+def read_package(data):
+    """
+    Decompresses and decodes items, expanding compact ones, as the reader does
+    """
+    header = None
+    items = []
+    for line in lzma.decompress(data).splitlines():
+        item = json.loads(line.decode())
+        if CompactItemEncoder.HEADER_KEY in item:
+            header = item[CompactItemEncoder.HEADER_KEY]
+            continue
+        if header is not None:
+            CompactItemEncoder.expand_item(header, item)
+        items.append(item)
+    return items
+
+
+def measure(items, compact, repeat):
+    """
+    Returns raw and compressed sizes, and best write and read times
+    """
+    serializer = LzmaJsonlPackageSerializer(None, "wb", compact)
+    raw = io.BytesIO()
+    serializer.serialize_package(items, raw)
+    write_times, read_times = [], []
+    for _ in range(repeat):
+        compressed = io.BytesIO()
+        start = time.perf_counter()
+        serializer.serialize_to_file(None, items, compressed)
+        write_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        read_package(compressed.getvalue())
+        read_times.append(time.perf_counter() - start)
+    return len(raw.getvalue()), len(compressed.getvalue()), min(write_times), min(read_times)
+
+
+def main():
+    """
+    Compares size and CPU time of regular and compact encodings of a package
+    """
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Smutty package encoding benchmark")
+    parser.add_argument("-n", "--item-count", type=int, default=10000)
+    parser.add_argument("-t", "--tag-vocabulary", type=int, default=500)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    items = export_items(args.item_count, args.tag_vocabulary)
+    for name, compact in (("regular", False), ("compact", True)):
+        raw_size, compressed_size, write_time, read_time = measure(items, compact, args.repeat)
+        logging.info("%-8s raw=%.0fkB xz=%.0fkB write=%.3fs read=%.3fs (%d items)", name,
+                     raw_size / 1024, compressed_size / 1024, write_time, read_time, len(items))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import logging
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from path import Path
+
+
+NOOP_CONFIG = """
+[database]
+dialect = postgres
+host = localhost
+port = 5432
+username = nobody
+password = nothing
+database = nothing
+lowest_item_id = {state_dir}/lowest_item_id.state
+
+[scraper]
+current_scraper_page = {state_dir}/current_scraper_page.state
+highest_scraper_id = {state_dir}/highest_scraper_id.state
+lowest_scraper_id = {state_dir}/lowest_scraper_id.state
+
+[exporter]
+output_directory = {state_dir}/output
+highest_exporter_id = {state_dir}/highest_exporter_id.state
+lowest_exporter_id = {state_dir}/lowest_exporter_id.state
+"""
+
+
+def time_invocation(arguments, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(arguments, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    """
+    Measures wall-clock time of no-op invocations, as run from cron
+    Nothing is fetched and no database connection is needed
+    """
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Smutty startup benchmark")
+    parser.add_argument("-r", "--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as state_dir, tempfile.TemporaryDirectory() as exported_state_dir:
+        config_path = Path(state_dir) / "smutty.conf"
+        config_path.write_text(NOOP_CONFIG.format(state_dir=state_dir))
+        # export up to date with the last finished scrap, nothing stored below it
+        exported_config_path = Path(exported_state_dir) / "smutty.conf"
+        exported_config_path.write_text(NOOP_CONFIG.format(state_dir=exported_state_dir))
+        for name, value in (("lowest_scraper_id", 2000), ("highest_exporter_id", 2000),
+                            ("lowest_exporter_id", 1000), ("lowest_item_id", 1000)):
+            (Path(exported_state_dir) / "{0}.state".format(name)).write_text(str(value))
+
+        invocations = {
+            "interpreter only": [sys.executable, "-c", "pass"],
+            # page count of zero exits before scraping
+            "scraper no-op": [sys.executable, "-m", "smutty.scraper", "-c", "0", config_path],
+            # no finished scrap exits before exporting
+            "exporter no-op": [sys.executable, "-m", "smutty.exporter", config_path],
+            "exporter up to date": [sys.executable, "-m", "smutty.exporter", exported_config_path],
+        }
+        for name, arguments in invocations.items():
+            durations = time_invocation(arguments, args.repeat)
+            logging.info("%-19s min=%.3fs mean=%.3fs max=%.3fs (%d runs)", name,
+                         min(durations), statistics.mean(durations), max(durations), len(durations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Bloom filters, written by the exporter and read by clients checking item membership
+"""
+import hashlib
+import math
+import struct
+
+from .exceptions import SmuttyException
+
+
+class BloomFilter:
+    """
+    Bit array in which every key sets a few bits, derived from its md5 digest by double hashing
+    Membership tests may give false positives, never false negatives
+    """
+
+    MAGIC = b"SMBF"
+
+    VERSION = 1
+
+    # magic, version, hash count, bit count
+    HEADER = struct.Struct(">4sBBI")
+
+    def __init__(self, bit_count, hash_count, bits=None):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self._bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+
+    def __repr__(self):
+        return "{0}({bit_count}, {hash_count})".format(self.__class__.__name__, **self.__dict__)
+
+    @classmethod
+    def for_capacity(cls, key_count, false_positive_rate):
+        """
+        Smallest filter holding key_count keys at the requested false positive rate
+        """
+        if not 0 < false_positive_rate < 1:
+            raise SmuttyException("Bloom filter false positive rate must be between 0 and 1, not {0}".format(
+                false_positive_rate))
+        key_count = max(key_count, 1)
+        bit_count = max(8, int(math.ceil(-key_count * math.log(false_positive_rate) / math.log(2) ** 2)))
+        hash_count = min(255, max(1, int(round(bit_count / key_count * math.log(2)))))
+        return cls(bit_count, hash_count)
+
+    def _positions(self, key):
+        digest = hashlib.md5(str(key).encode()).digest()
+        first, second = struct.unpack(">QQ", digest)
+        return ((first + i * second) % self.bit_count for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.MAGIC, self.VERSION, self.hash_count, self.bit_count) + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, hash_count, bit_count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise SmuttyException("Unsupported bloom filter format")
+        return cls(bit_count, hash_count, bytearray(data[cls.HEADER.size:]))
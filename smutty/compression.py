@@ -1,5 +1,8 @@
+import gzip
 import lzma
 
+from . import profiling
+
 
 class LzmaCompression:
 
@@ -17,8 +20,29 @@ class LzmaCompression:
         self._inside_fileobj = None
 
     def __enter__(self):
-        self._inside_fileobj = lzma.LZMAFile(self._outside_file_obj, mode=self._file_mode, **self.default_settings())
-        return self._inside_fileobj
+        # format is auto-detected when reading
+        settings = self.default_settings() if "r" not in self._file_mode else {}
+        self._inside_fileobj = lzma.LZMAFile(self._outside_file_obj, mode=self._file_mode, **settings)
+        if "r" in self._file_mode:
+            return self._inside_fileobj
+        return profiling.timed_writes(self._inside_fileobj, "compress")
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self._inside_fileobj is not None:
+            self._inside_fileobj.close()
+
+
+class GzipCompression:
+
+    def __init__(self, outside_file_obj, file_mode):
+        self._outside_file_obj = outside_file_obj
+        self._file_mode = file_mode
+        self._inside_fileobj = None
+
+    def __enter__(self):
+        # no file name nor time in header, so that output is stable
+        self._inside_fileobj = gzip.GzipFile(filename="", mode=self._file_mode, fileobj=self._outside_file_obj, mtime=0)
+        return profiling.timed_writes(self._inside_fileobj, "compress")
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         if self._inside_fileobj is not None:
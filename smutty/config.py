@@ -24,7 +24,29 @@ class ConfigurationFile:
                 # isolate returned value from original
                 return {**self._config[section]}
         except KeyError as exception:
-            raise SmuttyException("Problem while reading key {1} for section {2} in configuration file {3} : {0}".format(exception, key, section, self._file_name))
+            raise SmuttyException("Problem while reading key {1} for section {2} in configuration file {3} : {0}"
+                                  .format(exception, key, section, self._file_name))
 
-    def get_boolean(self, section, key):
-        return self._config.getboolean(section, key)
+    def get_boolean(self, section, key, fallback=False):
+        try:
+            return self._config.getboolean(section, key, fallback=fallback)
+        except ValueError as exception:
+            raise SmuttyException("Invalid boolean for key {1} in section {2} in configuration file {3} : {0}"
+                                  .format(exception, key, section, self._file_name))
+
+    def get_integer(self, section, key, fallback=None):
+        try:
+            return self._config.getint(section, key, fallback=fallback)
+        except ValueError as exception:
+            raise SmuttyException("Invalid integer for key {1} in section {2} in configuration file {3} : {0}"
+                                  .format(exception, key, section, self._file_name))
+
+    def get_float(self, section, key, fallback=None):
+        try:
+            return self._config.getfloat(section, key, fallback=fallback)
+        except ValueError as exception:
+            raise SmuttyException("Invalid number for key {1} in section {2} in configuration file {3} : {0}"
+                                  .format(exception, key, section, self._file_name))
+
+    def has_section(self, section):
+        return self._config.has_section(section)
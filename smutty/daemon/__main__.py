@@ -0,0 +1,5 @@
+from .app import App
+
+from ..runner import run
+
+run(App)
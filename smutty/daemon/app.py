@@ -0,0 +1,163 @@
+import argparse
+import logging
+import time
+
+from ..config import ConfigurationFile
+from ..filetools import IntegerStateFile
+
+from .metrics import DaemonMetrics
+
+# scrapy, twisted and sqlalchemy are only imported once running
+
+
+class App:
+    """
+    Keeps one reactor and one connection pool alive, crawls the newest pages
+    on a schedule, and exports newly finished ranges as soon as they are
+    """
+
+    DEFAULT_SCRAPE_INTERVAL = 900
+
+    DEFAULT_PAGE_COUNT = 10
+
+    def __init__(self):
+        # analyze commande line arguments
+        parser = argparse.ArgumentParser(description="Smutty scraper and exporter daemon")
+        parser.add_argument("-i", "--interval", metavar="SECONDS", type=int, help="delay between crawl starts")
+        parser.add_argument("-c", "--page-count", metavar="PAGE_COUNT", type=int, help="pages crawled per cycle")
+        parser.add_argument("-o", "--output", help="output directory", default=False)
+        parser.add_argument("config", metavar="CONFIG", nargs='?', default=ConfigurationFile.DEFAULT_CONFIG_FILE)
+        args = parser.parse_args()
+
+        # load configuration
+        self._config = ConfigurationFile(args.config)
+        daemon_config = self._config.get('daemon') if self._config.has_section('daemon') else {}
+
+        self._interval = args.interval or self._config.get_integer('daemon', 'scrape_interval',
+                                                                   self.DEFAULT_SCRAPE_INTERVAL)
+        self._page_count = args.page_count or self._config.get_integer('daemon', 'page_count', self.DEFAULT_PAGE_COUNT)
+        self._health_file = daemon_config.get('health_file')
+        self._blacklist_tag_file = daemon_config.get('blacklist_tag_file')
+        self._output_directory = args.output
+
+        self._current_scraper_page_state = IntegerStateFile(self._config.get('scraper', 'current_scraper_page'))
+
+        self._metrics = DaemonMetrics()
+        self._crawling = False
+        self._exporting = False
+        self._database = None
+        self._runner = None
+        self._exporter = None
+
+    def run(self):
+        from twisted.internet import reactor, task
+        import scrapy.crawler
+        import scrapy.utils.log
+
+        from ..db import DatabaseSession
+        from ..exporter.exporters import Exporter
+        from ..models import ensure_all_tables
+        from ..scraper.app import build_settings, load_blacklisted_tags
+
+        # one connection pool shared by pipeline and exporter
+        self._database = DatabaseSession.from_config(self._config)
+        ensure_all_tables(self._database.engine, self._config.get('database').get('schema_version'))
+
+        settings = build_settings(self._config, self._page_count, load_blacklisted_tags(self._blacklist_tag_file))
+        settings.set("SMUTTY_DATABASE", self._database)
+        scrapy.utils.log.configure_logging(settings)
+
+        self._runner = scrapy.crawler.CrawlerRunner(settings)
+        self._exporter = Exporter(self._config, self._output_directory, self._database)
+
+        logging.info("Starting daemon: one crawl of %d pages every %d seconds", self._page_count, self._interval)
+        loop = task.LoopingCall(self.cycle)
+        loop.start(self._interval, now=True)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
+        reactor.run()  # it blocks here until stopped
+
+    def shutdown(self):
+        logging.info("Stopping daemon")
+        self.report()
+        self._database.dispose()
+
+    def report(self):
+        self._metrics.log()
+        if self._health_file:
+            self._metrics.write(self._health_file)
+
+    def cycle(self):
+        """
+        Errors are logged and counted, as they would stop the looping call for good
+        """
+        try:
+            self.start_crawl()
+        except Exception as exception:
+            logging.exception("Cycle failed")
+            self._metrics.record_cycle_failure(exception)
+
+    def start_crawl(self):
+        from ..scraper.spiders import SmuttySpider
+
+        self._metrics.cycles += 1
+        if self._crawling:
+            logging.info("Previous crawl still running, skipping cycle")
+            self._metrics.skipped_cycles += 1
+            self.report()
+            return
+
+        # a finished run restarts from the newest page
+        current_scraper_page = self._current_scraper_page_state.get()
+        if current_scraper_page is None or current_scraper_page == 0:
+            self._current_scraper_page_state.set(1)
+
+        crawler = self._runner.create_crawler(SmuttySpider)
+        self._crawling = True
+        try:
+            deferred = self._runner.crawl(crawler)
+        except Exception:
+            self._crawling = False
+            raise
+        deferred.addCallback(self.crawl_finished, crawler, time.time())
+        deferred.addErrback(self.crawl_failed)
+        deferred.addBoth(self.export_if_needed)
+
+    def crawl_finished(self, _, crawler, started_at):
+        pages = crawler.stats.get_value('response_received_count', 0)
+        items = crawler.stats.get_value('item_scraped_count', 0)
+        self._metrics.record_crawl(started_at, pages, items)
+
+    def crawl_failed(self, failure):
+        logging.error("Crawl failed: %s", failure.getErrorMessage())
+        self._metrics.record_crawl_failure(failure.getErrorMessage())
+
+    def export_if_needed(self, _):
+        from twisted.internet import threads
+
+        self._crawling = False
+        if self._exporting:
+            self.report()
+            return
+        # blocking work runs off the reactor thread, crawls go on meanwhile
+        self._exporting = True
+        deferred = threads.deferToThread(self.export, time.time())
+        deferred.addErrback(self.export_failed)
+        deferred.addBoth(self.export_done)
+
+    def export(self, started_at):
+        """
+        Exports ranges finalized by the scraper, if any
+        """
+        intervals = self._exporter.plan()
+        if not intervals:
+            return
+        self._exporter.export(intervals)
+        self._metrics.record_export(started_at, intervals[-1].max_id)
+
+    def export_failed(self, failure):
+        logging.error("Export failed: %s", failure.getErrorMessage())
+        self._metrics.record_export_failure(failure.getErrorMessage())
+
+    def export_done(self, _):
+        self._exporting = False
+        self.report()
@@ -0,0 +1,79 @@
+import json
+import logging
+import time
+
+from ..filetools import FinalizedTempFile
+
+
+class DaemonMetrics:
+    """
+    Health and throughput counters of a long-running daemon
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.cycles = 0
+        self.skipped_cycles = 0
+        self.cycle_failures = 0
+        self.crawls = 0
+        self.crawl_failures = 0
+        self.pages = 0
+        self.items = 0
+        self.last_crawl_at = None
+        self.last_crawl_duration = None
+        self.last_crawl_items_per_second = None
+        self.exports = 0
+        self.export_failures = 0
+        self.last_export_at = None
+        self.last_export_duration = None
+        self.last_exported_id = None
+        self.last_error = None
+
+    def __repr__(self):
+        return "{0}({cycles}, {crawls}, {exports})".format(self.__class__.__name__, **self.__dict__)
+
+    def record_cycle_failure(self, error):
+        self.cycle_failures += 1
+        self.last_error = str(error)
+
+    def record_crawl(self, started_at, pages, items):
+        now = time.time()
+        duration = now - started_at
+        self.crawls += 1
+        self.pages += pages
+        self.items += items
+        self.last_crawl_at = now
+        self.last_crawl_duration = duration
+        self.last_crawl_items_per_second = items / duration if duration > 0 else None
+
+    def record_crawl_failure(self, error):
+        self.crawl_failures += 1
+        self.last_error = str(error)
+
+    def record_export(self, started_at, exported_id):
+        now = time.time()
+        self.exports += 1
+        self.last_export_at = now
+        self.last_export_duration = now - started_at
+        self.last_exported_id = exported_id
+
+    def record_export_failure(self, error):
+        self.export_failures += 1
+        self.last_error = str(error)
+
+    def as_dict(self):
+        result = {**self.__dict__}
+        result["uptime"] = time.time() - self.started_at
+        return result
+
+    def log(self, logger=None):
+        logger = logger or logging.getLogger('')
+        logger.info("Daemon metrics: uptime=%.0fs cycles=%d skipped=%d (failed %d) crawls=%d (failed %d) pages=%d "
+                    "items=%d last_crawl=%s items/s exports=%d (failed %d) last_exported_id=%s",
+                    time.time() - self.started_at, self.cycles, self.skipped_cycles, self.cycle_failures, self.crawls,
+                    self.crawl_failures, self.pages, self.items, self.last_crawl_items_per_second,
+                    self.exports, self.export_failures, self.last_exported_id)
+
+    def write(self, file_name):
+        with FinalizedTempFile(file_name, "wt") as tmp_fileobj:
+            json.dump(self.as_dict(), tmp_fileobj, sort_keys=True, indent=4)
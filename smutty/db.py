@@ -1,8 +1,23 @@
+import configparser
+import contextlib
+
 import sqlalchemy
+import sqlalchemy.orm
+
+from .exceptions import SmuttyException
 
 
 class DatabaseConfiguration:
 
+    # optional engine settings, with their parsers
+    POOL_OPTIONS = {
+        'pool_size': int,
+        'max_overflow': int,
+        'pool_recycle': int,
+        'pool_timeout': int,
+        'pool_pre_ping': lambda value: configparser.ConfigParser.BOOLEAN_STATES[value.lower()],
+    }
+
     def __init__(self, config_section):
         # read provided configuration
         self._dialect = config_section['dialect']
@@ -11,6 +26,15 @@ class DatabaseConfiguration:
         self._host = config_section['host']
         self._port = int(config_section['port'])
         self._database = config_section['database']
+        # only explicitly configured pool settings are forwarded to the engine
+        self._engine_options = {}
+        for key, parser in self.POOL_OPTIONS.items():
+            if key not in config_section:
+                continue
+            try:
+                self._engine_options[key] = parser(config_section[key])
+            except (KeyError, ValueError) as exception:
+                raise SmuttyException("Invalid value for database setting {0}: {1}".format(key, exception))
 
     @property
     def url(self):
@@ -23,21 +47,73 @@ class DatabaseConfiguration:
             database=self._database
         )
 
+    @property
+    def engine_options(self):
+        # isolate returned value from original
+        return {**self._engine_options}
+
 
 class DatabaseSession:
 
-    def __init__(self, url):
+    @classmethod
+    def from_config(cls, config):
+        from .querystats import QueryProfiler
+
+        database_configuration = DatabaseConfiguration(config.get('database'))
+        return cls(database_configuration.url,
+                   database_configuration.engine_options,
+                   QueryProfiler.from_config(config))
+
+    def __init__(self, url, engine_options=None, profiler=None):
         self._url = url
+        self._profiler = profiler
 
-        # initialize engine, session class, and shared session
-        self._engine = sqlalchemy.create_engine(self._url)
+        # initialize pooled engine, session class, and per-thread session registry
+        self._engine = sqlalchemy.create_engine(self._url, **(engine_options or {}))
+        if self._profiler is not None:
+            self._profiler.attach(self._engine)
         self._session_factory = sqlalchemy.orm.sessionmaker(bind=self._engine)
-        self._session = self._session_factory()
+        self._session_registry = sqlalchemy.orm.scoped_session(self._session_factory)
+
+    def __deepcopy__(self, memo):
+        # scrapy copies its settings, the connection pool must stay shared
+        return self
 
     @property
     def session(self):
-        return self._session
+        """
+        Session bound to the calling thread
+        """
+        return self._session_registry()
 
     @property
     def engine(self):
         return self._engine
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @contextlib.contextmanager
+    def unit_of_work(self):
+        """
+        Commits the calling thread session on success, rolls it back otherwise
+        The session is kept for reuse, its connection returns to the pool once done
+        """
+        session = self.session
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def release(self):
+        """
+        Closes the calling thread session, and returns its connection to the pool
+        """
+        self._session_registry.remove()
+
+    def dispose(self):
+        self.release()
+        self._engine.dispose()
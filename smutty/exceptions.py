@@ -1,2 +1,6 @@
 class SmuttyException(Exception):
     pass
+
+
+class QueryBudgetExceeded(SmuttyException):
+    pass
@@ -1,19 +1,12 @@
 import argparse
 import logging
 import sys
-
-import sqlalchemy
+import time
 
 from ..config import ConfigurationFile
-from ..db import DatabaseConfiguration, DatabaseSession
 from ..exceptions import SmuttyException
-from ..filetools import IntegerStateFile, MustExistDirectory
-from ..models import Item, create_all_tables
 
-from .indexers import LzmaJsonIndexer
-from .packages import ImagePackage, VideoPackage
-from .segments import Interval, Block
-from .serializers import LzmaJsonlPackageSerializer
+from .exporters import Exporter
 
 
 class App:
@@ -27,108 +20,59 @@ class App:
         parser.add_argument("-i", "--index-only", action='store_true', default=False)
         parser.add_argument("-m", dest="min_id", type=int)
         parser.add_argument("-M", dest="max_id", type=int)
+        parser.add_argument("--verify", action='store_true', default=False,
+                            help="check packages against their digest and the database, instead of exporting")
+        parser.add_argument("-j", "--jobs", type=int, help="processes used for verification")
+        parser.add_argument("--archive", action='store_true', default=False,
+                            help="merge old packages into bundles, instead of exporting")
+        parser.add_argument("--stream", action='store_true', default=False,
+                            help="write files generated by the run to stdout, as a tar stream")
         parser.add_argument("config", metavar="CONFIG", nargs='?', default=ConfigurationFile.DEFAULT_CONFIG_FILE)
         args = parser.parse_args()
 
         # load configuration
         self._config = ConfigurationFile(args.config)
 
-        # setup state files
-        self._highest_exporter_id_state = IntegerStateFile(self._config.get('exporter', 'highest_exporter_id'))
-        self._lowest_exporter_id_state = IntegerStateFile(self._config.get('exporter', 'lowest_exporter_id'))
-        self._lowest_scraper_id_state = IntegerStateFile(self._config.get('scraper', 'lowest_scraper_id'))
-
-        # prepare target directory
-        output_directory = args.output or self._config.get('exporter', 'output_directory')
-        self._output_directory = MustExistDirectory(output_directory)
-        logging.info("Output directory is %s", self._output_directory)
-        self._indexer = LzmaJsonIndexer(self._output_directory, "wb")
-        self._serializer = LzmaJsonlPackageSerializer(self._output_directory, "wb")
-
-        # prepare database
-        database_url = DatabaseConfiguration(self._config.get('database')).url
-        self._database = DatabaseSession(database_url)
-        create_all_tables(self._database.engine)
-
-        # exporter limits
-        self._exporter_max_id = args.max_id or self._highest_exporter_id_state.get()
-        self._exporter_min_id = args.min_id or self._lowest_exporter_id_state.get()
-        logging.info("Exporter current state limits : min_id=%s max_id=%s", self._exporter_min_id, self._exporter_max_id)
-        if bool(self._exporter_min_id) ^ bool(self._exporter_max_id):
-            raise SmuttyException("Either both exporter limits (or none !) should be specified")
-        if self._exporter_min_id and self._exporter_max_id and self._exporter_min_id > self._exporter_max_id:
-            raise SmuttyException("Exporter limits must respect min <= max")
-
-        # scraper limits
-        self._lowest_scraper_id = self._lowest_scraper_id_state.get()
-        logging.info("Scraper current finished limit : min_id=%s", self._lowest_scraper_id)
-        if self._lowest_scraper_id is None:
-            logging.info("No scrap was finished, nothing to do: exiting")
-            sys.exit(0)
-
-        # database limits
-        self._database_min_id, database_max_id = self.get_database_min_max_id()
-        logging.info("Database current state limits : min_id=%s max_id=%s", self._database_min_id, database_max_id)
-        if self._database_min_id is None or database_max_id is None:
-            logging.info("Nothing in database, nothing to do: exiting")
-            sys.exit(0)
-
-        # cross validations
-        if self._exporter_min_id and self._exporter_min_id < self._database_min_id:
-            raise SmuttyException("Exporter low limit cannot be lower than database lower bound")
-        if self._exporter_max_id and self._exporter_max_id > self._lowest_scraper_id:
-            raise SmuttyException("Exporter high limit cannot be higher than scraper lower bound")
-
-        # intervalss to process
-        self._intervals = []
-
-        # export everything and return if nothing was exported so far
-        if self._exporter_min_id is None or self._exporter_max_id is None:
-            logging.info("No exporter state available, exporting everything scraper produced")
-            whole_range = Interval(self._database_min_id, self._lowest_scraper_id)
-            self._intervals.append(whole_range)
+        # decide what to export
+        self._exporter = Exporter(self._config, args.output)
+        self._verify = args.verify
+        self._jobs = args.jobs
+        self._archive = args.archive
+        self._stream = args.stream
+        if self._verify or self._archive:
             return
+        self._intervals = self._exporter.plan(args.min_id, args.max_id)
 
-        # here the situation is expected to be
-        assert self._database_min_id <= self._exporter_min_id <= self._exporter_max_id <= self._lowest_scraper_id
+    def run(self):
+        if self._verify:
+            stale = self._exporter.verify(self._jobs)
+            # one line per block to export again, for scripts
+            for content_type, block in stale:
+                print(content_type, block.min_id, block.max_id)
+            if stale:
+                sys.exit(1)
+            return
 
-        # low boundary expansion (exported vs db)
-        if self._database_min_id < self._exporter_min_id:
-            lower_range = Interval(self._database_min_id, self._exporter_min_id - 1)
-            self._intervals.append(lower_range)
-            logging.info("Queuing lower range expansion %s", lower_range)
+        start = time.time()
+        self.generate()
+        # an empty stream still is a valid tar file
+        if self._stream:
+            self._exporter.stream(start, sys.stdout.buffer)
 
-        # high boundary expansion (exported vs scraped)
-        if self._exporter_max_id < self._lowest_scraper_id:
-            higher_range = Interval(self._exporter_max_id + 1, self._lowest_scraper_id)
-            self._intervals.append(higher_range)
-            logging.info("Queuing higher range expansion %s", higher_range)
+        # budgets are per run, the daemon runs exports for as long as it lives
+        if self._exporter.profiler is not None:
+            self._exporter.profiler.check_budgets()
 
-    def get_database_min_max_id(self):
-        result = self._database.session.query(
-            sqlalchemy.func.min(Item.item_id).label('min_id'),
-            sqlalchemy.func.max(Item.item_id).label('max_id'),
-        ).one()
-        return (result.min_id, result.max_id)
+    def generate(self):
+        if self._archive:
+            self._exporter.archive()
+            return
 
-    def run(self):
         if not self._intervals:
             logging.info("Nothing to export, exiting")
             return
 
-        # serialize items into packages
-        for interval in self._intervals:
-            logging.info("Exporting %s", interval)
-            for block in Block.blocks_covering_interval(interval):
-                self._serializer.serialize(ImagePackage(block), self._database.session)
-                self._serializer.serialize(VideoPackage(block), self._database.session)
-
-        # store progress in state files
-        self._highest_exporter_id_state.set(self._lowest_scraper_id)
-        self._lowest_exporter_id_state.set(self._database_min_id)
-
-        # build index
-        self._indexer.generate()
+        self._exporter.export(self._intervals)
 
 
 def main():
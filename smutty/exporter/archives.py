@@ -0,0 +1,205 @@
+import collections
+import json
+import logging
+import lzma
+import re
+import time
+
+from ..compression import LzmaCompression
+from ..filetools import FinalizedTempFile
+
+from .indexers import LzmaJsonIndexer
+from .segments import Interval, Block
+
+
+def load_manifest(bundle_path):
+    with open(bundle_path + ArchiveBundler.MANIFEST_SUFFIX, "rt") as file_obj:
+        return json.load(file_obj)["members"]
+
+
+class ArchiveBundler:
+    """
+    Merges packages of closed blocks, untouched for some time, into bundles spanning
+    many blocks and compressed as a single stream, which compresses better and keeps
+    the number of files low. A manifest sidecar locates every member package in the
+    decompressed bundle, so that index entries can reference it
+    Sidecars of member packages are retired along with them, except the kept ones
+    (bloom filters for example), which remain valid for bundled packages
+    """
+
+    FILE_PATTERN = r"^bundle-(?P<min_id>[0-9]+)-(?P<max_id>[0-9]+)-(?P<hash_digest>[0-9a-f]+)\.jsonl\.xz$"
+
+    MANIFEST_SUFFIX = ".manifest.json"
+
+    DEFAULT_BUNDLE_BLOCKS = 100
+
+    # decompressed bytes copied at once into the bundle
+    COPY_SIZE = 1024 * 1024
+
+    def __init__(self, destination_directory, file_mode, max_age_days, bundle_blocks=DEFAULT_BUNDLE_BLOCKS,
+                 kept_suffixes=()):
+        self._destination_directory = destination_directory
+        self._file_mode = file_mode
+        self._max_age = max_age_days * 24 * 3600
+        self._bundle_size = bundle_blocks * Block.SIZE
+        self._kept_suffixes = tuple(kept_suffixes)
+
+    def __repr__(self):
+        return "{0}({_destination_directory}, {_max_age}, {_bundle_size})".format(
+            self.__class__.__name__, **self.__dict__)
+
+    def bundle_interval(self, item_id):
+        min_id = item_id - item_id % self._bundle_size
+        return Interval(min_id, min_id + self._bundle_size - 1)
+
+    def _bundle_path(self, interval, hash_digest):
+        bundle_name = "bundle-{0}-{1}-{2}.jsonl.xz".format(interval.min_id, interval.max_id, hash_digest)
+        return self._destination_directory.path / bundle_name
+
+    def bundles(self):
+        """
+        Returns (bundle file, members) per bundle interval
+        """
+        pattern = re.compile(self.FILE_PATTERN)
+        result = {}
+        for bundle_file in self._destination_directory.path.files("bundle-*"):
+            match = pattern.fullmatch(bundle_file.name)
+            if match:
+                interval = Interval(int(match.group('min_id')), int(match.group('max_id')))
+                result[interval] = (bundle_file, load_manifest(bundle_file))
+        return result
+
+    def eligible_packages(self, closed_max_id):
+        """
+        Full packages of closed blocks, older than the configured age
+        """
+        pattern = re.compile(LzmaJsonIndexer.package_pattern())
+        oldest_mtime = time.time() - self._max_age
+        result = []
+        for package_file in self._destination_directory.path.files():
+            match = pattern.fullmatch(package_file.name)
+            if not match:
+                continue
+            block = Block.containing(int(match.group('min_id')))
+            closed = block.max_id <= closed_max_id
+            full = block == Interval(int(match.group('min_id')), int(match.group('max_id')))
+            if closed and full and package_file.mtime < oldest_mtime:
+                result.append((package_file, {
+                    "file_name": package_file.name,
+                    "content_type": match.group('content_type'),
+                    "min_id": block.min_id,
+                    "max_id": block.max_id,
+                    "hash_digest": match.group('hash_digest'),
+                }))
+        return result
+
+    def _copy(self, source, destination, length=None):
+        """
+        Copies by chunks, up to the given length if any
+        Returns the length copied
+        """
+        copied = 0
+        while length is None or copied < length:
+            chunk = source.read(self.COPY_SIZE if length is None else min(self.COPY_SIZE, length - copied))
+            if not chunk:
+                break
+            destination.write(chunk)
+            copied += len(chunk)
+        return copied
+
+    def write_bundle(self, interval, packages, previous=None):
+        """
+        Writes a bundle made of the given packages, and of members of the previous
+        bundle of the same interval which they do not replace
+        Members are streamed from their files, never held in memory as a whole
+        """
+        # (info, package file), the file being None for members of the previous bundle
+        members = []
+        replaced = {(info["content_type"], info["min_id"]) for _, info in packages}
+        if previous is not None:
+            members.extend((member, None) for member in previous[1]
+                           if (member["content_type"], member["min_id"]) not in replaced)
+        members.extend((info, package_file) for package_file, info in packages)
+        members.sort(key=lambda member: (member[0]["min_id"], member[0]["content_type"]))
+
+        # content is hashed while written, members sharing one compression context
+        temp_file = FinalizedTempFile(self._bundle_path(interval, "INTERMEDIATE"), self._file_mode, hashed=True)
+        manifest = []
+        offset = 0
+        with temp_file as tmp_fileobj:
+            with LzmaCompression(tmp_fileobj, self._file_mode) as lzma_fileobj:
+                previous_data = lzma.open(previous[0], "rb") if previous is not None else None
+                try:
+                    for info, package_file in members:
+                        if package_file is None:
+                            # kept in bundle order, so that the previous bundle is only read forward
+                            previous_data.seek(info["offset"])
+                            length = self._copy(previous_data, lzma_fileobj, info["length"])
+                        else:
+                            with lzma.open(package_file, "rb") as package_data:
+                                length = self._copy(package_data, lzma_fileobj)
+                        manifest.append({
+                            # names the kept sidecars, missing from members of older bundles
+                            "file_name": info.get("file_name"),
+                            "content_type": info["content_type"],
+                            "min_id": info["min_id"],
+                            "max_id": info["max_id"],
+                            "hash_digest": info["hash_digest"],
+                            "offset": offset,
+                            "length": length,
+                        })
+                        offset += length
+                finally:
+                    if previous_data is not None:
+                        previous_data.close()
+            bundle_path_final = self._bundle_path(interval, tmp_fileobj.hexdigest())
+            temp_file.final_path = bundle_path_final
+            # manifest first, so that a bundle is never without it
+            with FinalizedTempFile(bundle_path_final + self.MANIFEST_SUFFIX, "wt") as manifest_fileobj:
+                json.dump({"members": manifest}, manifest_fileobj, sort_keys=True)
+        logging.info("Generated bundle file %s holding %d packages", bundle_path_final, len(manifest))
+        return bundle_path_final
+
+    def replaced_sidecars(self, previous_members, packages):
+        """
+        Kept sidecars of previous bundle members, which the given packages replace
+        """
+        replaced = {(info["content_type"], info["min_id"]) for _, info in packages}
+        package_names = {package_file.name for package_file, _ in packages}
+        result = []
+        for member in previous_members:
+            if (member["content_type"], member["min_id"]) not in replaced or not member.get("file_name"):
+                continue
+            if member["file_name"] in package_names:
+                continue
+            for suffix in self._kept_suffixes:
+                sidecar = self._destination_directory.path / (member["file_name"] + suffix)
+                if sidecar.exists():
+                    result.append(sidecar)
+        return result
+
+    def archive(self, closed_max_id):
+        """
+        Returns files superseded by bundles, which must only be removed once
+        the index does not reference them anymore
+        """
+        bundles = self.bundles()
+        pending = collections.defaultdict(list)
+        for package_file, info in self.eligible_packages(closed_max_id):
+            pending[self.bundle_interval(info["min_id"])].append((package_file, info))
+
+        retired = []
+        for interval in sorted(pending, key=lambda interval: interval.min_id):
+            packages = pending[interval]
+            previous = bundles.get(interval)
+            bundle_file = self.write_bundle(interval, packages, previous)
+            for package_file, _ in packages:
+                retired.append(package_file)
+                retired.extend(sidecar for sidecar in self._destination_directory.path.files(
+                    "{0}.*".format(package_file.name)) if not sidecar.name.endswith(self._kept_suffixes))
+            if previous is not None:
+                retired.extend(self.replaced_sidecars(previous[1], packages))
+            if previous is not None and previous[0] != bundle_file:
+                retired.extend([previous[0], previous[0] + self.MANIFEST_SUFFIX])
+        logging.info("%d files retired by bundles", len(retired))
+        return retired
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import re
+
+from ..filetools import FinalizedTempFile, md5_file
+
+from .indexers import Indexer
+
+
+class ExportCheckpoint:
+    """
+    Package files written per block by an export run which did not complete yet,
+    so that a restarted run skips blocks already done, unless items were stored
+    into them meanwhile (by a backfill for example), as told by their item count
+    Final states and index are only written once the whole run is over
+    """
+
+    VERSION = 2
+
+    def __init__(self, file_name, destination_directory):
+        self.file_name = file_name
+        self._destination_directory = destination_directory
+        self._blocks = {}
+
+    def __repr__(self):
+        return "{0}({1}, {2} blocks)".format(self.__class__.__name__, self.file_name, len(self._blocks))
+
+    def load(self):
+        try:
+            with open(self.file_name, "rt") as file_obj:
+                data = json.load(file_obj)
+        except FileNotFoundError:
+            return
+        if data.get("version") != self.VERSION:
+            logging.warning("Unsupported checkpoint version %s, ignoring it", data.get("version"))
+            return
+        self._blocks = data["blocks"]
+        logging.info("Resuming from checkpoint %s holding %d blocks", self.file_name, len(self._blocks))
+
+    def save(self):
+        with FinalizedTempFile(self.file_name, "wt") as tmp_fileobj:
+            json.dump({"version": self.VERSION, "blocks": self._blocks}, tmp_fileobj, sort_keys=True)
+
+    def delete(self):
+        logging.debug("Deleting checkpoint %s", self.file_name)
+        self._blocks = {}
+        try:
+            os.remove(self.file_name)
+        except FileNotFoundError:
+            pass
+
+    def verify_file(self, file_name):
+        """
+        Package file is present and matches the digest in its name
+        """
+        match = re.match(Indexer.PACKAGE_PATTERN, file_name)
+        path = self._destination_directory.path / file_name
+        return match is not None and path.exists() and md5_file(path) == match.group('hash_digest')
+
+    def has_block(self, block):
+        return str(block.min_id) in self._blocks
+
+    def is_done(self, block, max_id, item_count):
+        """
+        Block was exported up to the same id with as many items, and its package files are intact
+        """
+        entry = self._blocks.get(str(block.min_id))
+        if entry is None or entry["max_id"] != max_id or entry["item_count"] != item_count:
+            return False
+        return all(self.verify_file(file_name) for file_name in entry["files"])
+
+    def record(self, block, max_id, item_count, package_files):
+        self._blocks[str(block.min_id)] = {
+            "max_id": max_id,
+            "item_count": item_count,
+            "files": sorted(package_file.name for package_file in package_files),
+        }
+        self.save()
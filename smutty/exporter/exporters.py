@@ -0,0 +1,408 @@
+import logging
+import re
+
+from .. import profiling
+from ..exceptions import SmuttyException
+from ..filetools import IntegerStateFile, ItemIdsStateFile, MustExistDirectory
+from ..querystats import profiled_stage
+
+from .archives import ArchiveBundler, load_manifest
+from .checkpoints import ExportCheckpoint
+from .indexers import LzmaJsonIndexer, ShardedIndexWriter
+from .segments import Interval, Block, merge_intervals
+from .serializers import FanOutPackageSerializer, LzmaJsonlPackageSerializer, SeekableLzmaJsonlPackageSerializer
+from .statistics import TagStatistics
+from .streams import stream_files
+from .views import SubmitterViews
+from .verifiers import PackageVerifier
+
+# sqlalchemy and models are only imported once there is work to do,
+# so that no-op invocations (from cron) stay cheap
+
+
+class Exporter:
+    """
+    Plans and performs exports, based on exporter and scraper states
+    The database is only opened when states show there is something to export
+    """
+
+    DEFAULT_MAX_DELTA_PACKAGES = 16
+
+    def __init__(self, config, output_directory=None, database=None):
+        self._config = config
+
+        # setup state files
+        self._highest_exporter_id_state = IntegerStateFile(self._config.get('exporter', 'highest_exporter_id'))
+        self._lowest_exporter_id_state = IntegerStateFile(self._config.get('exporter', 'lowest_exporter_id'))
+        self._lowest_scraper_id_state = IntegerStateFile(self._config.get('scraper', 'lowest_scraper_id'))
+        self._lowest_item_id_state = None
+        if self._config.get('database').get('lowest_item_id'):
+            self._lowest_item_id_state = IntegerStateFile(self._config.get('database').get('lowest_item_id'))
+        # items changed by refresh runs, their blocks are exported again
+        self._refreshed_items = None
+        if self._config.get('scraper').get('refreshed_items'):
+            self._refreshed_items = ItemIdsStateFile(self._config.get('scraper').get('refreshed_items'))
+        self._refreshed_blocks = set()
+        self._refreshed_submitters = set()
+
+        self._output_directory_name = output_directory or self._config.get('exporter', 'output_directory')
+        self._output_directory = None
+        self._indexer = None
+        self._serializer = None
+        self._tag_statistics = None
+        self._submitter_views = None
+        self._archive_bundler = None
+        self._with_tag_statistics = self._config.get_boolean('exporter', 'tag_statistics')
+        self._max_delta_packages = self._config.get_integer('exporter', 'max_delta_packages',
+                                                            self.DEFAULT_MAX_DELTA_PACKAGES)
+        self._seekable_frame_lines = self._config.get_integer('exporter', 'seekable_frame_lines', 0)
+        self._additional_formats = self._config.get('exporter').get('additional_formats', '').split()
+        self._checkpoint_file = self._config.get('exporter').get('checkpoint_file')
+        self._compact_encoding = self._config.get_boolean('exporter', 'compact_encoding')
+        self._bloom_false_positive_rate = self._config.get_float('exporter', 'bloom_false_positive_rate', 0)
+        self._submitter_buckets = self._config.get_integer('exporter', 'submitter_buckets', 0)
+        self._archive_after_days = self._config.get_integer('exporter', 'archive_after_days', 0)
+        self._archive_bundle_blocks = self._config.get_integer('exporter', 'archive_bundle_blocks',
+                                                               ArchiveBundler.DEFAULT_BUNDLE_BLOCKS)
+        self._index_shard_blocks = self._config.get_integer('exporter', 'index_shard_blocks', 0)
+        self._flat_index = self._config.get_boolean('exporter', 'flat_index', True)
+
+        self._database = database
+        self._database_min_id = None
+        self._lowest_scraper_id = None
+
+    def __repr__(self):
+        return "{0}({_output_directory_name})".format(self.__class__.__name__, **self.__dict__)
+
+    @property
+    def database(self):
+        if self._database is None:
+            from ..db import DatabaseSession
+            from ..models import ensure_all_tables
+
+            self._database = DatabaseSession.from_config(self._config)
+            ensure_all_tables(self._database.engine, self._config.get('database').get('schema_version'))
+        return self._database
+
+    @property
+    def profiler(self):
+        # runs with nothing to do never connect, nor have anything to report
+        if self._database is None:
+            return None
+        return self._database.profiler
+
+    def prepare_output(self):
+        if self._output_directory is not None:
+            return
+        self._output_directory = MustExistDirectory(self._output_directory_name)
+        logging.info("Output directory is %s", self._output_directory)
+        self._indexer = LzmaJsonIndexer(self._output_directory, "wb")
+        if self._index_shard_blocks:
+            self._indexer.attach_shards(ShardedIndexWriter(self._output_directory, self._index_shard_blocks),
+                                        self._flat_index)
+        if self._seekable_frame_lines:
+            primary = SeekableLzmaJsonlPackageSerializer(self._output_directory, "wb", self._seekable_frame_lines,
+                                                         self._compact_encoding)
+            self._indexer.attach_sidecar("frames", SeekableLzmaJsonlPackageSerializer.FRAMES_SUFFIX)
+        else:
+            primary = LzmaJsonlPackageSerializer(self._output_directory, "wb", self._compact_encoding)
+        # other formats are written from the same items, next to indexed packages
+        additional = []
+        for format_name in self._additional_formats:
+            serializer = FanOutPackageSerializer.additional_serializer(format_name, self._output_directory, "wb")
+            self._indexer.ignore_files(r".*{0}$".format(re.escape(serializer.FILE_EXTENSION)))
+            additional.append(serializer)
+        self._serializer = FanOutPackageSerializer(primary, additional, self._bloom_false_positive_rate)
+        self._indexer.attach_sidecar("bloom", FanOutPackageSerializer.BLOOM_SUFFIX)
+        self._tag_statistics = TagStatistics(self._output_directory, "wb")
+        self._indexer.ignore_files(TagStatistics.FILE_PATTERN)
+        # bundles are always indexed, even once archiving is disabled
+        self._indexer.attach_bundles(ArchiveBundler.FILE_PATTERN, load_manifest)
+        if self._archive_after_days:
+            self._archive_bundler = ArchiveBundler(self._output_directory, "wb", self._archive_after_days,
+                                                   self._archive_bundle_blocks, [FanOutPackageSerializer.BLOOM_SUFFIX])
+        if self._submitter_buckets:
+            self._submitter_views = SubmitterViews(self._output_directory, self._submitter_buckets,
+                                                   self._compact_encoding)
+
+    def plan(self, min_id=None, max_id=None):
+        """
+        Returns intervals to export, which is empty when there is nothing to do
+        """
+        # exporter limits
+        exporter_max_id = max_id or self._highest_exporter_id_state.get()
+        exporter_min_id = min_id or self._lowest_exporter_id_state.get()
+        logging.info("Exporter current state limits : min_id=%s max_id=%s", exporter_min_id, exporter_max_id)
+        if bool(exporter_min_id) ^ bool(exporter_max_id):
+            raise SmuttyException("Either both exporter limits (or none !) should be specified")
+        if exporter_min_id and exporter_max_id and exporter_min_id > exporter_max_id:
+            raise SmuttyException("Exporter limits must respect min <= max")
+
+        # scraper limits
+        self._lowest_scraper_id = self._lowest_scraper_id_state.get()
+        logging.info("Scraper current finished limit : min_id=%s", self._lowest_scraper_id)
+        if self._lowest_scraper_id is None:
+            logging.info("No scrap was finished, nothing to do")
+            return []
+
+        # no scrap finished since last export, nothing stored below the exported range
+        # (by a backfill for example), and nothing refreshed, decided from states only
+        if min_id is None and max_id is None and exporter_max_id == self._lowest_scraper_id \
+                and self.nothing_below(exporter_min_id) and not self.refreshed_pending():
+            logging.info("Export is up to date with last finished scrap, nothing to do")
+            return []
+
+        # prepare target directory
+        self.prepare_output()
+
+        # the session is released whatever the outcome, export uses its own
+        try:
+            return self.plan_from_database(exporter_min_id, exporter_max_id)
+        finally:
+            self.database.release()
+
+    def plan_from_database(self, exporter_min_id, exporter_max_id):
+        """
+        Returns intervals to export, given exporter limits and database ones
+        """
+        # database limits
+        self._database_min_id, database_max_id = self.get_database_min_max_id()
+        logging.info("Database current state limits : min_id=%s max_id=%s", self._database_min_id, database_max_id)
+        if self._lowest_item_id_state is not None and self._database_min_id is not None:
+            self._lowest_item_id_state.set(self._database_min_id)
+        if self._database_min_id is None or database_max_id is None:
+            logging.info("Nothing in database, nothing to do")
+            return []
+
+        # cross validations
+        if exporter_min_id and exporter_min_id < self._database_min_id:
+            raise SmuttyException("Exporter low limit cannot be lower than database lower bound")
+        if exporter_max_id and exporter_max_id > self._lowest_scraper_id:
+            raise SmuttyException("Exporter high limit cannot be higher than scraper lower bound")
+
+        # intervalss to process
+        intervals = []
+
+        # export everything and return if nothing was exported so far
+        if exporter_min_id is None or exporter_max_id is None:
+            logging.info("No exporter state available, exporting everything scraper produced")
+            whole_range = Interval(self._database_min_id, self._lowest_scraper_id)
+            intervals.append(whole_range)
+            return intervals
+
+        # here the situation is expected to be
+        assert self._database_min_id <= exporter_min_id <= exporter_max_id <= self._lowest_scraper_id
+
+        # low boundary expansion (exported vs db)
+        if self._database_min_id < exporter_min_id:
+            lower_range = Interval(self._database_min_id, exporter_min_id - 1)
+            intervals.append(lower_range)
+            logging.info("Queuing lower range expansion %s", lower_range)
+
+        # high boundary expansion (exported vs scraped)
+        if exporter_max_id < self._lowest_scraper_id:
+            higher_range = Interval(exporter_max_id + 1, self._lowest_scraper_id)
+            intervals.append(higher_range)
+            logging.info("Queuing higher range expansion %s", higher_range)
+
+        # blocks of the exported range holding refreshed items, merged with expansions
+        # reaching into them so that they are written again as a whole
+        intervals.extend(self.refreshed_intervals(Interval(exporter_min_id, exporter_max_id)))
+        return merge_intervals(intervals)
+
+    def nothing_below(self, exporter_min_id):
+        """
+        Whether the cached lowest item id of the database shows nothing to export below the exported range
+        """
+        if self._lowest_item_id_state is None or exporter_min_id is None:
+            return False
+        lowest_item_id = self._lowest_item_id_state.get()
+        return lowest_item_id is not None and lowest_item_id >= exporter_min_id
+
+    def refreshed_pending(self):
+        return self._refreshed_items is not None and self._refreshed_items.pending()
+
+    def refreshed_intervals(self, exported):
+        """
+        Whole blocks, up to the scraper limit, of exported items changed by refresh runs since last export
+        Ids are released once the export is complete, or right away when there is no such block
+        """
+        if self._refreshed_items is None:
+            return []
+        blocks = {
+            Block.containing(item_id)
+            for item_id in self._refreshed_items.take()
+            if exported.min_id <= item_id <= exported.max_id
+        }
+        if not blocks:
+            self._refreshed_items.release()
+            return []
+        self._refreshed_blocks = {block.min_id for block in blocks}
+        # refreshed items may have moved to another submitter, or have been deleted
+        self._refreshed_submitters = self._refreshed_items.taken_submitters()
+        intervals = [Interval(block.min_id, min(block.max_id, self._lowest_scraper_id))
+                     for block in sorted(blocks, key=lambda block: block.min_id)]
+        logging.info("Queuing %d blocks holding refreshed items", len(intervals))
+        return intervals
+
+    def get_database_min_max_id(self):
+        import sqlalchemy
+
+        from ..models import Item
+
+        with profiled_stage(self.database.profiler, "limits query"):
+            result = self.database.session.query(
+                sqlalchemy.func.min(Item.item_id).label('min_id'),
+                sqlalchemy.func.max(Item.item_id).label('max_id'),
+            ).one()
+        return (result.min_id, result.max_id)
+
+    def block_item_count(self, block, max_id):
+        from ..models import Item
+
+        with profiled_stage(self.database.profiler, "checkpoint query"):
+            return self.database.session.query(Item.item_id).filter(
+                block.min_id <= Item.item_id,
+                Item.item_id <= max_id
+            ).count()
+
+    def verify(self, processes=None):
+        """
+        Returns (content type, block) keys of the exported range which need to be exported again
+        """
+        lowest_exporter_id = self._lowest_exporter_id_state.get()
+        highest_exporter_id = self._highest_exporter_id_state.get()
+        if lowest_exporter_id is None or highest_exporter_id is None:
+            logging.info("Nothing was exported yet, nothing to verify")
+            return []
+        self.prepare_output()
+        verifier = PackageVerifier(self._output_directory, processes)
+        with profiled_stage(self.database.profiler, "verification query"):
+            stale = verifier.verify(self.database.session, Interval(lowest_exporter_id, highest_exporter_id))
+        self.database.release()
+        return stale
+
+    def archive(self):
+        """
+        Merges old packages of the exported range into bundles, and only removes
+        them once a new index referencing bundles instead is written
+        """
+        self.prepare_output()
+        if self._archive_bundler is None:
+            raise SmuttyException("Archiving requires archive_after_days to be set in exporter section")
+        highest_exporter_id = self._highest_exporter_id_state.get()
+        if highest_exporter_id is None:
+            logging.info("Nothing was exported yet, nothing to archive")
+            return
+        retired = self._archive_bundler.archive(highest_exporter_id)
+        self._indexer.generate(retired)
+        for retired_file in retired:
+            logging.debug("Deleting retired file %s", retired_file)
+            retired_file.remove_p()
+
+    def stream(self, since, file_obj):
+        """
+        Sends files written since the given time as a tar stream, the index last
+        """
+        self.prepare_output()
+        return stream_files(self._output_directory, since, file_obj,
+                            {self._indexer.index_file_name(), ShardedIndexWriter.ROOT_NAME})
+
+    def export_package(self, package_class, block, interval, full=False):
+        """
+        Appends a delta package when the block is still open and already exported,
+        otherwise (re)writes the full block package, folding existing deltas into it
+        Full packages may be requested, when existing ones cannot be trusted
+        """
+        # never export items of a scrap which is not finished yet
+        exported = Interval(block.min_id, min(block.max_id, self._lowest_scraper_id))
+        full_package = package_class(block, exported)
+
+        closed = block.max_id <= self._lowest_scraper_id
+        covered = block.intersection(interval)
+        if full or closed or covered == exported or not self._serializer.has_full_package(full_package):
+            return self._serializer.serialize(full_package, self.database.session)
+
+        delta_count = len(self._serializer.delta_package_files(full_package))
+        if delta_count >= self._max_delta_packages:
+            logging.info("Compacting %d delta packages of %s", delta_count, full_package)
+            return self._serializer.serialize(full_package, self.database.session)
+
+        delta_package = package_class(block, covered.intersection(exported), delta=True)
+        if not delta_package.db_items(self.database.session).count():
+            logging.debug("No new item for %s, skipping", delta_package)
+            return None
+        return self._serializer.serialize(delta_package, self.database.session)
+
+    def export(self, intervals):
+        from .packages import ImagePackage, VideoPackage
+
+        checkpoint = None
+        if self._checkpoint_file:
+            checkpoint = ExportCheckpoint(self._checkpoint_file, self._output_directory)
+            checkpoint.load()
+
+        # serialize items into packages
+        for interval in intervals:
+            logging.info("Exporting %s", interval)
+            for block in Block.blocks_covering_interval(interval):
+                exported_max_id = min(block.max_id, self._lowest_scraper_id)
+                if checkpoint:
+                    item_count = self.block_item_count(block, exported_max_id)
+                # refreshed blocks may have been checkpointed before their items changed
+                refreshed = block.min_id in self._refreshed_blocks
+                if checkpoint and not refreshed and checkpoint.is_done(block, exported_max_id, item_count):
+                    logging.info("Block %s already exported according to checkpoint, skipping", block)
+                    continue
+                # packages written by the interrupted run may already hold part of the items
+                rewritten = checkpoint is not None and checkpoint.has_block(block)
+                profiling.set_unit("block {0}-{1}".format(block.min_id, block.max_id))
+                package_files = []
+                with profiled_stage(self.database.profiler, "package query"):
+                    for package_class in (ImagePackage, VideoPackage):
+                        package_file = self.export_package(package_class, block, interval, rewritten)
+                        if package_file is not None:
+                            package_files.append(package_file)
+                if checkpoint:
+                    checkpoint.record(block, exported_max_id, item_count, package_files)
+
+        # statistics only scan ranges they do not cover yet
+        if self._with_tag_statistics:
+            self._tag_statistics.load()
+            # items exported again may have been stored or changed since they were counted,
+            # counts cannot be amended, they are computed again
+            if self._tag_statistics.overlaps(intervals):
+                logging.info("Counted items are exported again, computing tag statistics from scratch")
+                self._tag_statistics.clear()
+            with profiled_stage(self.database.profiler, "tag statistics"):
+                self._tag_statistics.update(Interval(self._database_min_id, self._lowest_scraper_id),
+                                            self.database.session)
+            self._tag_statistics.save()
+
+        # views only rewrite buckets of submitters with new or refreshed items
+        if self._submitter_views is not None:
+            with profiled_stage(self.database.profiler, "submitter views"):
+                self._submitter_views.update(intervals, Interval(self._database_min_id, self._lowest_scraper_id),
+                                             self.database.session, self._refreshed_submitters)
+
+        # store progress in state files
+        self._highest_exporter_id_state.set(self._lowest_scraper_id)
+        self._lowest_exporter_id_state.set(self._database_min_id)
+
+        # build index, merging old packages into bundles beforehand
+        if self._archive_bundler is not None:
+            self.archive()
+        else:
+            self._indexer.generate()
+
+        # run is complete, next one starts from states
+        if checkpoint:
+            checkpoint.delete()
+        if self._refreshed_blocks:
+            self._refreshed_items.release()
+            self._refreshed_blocks = set()
+            self._refreshed_submitters = set()
+
+        if self.database.profiler is not None:
+            self.database.profiler.log_report()
+        self.database.release()
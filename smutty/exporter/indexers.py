@@ -1,9 +1,14 @@
+import collections
+import hashlib
 import json
 import logging
+import lzma
 import re
 
 from ..compression import LzmaCompression
-from ..filetools import FinalizedTempFile
+from ..filetools import FinalizedTempFile, MustExistDirectory
+
+from .segments import Block
 
 
 class Indexer:
@@ -16,6 +21,12 @@ class Indexer:
         self._destination_directory = destination_directory
         self._file_mode = file_mode
         self._package_info = []
+        self._ignored_patterns = []
+        self._sidecars = {}
+        self._bundle_pattern = None
+        self._bundle_members = None
+        self._flat = True
+        self._shards = None
 
     def __repr__(self):
         return "{0}({_destination_directory})".format(self.__class__.__name__, **self.__dict__)
@@ -40,12 +51,68 @@ class Indexer:
         """
         raise NotImplementedError()
 
-    def build_package_info(self):
+    def ignore_files(self, pattern):
+        """
+        Other artifacts living next to packages, which are not to be indexed
+        """
+        self._ignored_patterns.append(re.compile(pattern))
+
+    def attach_sidecar(self, key, suffix):
+        """
+        Files named after a package plus the suffix are referenced by the package entry
+        """
+        self._sidecars[key] = suffix
+        self.ignore_files(r".*{0}$".format(re.escape(suffix)))
+
+    def attach_bundles(self, pattern, load_members):
+        """
+        Packages merged into bundles are listed from bundle members,
+        package files of the same block taking precedence
+        """
+        self._bundle_pattern = re.compile(pattern)
+        self._bundle_members = load_members
+        self.ignore_files(r"^bundle-.*")
+
+    def attach_shards(self, shard_writer, flat=True):
+        """
+        A sharded index is written along, or instead of the flat one
+        """
+        self._shards = shard_writer
+        self._flat = flat
+
+    def bundle_package_info(self, excluded_files):
+        result = {}
+        for bundle_file in self._destination_directory.path.files("bundle-*"):
+            if bundle_file.name in excluded_files or not self._bundle_pattern.fullmatch(bundle_file.name):
+                continue
+            for member in self._bundle_members(bundle_file):
+                info = {name: str(member[name]) for name in ['content_type', 'min_id', 'max_id']}
+                info.update(
+                    hash_digest=member['hash_digest'],
+                    bundle=bundle_file.name,
+                    offset=member['offset'],
+                    length=member['length'],
+                )
+                # sidecars kept by bundling, such as bloom filters
+                file_name = member.get('file_name')
+                for key, suffix in self._sidecars.items():
+                    sidecar_name = "{0}{1}".format(file_name, suffix)
+                    if file_name and sidecar_name not in excluded_files \
+                            and (bundle_file.parent / sidecar_name).exists():
+                        info[key] = sidecar_name
+                result[(info['content_type'], info['min_id'])] = info
+        return result
+
+    def build_package_info(self, excluded_files=()):
         # build package info
         self._package_info = []
         pattern = re.compile(self.package_pattern())
         for package_file in self._destination_directory.path.files():
-            match = pattern.match(package_file.name)
+            if package_file.name in excluded_files:
+                continue
+            if any(ignored.match(package_file.name) for ignored in self._ignored_patterns):
+                continue
+            match = pattern.fullmatch(package_file.name)
             if not match:
                 logging.warning("Invalid package name %s, ignoring", package_file)
                 continue
@@ -53,7 +120,16 @@ class Indexer:
                 name: match.group(name)
                 for name in ['content_type', 'min_id', 'max_id', 'hash_digest']
             }
+            for key, suffix in self._sidecars.items():
+                sidecar_name = package_file.name + suffix
+                if (package_file.parent / sidecar_name).exists():
+                    info[key] = sidecar_name
             self._package_info.append(info)
+        if self._bundle_pattern is not None:
+            bundled = self.bundle_package_info(excluded_files)
+            for info in self._package_info:
+                bundled.pop((info['content_type'], info['min_id']), None)
+            self._package_info.extend(bundled.values())
         # sort entries according to hash (so that exporter runs are stable)
         self._package_info.sort(key=lambda x: x['hash_digest'])
         logging.info("%s packages found", len(self._package_info))
@@ -81,12 +157,18 @@ class Indexer:
             self.serialize_info(tmp_fileobj)
             logging.info("Generated index file %s", pkg_path)
 
-    def generate(self):
+    def generate(self, excluded_files=()):
+        """
+        Excluded files are about to be removed, and must not be referenced
+        """
         logging.info("Building index of packages")
         # clean index files before listing packages
         self.remove_existing_index_files()
-        self.build_package_info()
-        self.serialize()
+        self.build_package_info({file.name for file in excluded_files})
+        if self._flat:
+            self.serialize()
+        if self._shards is not None:
+            self._shards.write(self._package_info)
 
 
 class JsonIndexer(Indexer):
@@ -136,3 +218,66 @@ class LzmaJsonIndexer(JsonIndexer):
         """
         with LzmaCompression(file_obj, self._file_mode) as lzma_fileobj:
             self.serialize_index(lzma_fileobj)
+
+
+class ShardedIndexWriter:
+    """
+    Two-level index in a sub-directory: a root listing shards by id range, and shards
+    holding index entries of packages within their range of blocks
+    Shards are named after their hash, so that unchanged ones are neither written
+    nor downloaded again, and only the small root changes on every run
+    """
+
+    DIRECTORY = "shards"
+
+    ROOT_NAME = "root.json.xz"
+
+    FILE_PATTERN = r"^shard-(?P<min_id>[0-9]+)-(?P<max_id>[0-9]+)-(?P<hash_digest>[0-9a-f]+)\.json\.xz$"
+
+    def __init__(self, destination_directory, shard_blocks):
+        self._directory = MustExistDirectory(destination_directory.path / self.DIRECTORY)
+        self._shard_size = shard_blocks * Block.SIZE
+
+    def __repr__(self):
+        return "{0}({_directory}, {_shard_size})".format(self.__class__.__name__, **self.__dict__)
+
+    def shard_min_id(self, item_id):
+        return item_id - item_id % self._shard_size
+
+    @staticmethod
+    def encode(data):
+        # compression of the same data gives the same file, and the same name
+        json_data = json.dumps(data, sort_keys=True, separators=(',', ':'))
+        return lzma.compress(json_data.encode(), **LzmaCompression.default_settings())
+
+    def write_file(self, name, data):
+        with FinalizedTempFile(self._directory.path / name, "wb") as tmp_fileobj:
+            tmp_fileobj.write(data)
+
+    def write(self, package_info):
+        shards = collections.defaultdict(list)
+        for info in package_info:
+            shards[self.shard_min_id(int(info['min_id']))].append(info)
+
+        root = []
+        written = 0
+        for min_id in sorted(shards):
+            entries = sorted(shards[min_id],
+                             key=lambda info: (int(info['min_id']), -int(info['max_id']), info['content_type']))
+            data = self.encode(entries)
+            max_id = min_id + self._shard_size - 1
+            name = "shard-{0}-{1}-{2}.json.xz".format(min_id, max_id, hashlib.md5(data).hexdigest())
+            if not (self._directory.path / name).exists():
+                self.write_file(name, data)
+                written += 1
+            root.append({"min_id": min_id, "max_id": max_id, "file": name, "packages": len(entries)})
+        self.write_file(self.ROOT_NAME, self.encode({"shards": root}))
+
+        # shards of previous runs are only removed once the root does not reference them
+        referenced = {shard["file"] for shard in root}
+        pattern = re.compile(self.FILE_PATTERN)
+        for file in self._directory.path.files("shard-*"):
+            if pattern.fullmatch(file.name) and file.name not in referenced:
+                logging.debug("Deleting outdated index shard %s", file)
+                file.remove()
+        logging.info("Generated index root with %d shards, %d written", len(root), written)
@@ -1,35 +1,61 @@
+import sqlalchemy.orm
+
 from ..models import Image, Video
 
 
 class Package:
 
-    def __init__(self, block, item_class):
+    def __init__(self, block, item_class, interval=None, delta=False):
         self._block = block
         self._item_class = item_class
+        # exported id range, which may stop short of block boundaries
+        self._interval = interval or block
+        # delta packages only hold ids appended to an already exported block
+        self._delta = delta
 
     def __repr__(self):
-        return "{0}({_block}, {_item_class.__name__})".format(self.__class__.__name__, **self.__dict__)
+        return "{0}({_block}, {_item_class.__name__}, {_interval}, {_delta})".format(
+            self.__class__.__name__, **self.__dict__)
+
+    @property
+    def block(self):
+        return self._block
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def is_delta(self):
+        return self._delta
+
+    def content_type(self):
+        return self._item_class.__name__.lower()
 
-    def db_items(self, db_session, sorted_by_id=False):
-        result = self._block.items(db_session, self._item_class)
+    def db_items(self, db_session, sorted_by_id=False, with_tags=False):
+        result = self._interval.items(db_session, self._item_class)
+        if with_tags:
+            # one extra query for all tags, instead of one per item
+            result = result.options(sqlalchemy.orm.selectinload(self._item_class.tags))
         if sorted_by_id:
             result = result.order_by(self._item_class.item_id)
         return result
 
     def name(self):
+        bounds = self._interval if self._delta else self._block
         return "{0}-{1}-{2}".format(
-            self._item_class.__name__.lower(),
-            self._block.min_id,
-            self._block.max_id)
+            self.content_type(),
+            bounds.min_id,
+            bounds.max_id)
 
 
 class ImagePackage(Package):
 
-    def __init__(self, block):
-        super().__init__(block, Image)
+    def __init__(self, block, interval=None, delta=False):
+        super().__init__(block, Image, interval, delta)
 
 
 class VideoPackage(Package):
 
-    def __init__(self, block):
-        super().__init__(block, Video)
+    def __init__(self, block, interval=None, delta=False):
+        super().__init__(block, Video, interval, delta)
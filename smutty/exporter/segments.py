@@ -8,6 +8,31 @@ class Interval:
     def __repr__(self):
         return "{0}({min_id}, {max_id})".format(self.__class__.__name__, **self.__dict__)
 
+    def __eq__(self, other):
+        if not isinstance(other, Interval):
+            return NotImplemented
+        return (self.min_id, self.max_id) == (other.min_id, other.max_id)
+
+    def __hash__(self):
+        return hash((self.min_id, self.max_id))
+
+    def intersection(self, other):
+        """
+        Returns None when intervals do not overlap
+        """
+        min_id = max(self.min_id, other.min_id)
+        max_id = min(self.max_id, other.max_id)
+        if min_id > max_id:
+            return None
+        return Interval(min_id, max_id)
+
+    def items(self, db_session, item_class):
+        # query is sorted so that exporter output is stable
+        return db_session.query(item_class).filter(
+                self.min_id <= item_class.item_id,
+                item_class.item_id <= self.max_id
+            )
+
 
 class Block(Interval):
 
@@ -24,9 +49,20 @@ class Block(Interval):
         for base in range(lowest_id, highest_id + 1, cls.SIZE):
             yield Block(base, base + cls.SIZE - 1)
 
-    def items(self, db_session, item_class):
-        # query is sorted so that exporter output is stable
-        return db_session.query(item_class).filter(
-                self.min_id <= item_class.item_id,
-                item_class.item_id <= self.max_id
-            )
+    @classmethod
+    def containing(cls, item_id):
+        base = item_id - item_id % cls.SIZE
+        return Block(base, base + cls.SIZE - 1)
+
+
+def merge_intervals(intervals):
+    """
+    Sorted intervals, overlapping or adjacent ones being merged
+    """
+    merged = []
+    for interval in sorted(intervals, key=lambda interval: interval.min_id):
+        if merged and interval.min_id <= merged[-1].max_id + 1:
+            merged[-1] = Interval(merged[-1].min_id, max(merged[-1].max_id, interval.max_id))
+        else:
+            merged.append(interval)
+    return merged
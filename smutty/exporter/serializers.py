@@ -1,12 +1,26 @@
+import calendar
+import collections
+import concurrent.futures
+import datetime
+import itertools
 import json
 import logging
+import lzma
 
-from ..compression import LzmaCompression
-from ..filetools import md5_file, FinalizedTempFile
+from .. import profiling
+from ..bloom import BloomFilter
+from ..compression import GzipCompression, LzmaCompression
+from ..exceptions import SmuttyException
+from ..filetools import FinalizedTempFile
+
+from .segments import Interval
 
 
 class PackageSerializer:
 
+    # extension of package files, to be defined in sub-classes
+    FILE_EXTENSION = None
+
     def __init__(self, destination_directory, file_mode):
         self._destination_directory = destination_directory
         self._file_mode = file_mode
@@ -14,44 +28,82 @@ class PackageSerializer:
     def __repr__(self):
         return "{0}({_destination_directory})".format(self.__class__.__name__, **self.__dict__)
 
-    def remove_existing_package_files(self, package):
-        pattern = "{0}-*".format(package.name())
+    def block_package_files(self, package, with_sidecars=False):
+        """
+        Returns (file, interval) for every package file of the same content type within the block
+        """
+        pattern = "{0}-*".format(package.content_type())
+        result = []
         for file in self._destination_directory.path.files(pattern):
+            if not with_sidecars and not file.name.endswith(self.FILE_EXTENSION):
+                continue
+            try:
+                min_id, max_id = (int(part) for part in file.name.split("-")[1:3])
+            except ValueError:
+                continue
+            if package.block.min_id <= min_id and max_id <= package.block.max_id:
+                result.append((file, Interval(min_id, max_id)))
+        return result
+
+    def has_full_package(self, package):
+        return any(interval == package.block for _, interval in self.block_package_files(package))
+
+    def delta_package_files(self, package):
+        return [file for file, interval in self.block_package_files(package) if interval != package.block]
+
+    def remove_existing_package_files(self, package):
+        # a full package supersedes every delta of its block
+        if package.is_delta:
+            files = self._destination_directory.path.files("{0}-*".format(package.name()))
+        else:
+            files = [file for file, _ in self.block_package_files(package, with_sidecars=True)]
+        for file in files:
             logging.debug("Deleting present package file %s", file)
             file.remove()
 
-    @classmethod
-    def serialize_package(cls, package, db_session, file_obj):
+    @staticmethod
+    def read_items(package, db_session):
         """
-        Order items by id so that exporter output is stable
+        Items as plain dicts, with tags loaded along, so that they can be shared between threads
+        Items are ordered by id, and tags sorted, so that exporter output is stable
+        Dates are kept as datetime objects, for each format to render them
         """
-        for item in package.db_items(db_session, sorted_by_id=True):
-            cls.serialize_item(item, file_obj)
+        items = []
+        for db_item in package.db_items(db_session, sorted_by_id=True, with_tags=True):
+            item = db_item.export_dict()
+            item['tags'].sort()
+            item['last_updated'] = db_item.last_updated
+            items.append(item)
+        return items
+
+    def serialize_package(self, items, file_obj):
+        for item in items:
+            self.serialize_item(item, file_obj)
 
     def serialize(self, package, db_session):
+        self.remove_existing_package_files(package)
+        return self.write(package, self.read_items(package, db_session))
+
+    def write(self, package, items):
         """
-        Serialize to a temporary file, then moves result to requested destination
+        Serialize to a temporary file, then renames it to requested destination
         """
-        self.remove_existing_package_files(package)
-        # first pass: generate content
-        pkg_name = self.package_file_name(package, "INTERMEDIATE")
-        pkg_path_intermediate = self._destination_directory.path / pkg_name
-        with FinalizedTempFile(pkg_path_intermediate, self._file_mode) as tmp_fileobj:
+        # content is hashed while written, and the file is named after it
+        temp_path = self._destination_directory.path / self.package_file_name(package, "INTERMEDIATE")
+        temp_file = FinalizedTempFile(temp_path, self._file_mode, hashed=True)
+        with profiling.stage("serialize"), temp_file as tmp_fileobj:
             logging.debug("Exporting %s to temporary file %s", package, tmp_fileobj.name)
-            self.serialize_to_file(package, db_session, tmp_fileobj)
-        # second pass: generate hash and rename
-        hash_digest = md5_file(pkg_path_intermediate)
-        pkg_name = self.package_file_name(package, hash_digest)
-        pkg_path_final = self._destination_directory.path / pkg_name
-        pkg_path_intermediate.rename(pkg_path_final)
-        logging.info("Generated package file %s", pkg_path_final)
+            self.serialize_to_file(package, items, tmp_fileobj)
+            pkg_name = self.package_file_name(package, tmp_fileobj.hexdigest())
+            temp_file.final_path = self._destination_directory.path / pkg_name
+        logging.info("Generated package file %s", temp_file.final_path)
+        return temp_file.final_path
 
-    @classmethod
-    def serialize_to_file(cls, package, db_session, file_obj):
+    def serialize_to_file(self, package, items, file_obj):
         """
         Provide a default pass-through implementation
         """
-        cls.serialize_package(package, db_session, file_obj)
+        self.serialize_package(items, file_obj)
 
     @classmethod
     def package_file_name(cls, package):
@@ -68,44 +120,337 @@ class PackageSerializer:
         raise NotImplementedError()
 
 
+class CompactItemEncoder:
+    """
+    Shortens item fields using tables declared in a header line, written before items:
+    urls become [prefix index, suffix], dates become epoch seconds, and mime types an index
+    """
+
+    VERSION = 1
+
+    HEADER_KEY = "_header"
+
+    URL_FIELDS = ("image_url", "poster_url", "video_url", "sub_page")
+
+    DATE_FIELDS = ("last_updated",)
+
+    ENUM_FIELDS = ("video_mime",)
+
+    def __init__(self, items):
+        # tables are ordered by first use, so that exporter output is stable
+        self._prefixes = collections.OrderedDict()
+        self._enums = {field: collections.OrderedDict() for field in self.ENUM_FIELDS}
+        for item in items:
+            for field in self.URL_FIELDS:
+                if field in item:
+                    self._prefixes.setdefault(self.split_url(item[field])[0], len(self._prefixes))
+            for field, values in self._enums.items():
+                if field in item:
+                    values.setdefault(item[field], len(values))
+
+    @staticmethod
+    def split_url(url):
+        # a trailing slash stays in the suffix, so that sub pages share their prefix
+        prefix, separator, _ = url.rstrip("/").rpartition("/")
+        return prefix + separator, url[len(prefix + separator):]
+
+    @staticmethod
+    def encode_date(value):
+        seconds = calendar.timegm(value.utctimetuple())
+        return seconds + value.microsecond / 1000000 if value.microsecond else seconds
+
+    def header(self):
+        return {
+            "version": self.VERSION,
+            "prefixes": list(self._prefixes),
+            "enums": {field: list(values) for field, values in self._enums.items()},
+            "dates": list(self.DATE_FIELDS),
+        }
+
+    def encode_header(self):
+        json_data = json.dumps({self.HEADER_KEY: self.header()}, sort_keys=True, separators=(',', ':'))
+        return "{0}\n".format(json_data).encode()
+
+    def encode_item(self, item):
+        item = dict(item)
+        for field in self.URL_FIELDS:
+            if field in item:
+                prefix, suffix = self.split_url(item[field])
+                item[field] = [self._prefixes[prefix], suffix]
+        for field in self.DATE_FIELDS:
+            item[field] = self.encode_date(item[field])
+        for field, values in self._enums.items():
+            if field in item:
+                item[field] = values[item[field]]
+        json_data = json.dumps(item, sort_keys=True, separators=(',', ':'))
+        return "{0}\n".format(json_data).encode()
+
+    @classmethod
+    def expand_item(cls, header, item):
+        """
+        Restores an item to its regular form, dates being expanded as UTC
+        """
+        prefixes = header["prefixes"]
+        for field in cls.URL_FIELDS:
+            if field in item:
+                index, suffix = item[field]
+                item[field] = prefixes[index] + suffix
+        for field in header["dates"]:
+            item[field] = str(datetime.datetime.fromtimestamp(item[field], datetime.timezone.utc))
+        for field, values in header["enums"].items():
+            if field in item:
+                item[field] = values[item[field]]
+        return item
+
+
 class JsonlPackageSerializer(PackageSerializer):
 
-    def __init__(self, destination_directory, file_mode):
+    FILE_EXTENSION = ".jsonl"
+
+    def __init__(self, destination_directory, file_mode, compact=False):
         super().__init__(destination_directory, file_mode)
+        self._compact = compact
 
     @classmethod
     def package_file_name(cls, package, suffix):
         """
         IMPORTANT: Re-implementation required in sub-classes
         """
-        return "{0}-{1}.jsonl".format(package.name(), suffix)
+        return "{0}-{1}{2}".format(package.name(), suffix, cls.FILE_EXTENSION)
 
     @classmethod
-    def serialize_item(cls, item, file_obj):
+    def encode_item(cls, item):
         """
         Provide a default implementation for sub-classes
-        Tags are sorted so that exporter output is stable
         """
-        item = item.export_dict()
-        item['tags'].sort()
-        json_data = json.dumps(item, sort_keys=True)
-        file_obj.write(json_data.encode())
-        file_obj.write("\n".encode())
+        json_data = json.dumps(item, sort_keys=True, default=str)
+        return "{0}\n".format(json_data).encode()
+
+    @classmethod
+    def serialize_item(cls, item, file_obj):
+        file_obj.write(cls.encode_item(item))
+
+    def serialize_package(self, items, file_obj):
+        """
+        Overrides default implementation, when encoding is compact
+        """
+        if not self._compact:
+            super().serialize_package(items, file_obj)
+            return
+        encoder = CompactItemEncoder(items)
+        file_obj.write(encoder.encode_header())
+        for item in items:
+            file_obj.write(encoder.encode_item(item))
 
 
 class LzmaJsonlPackageSerializer(JsonlPackageSerializer):
 
+    FILE_EXTENSION = ".jsonl.xz"
+
+    def __init__(self, destination_directory, file_mode, compact=False):
+        super().__init__(destination_directory, file_mode, compact)
+
+    @classmethod
+    def package_file_name(cls, package, suffix):
+        return "{0}-{1}{2}".format(package.name(), suffix, cls.FILE_EXTENSION)
+
+    def serialize_to_file(self, package, items, file_obj):
+        """
+        Overrides default implementation
+        Wraps serialization into a compressed file
+        """
+        with LzmaCompression(file_obj, self._file_mode) as lzma_fileobj:
+            self.serialize_package(items, lzma_fileobj)
+
+
+class GzipJsonlPackageSerializer(JsonlPackageSerializer):
+
+    FILE_EXTENSION = ".jsonl.gz"
+
     def __init__(self, destination_directory, file_mode):
         super().__init__(destination_directory, file_mode)
 
     @classmethod
     def package_file_name(cls, package, suffix):
-        return "{0}-{1}.jsonl.xz".format(package.name(), suffix)
+        return "{0}-{1}{2}".format(package.name(), suffix, cls.FILE_EXTENSION)
 
-    def serialize_to_file(self, package, db_session, file_obj):
+    def serialize_to_file(self, package, items, file_obj):
         """
         Overrides default implementation
         Wraps serialization into a compressed file
         """
+        with GzipCompression(file_obj, self._file_mode) as gzip_fileobj:
+            self.serialize_package(items, gzip_fileobj)
+
+
+class LzmaColumnsPackageSerializer(PackageSerializer):
+    """
+    One json object holding an array per attribute, which compresses better
+    and loads faster into dataframes than one object per line
+    """
+
+    FILE_EXTENSION = ".columns.json.xz"
+
+    def __init__(self, destination_directory, file_mode):
+        super().__init__(destination_directory, file_mode)
+
+    @classmethod
+    def package_file_name(cls, package, suffix):
+        return "{0}-{1}{2}".format(package.name(), suffix, cls.FILE_EXTENSION)
+
+    @staticmethod
+    def encode_columns(items):
+        names = sorted(set(itertools.chain.from_iterable(items)))
+        columns = {name: [item.get(name) for item in items] for name in names}
+        return json.dumps(columns, sort_keys=True, separators=(',', ':'), default=str).encode()
+
+    def serialize_to_file(self, package, items, file_obj):
+        """
+        Overrides default implementation
+        """
         with LzmaCompression(file_obj, self._file_mode) as lzma_fileobj:
-            self.serialize_package(package, db_session, lzma_fileobj)
+            lzma_fileobj.write(self.encode_columns(items))
+
+
+class SeekableLzmaJsonlPackageSerializer(LzmaJsonlPackageSerializer):
+    """
+    Packages are a concatenation of independent xz streams of at most frame_lines items,
+    which is still a valid xz file, and a frame table is written in a sidecar file
+    so that readers can fetch and decompress only the frame holding a given item
+    In compact encoding, the header line is compressed on its own, and located in the table too
+    """
+
+    FRAMES_SUFFIX = ".frames.json"
+
+    def __init__(self, destination_directory, file_mode, frame_lines, compact=False):
+        super().__init__(destination_directory, file_mode, compact)
+        assert frame_lines > 0
+        self._frame_lines = frame_lines
+        self._frames = []
+        self._header = None
+
+    def write(self, package, items):
+        self._frames = []
+        self._header = None
+        pkg_path = super().write(package, items)
+        frames_path = pkg_path + self.FRAMES_SUFFIX
+        table = {"frames": self._frames}
+        if self._header is not None:
+            table["header"] = self._header
+        with FinalizedTempFile(frames_path, "wt") as tmp_fileobj:
+            json.dump(table, tmp_fileobj, sort_keys=True)
+        logging.debug("Generated frame table %s", frames_path)
+        return pkg_path
+
+    def serialize_to_file(self, package, items, file_obj):
+        """
+        Overrides default implementation
+        Compresses each frame independently, and records its location
+        """
+        offset = 0
+        encode_item = self.encode_item
+        if self._compact:
+            encoder = CompactItemEncoder(items)
+            encode_item = encoder.encode_item
+            with profiling.stage("compress"):
+                compressed = lzma.compress(encoder.encode_header(), **LzmaCompression.default_settings())
+            file_obj.write(compressed)
+            self._header = {"offset": offset, "length": len(compressed)}
+            offset += len(compressed)
+        items = iter(items)
+        while True:
+            frame_items = list(itertools.islice(items, self._frame_lines))
+            # an empty package still holds one (empty) stream, to remain a valid xz file
+            if not frame_items and (self._frames or self._header):
+                break
+            data = b"".join(encode_item(item) for item in frame_items)
+            with profiling.stage("compress"):
+                compressed = lzma.compress(data, **LzmaCompression.default_settings())
+            file_obj.write(compressed)
+            if frame_items:
+                self._frames.append({
+                    "min_id": frame_items[0]["item_id"],
+                    "max_id": frame_items[-1]["item_id"],
+                    "offset": offset,
+                    "length": len(compressed),
+                })
+            offset += len(compressed)
+            if len(frame_items) < self._frame_lines:
+                break
+
+
+class FanOutPackageSerializer:
+    """
+    Reads items of a package once, and hands them to several serializers,
+    each in its own thread since compressors release the GIL
+    The first serializer is the primary one, which delta bookkeeping relies on
+    Primary packages may get a bloom filter sidecar over item ids and media urls
+    """
+
+    BLOOM_SUFFIX = ".bloom"
+
+    BLOOM_URL_FIELDS = ("image_url", "poster_url", "video_url")
+
+    ADDITIONAL_FORMATS = {
+        "jsonl.gz": GzipJsonlPackageSerializer,
+        "columns.json.xz": LzmaColumnsPackageSerializer,
+    }
+
+    def __init__(self, primary, additional=None, bloom_false_positive_rate=None):
+        self._serializers = [primary] + list(additional or [])
+        self._bloom_false_positive_rate = bloom_false_positive_rate
+
+    def __repr__(self):
+        return "{0}({_serializers})".format(self.__class__.__name__, **self.__dict__)
+
+    @classmethod
+    def additional_serializer(cls, format_name, destination_directory, file_mode):
+        try:
+            serializer_class = cls.ADDITIONAL_FORMATS[format_name]
+        except KeyError:
+            raise SmuttyException("Unknown package format '{0}', expected one of {1}".format(
+                format_name, sorted(cls.ADDITIONAL_FORMATS)))
+        return serializer_class(destination_directory, file_mode)
+
+    @property
+    def primary(self):
+        return self._serializers[0]
+
+    def has_full_package(self, package):
+        return self.primary.has_full_package(package)
+
+    def delta_package_files(self, package):
+        return self.primary.delta_package_files(package)
+
+    def remove_existing_package_files(self, package):
+        for serializer in self._serializers:
+            serializer.remove_existing_package_files(package)
+
+    def serialize(self, package, db_session):
+        """
+        Returns the path of the primary package file
+        """
+        self.remove_existing_package_files(package)
+        with profiling.stage("db"):
+            items = PackageSerializer.read_items(package, db_session)
+        if len(self._serializers) == 1:
+            pkg_path = self.primary.write(package, items)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(self._serializers)) as executor:
+                futures = [executor.submit(serializer.write, package, items) for serializer in self._serializers]
+                pkg_path = [future.result() for future in futures][0]
+        if self._bloom_false_positive_rate:
+            self.write_bloom_filter(pkg_path + self.BLOOM_SUFFIX, items)
+        return pkg_path
+
+    def write_bloom_filter(self, bloom_path, items):
+        keys = []
+        for item in items:
+            keys.append(item["item_id"])
+            keys.extend(item[field] for field in self.BLOOM_URL_FIELDS if field in item)
+        bloom_filter = BloomFilter.for_capacity(len(keys), self._bloom_false_positive_rate)
+        for key in keys:
+            bloom_filter.add(key)
+        with FinalizedTempFile(bloom_path, "wb") as tmp_fileobj:
+            tmp_fileobj.write(bloom_filter.to_bytes())
+        logging.debug("Generated bloom filter %s", bloom_path)
@@ -0,0 +1,155 @@
+import collections
+import itertools
+import json
+import logging
+
+from ..compression import LzmaCompression
+from ..filetools import FinalizedTempFile
+
+from .segments import Interval, Block
+
+
+class TagStatistics:
+    """
+    Per-tag item counts and sparse tag co-occurrence counts,
+    maintained incrementally over the covered id range
+    """
+
+    FILE_NAME = "tagstats.json.xz"
+
+    FILE_PATTERN = r"^tagstats\.json\.xz$"
+
+    VERSION = 1
+
+    def __init__(self, destination_directory, file_mode):
+        self._destination_directory = destination_directory
+        self._file_mode = file_mode
+        self.clear()
+
+    def clear(self):
+        self.min_id = None
+        self.max_id = None
+        self.tagged_item_count = 0
+        self.tag_counts = collections.Counter()
+        # upper triangle only: keys are (name, other_name) with name < other_name
+        self.pair_counts = collections.Counter()
+
+    def __repr__(self):
+        return "{0}({_destination_directory}, {min_id}, {max_id})".format(self.__class__.__name__, **self.__dict__)
+
+    @property
+    def path(self):
+        return self._destination_directory.path / self.FILE_NAME
+
+    def load(self):
+        if not self.path.exists():
+            logging.info("No tag statistics found, starting from scratch")
+            return
+        with open(self.path, "rb") as file_obj:
+            with LzmaCompression(file_obj, "rb") as lzma_fileobj:
+                data = json.loads(lzma_fileobj.read().decode())
+        if data["version"] != self.VERSION:
+            logging.warning("Unsupported tag statistics version %s, starting from scratch", data["version"])
+            return
+        names = data["tags"]
+        self.min_id = data["min_id"]
+        self.max_id = data["max_id"]
+        self.tagged_item_count = data["tagged_item_count"]
+        self.tag_counts = collections.Counter(dict(zip(names, data["counts"])))
+        self.pair_counts = collections.Counter({
+            (names[i], names[j]): count
+            for i, j, count in data["pairs"]
+        })
+        logging.info("Loaded tag statistics for %s", Interval(self.min_id, self.max_id))
+
+    def save(self):
+        # tags are referenced by their rank in name order, so that output is stable
+        names = sorted(self.tag_counts)
+        ranks = {name: rank for rank, name in enumerate(names)}
+        data = {
+            "version": self.VERSION,
+            "min_id": self.min_id,
+            "max_id": self.max_id,
+            "tagged_item_count": self.tagged_item_count,
+            "tags": names,
+            "counts": [self.tag_counts[name] for name in names],
+            "pairs": sorted(
+                [ranks[name], ranks[other_name], count]
+                for (name, other_name), count in self.pair_counts.items()
+            ),
+        }
+        with FinalizedTempFile(self.path, self._file_mode) as tmp_fileobj:
+            with LzmaCompression(tmp_fileobj, self._file_mode) as lzma_fileobj:
+                lzma_fileobj.write(json.dumps(data, separators=(',', ':')).encode())
+        logging.info("Generated tag statistics file %s", self.path)
+
+    def missing_intervals(self, interval):
+        """
+        Parts of the requested interval not covered yet
+        """
+        if self.min_id is None or self.max_id is None:
+            return [interval]
+        missing = []
+        if interval.min_id < self.min_id:
+            missing.append(Interval(interval.min_id, min(interval.max_id, self.min_id - 1)))
+        if self.max_id < interval.max_id:
+            missing.append(Interval(max(interval.min_id, self.max_id + 1), interval.max_id))
+        return missing
+
+    def overlaps(self, intervals):
+        """
+        Whether some of the intervals reach into the covered range
+        """
+        if self.min_id is None or self.max_id is None:
+            return False
+        covered = Interval(self.min_id, self.max_id)
+        return any(covered.intersection(interval) is not None for interval in intervals)
+
+    def add_item_tags(self, item_tags):
+        """
+        Batch update from a mapping of item id to tag names
+        """
+        tag_lists = [sorted(names) for names in item_tags.values()]
+        self.tagged_item_count += len(tag_lists)
+        self.tag_counts.update(itertools.chain.from_iterable(tag_lists))
+        self.pair_counts.update(itertools.chain.from_iterable(
+            itertools.combinations(names, 2) for names in tag_lists
+        ))
+
+    def update(self, interval, db_session):
+        """
+        Only scans items of the interval not covered yet, one query per block
+        """
+        from ..models import Tag, association_item_tag
+
+        for missing in self.missing_intervals(interval):
+            logging.info("Computing tag statistics for %s", missing)
+            for block in Block.blocks_covering_interval(missing):
+                low, high = max(block.min_id, missing.min_id), min(block.max_id, missing.max_id)
+                rows = db_session.query(association_item_tag.c.item_id, Tag.name).join(
+                    Tag, Tag.tag_id == association_item_tag.c.tag_id
+                ).filter(
+                    low <= association_item_tag.c.item_id,
+                    association_item_tag.c.item_id <= high
+                )
+                item_tags = collections.defaultdict(list)
+                for item_id, name in rows:
+                    item_tags[item_id].append(name)
+                self.add_item_tags(item_tags)
+            self.min_id = missing.min_id if self.min_id is None else min(self.min_id, missing.min_id)
+            self.max_id = missing.max_id if self.max_id is None else max(self.max_id, missing.max_id)
+
+    def most_frequent(self, count=None):
+        return self.tag_counts.most_common(count)
+
+    def cooccurring(self, name, count=None):
+        """
+        Tags most often found together with the given one
+        """
+        partners = collections.Counter()
+        for (first, second), pair_count in self.pair_counts.items():
+            if first == name:
+                partners[second] = pair_count
+            elif second == name:
+                partners[first] = pair_count
+        return partners.most_common(count)
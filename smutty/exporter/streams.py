@@ -0,0 +1,28 @@
+import logging
+import math
+import tarfile
+
+
+def stream_files(destination_directory, since, file_obj, last_names=()):
+    """
+    Writes a tar stream of files of the destination directory modified since the given time,
+    files named last_names at the end, so that an index only references files already sent
+    Hidden files, temporary ones for example, are left out
+    """
+    # modification times may be truncated to the second
+    since = math.floor(since)
+    root = destination_directory.path
+    files = []
+    for file in root.walkfiles():
+        relative = root.relpathto(file)
+        if any(part.startswith(".") for part in relative.splitall()[1:]) or file.mtime < since:
+            continue
+        files.append((file.name in last_names, relative, file))
+    files.sort()
+    size = 0
+    with tarfile.open(fileobj=file_obj, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for _, relative, file in files:
+            tar.add(file, arcname=relative, recursive=False)
+            size += file.size
+    logging.info("Streamed %d files, %d bytes", len(files), size)
+    return [file for _, _, file in files]
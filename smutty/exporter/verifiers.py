@@ -0,0 +1,235 @@
+import collections
+import hashlib
+import json
+import logging
+import lzma
+import mmap
+import multiprocessing
+import re
+
+from .archives import ArchiveBundler, load_manifest
+from .indexers import LzmaJsonIndexer
+from .segments import Block
+from .serializers import CompactItemEncoder
+
+
+BlockSummary = collections.namedtuple("BlockSummary", ["item_count", "checksum"])
+
+EMPTY_SUMMARY = BlockSummary(0, 0)
+
+CHECKSUM_MODULUS = 2 ** 64
+
+# exported fields which are checked, last_updated being left out as its text depends on the encoding
+ITEM_FIELDS = ("item_id", "submitter", "sub_page", "image_url", "poster_url", "video_url", "video_mime")
+
+
+def item_checksum(item):
+    """
+    64 bits of the md5 digest of the checked fields and sorted tags of an item,
+    summed per block so that the order of items does not matter
+    """
+    content = {field: item[field] for field in ITEM_FIELDS if field in item}
+    content["tags"] = sorted(item["tags"])
+    json_data = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return int.from_bytes(hashlib.md5(json_data.encode()).digest()[:8], "big")
+
+
+def add_summaries(first, second):
+    return BlockSummary(first.item_count + second.item_count, (first.checksum + second.checksum) % CHECKSUM_MODULUS)
+
+
+def read_package_file(file_name):
+    """
+    Returns (md5 digest, decompressed data) of a package or bundle file,
+    data being empty when it cannot be decompressed, its digest telling it is corrupted
+    """
+    with open(file_name, "rb") as file_obj:
+        with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            hash_digest = hashlib.md5(mapped).hexdigest()
+            try:
+                return hash_digest, lzma.decompress(mapped)
+            except lzma.LZMAError:
+                return hash_digest, b""
+
+
+def summarize(data):
+    item_count, checksum = 0, 0
+    header = None
+    for line in data.splitlines():
+        item = json.loads(line.decode())
+        if CompactItemEncoder.HEADER_KEY in item:
+            header = item[CompactItemEncoder.HEADER_KEY]
+            continue
+        if header is not None:
+            item = CompactItemEncoder.expand_item(header, item)
+        item_count += 1
+        checksum += item_checksum(item)
+    return BlockSummary(item_count, checksum % CHECKSUM_MODULUS)
+
+
+def inspect_package_file(file_name):
+    """
+    Returns (md5 digest, summary) of a package file
+    Module-level so that it can run in worker processes
+    """
+    hash_digest, data = read_package_file(file_name)
+    return hash_digest, summarize(data)
+
+
+def inspect_bundle_file(file_name, members):
+    """
+    Returns (md5 digest, summaries) of a bundle file, one summary per (offset, length) member
+    """
+    hash_digest, data = read_package_file(file_name)
+    return hash_digest, [summarize(data[offset:offset + length]) for offset, length in members]
+
+
+class PackageVerifier:
+    """
+    Checks package digests, and compares package contents with the database,
+    per block and content type, using item counts and order-independent checksums
+    """
+
+    def __init__(self, destination_directory, processes=None):
+        self._destination_directory = destination_directory
+        self._processes = processes
+
+    def __repr__(self):
+        return "{0}({_destination_directory})".format(self.__class__.__name__, **self.__dict__)
+
+    def package_files(self):
+        """
+        Returns package files grouped by (content type, block)
+        """
+        pattern = re.compile(LzmaJsonIndexer.package_pattern())
+        result = collections.defaultdict(list)
+        for package_file in self._destination_directory.path.files():
+            match = pattern.fullmatch(package_file.name)
+            if not match:
+                continue
+            block = Block.containing(int(match.group('min_id')))
+            result[(match.group('content_type'), block)].append((package_file, match.group('hash_digest')))
+        return result
+
+    def bundle_members(self, package_files):
+        """
+        Returns bundle files, with members of blocks which have no package file
+        """
+        pattern = re.compile(ArchiveBundler.FILE_PATTERN)
+        result = []
+        for bundle_file in self._destination_directory.path.files("bundle-*"):
+            match = pattern.fullmatch(bundle_file.name)
+            if not match:
+                continue
+            members = []
+            for member in load_manifest(bundle_file):
+                key = (member["content_type"], Block.containing(member["min_id"]))
+                if key not in package_files:
+                    members.append((key, member["offset"], member["length"]))
+            result.append((bundle_file, match.group('hash_digest'), members))
+        return result
+
+    def package_summaries(self, package_files, bundle_members=()):
+        """
+        Hashes and summarizes all package and bundle files in parallel
+        Returns summaries per (content type, block), and keys of blocks with corrupted files
+        """
+        keys, files, expected_digests = [], [], []
+        for key, entries in package_files.items():
+            for package_file, hash_digest in entries:
+                keys.append(key)
+                files.append(str(package_file))
+                expected_digests.append(hash_digest)
+
+        with multiprocessing.Pool(self._processes) as pool:
+            results = pool.map(inspect_package_file, files)
+            bundle_results = pool.starmap(inspect_bundle_file, [
+                (str(bundle_file), [(offset, length) for _, offset, length in members])
+                for bundle_file, _, members in bundle_members
+            ])
+
+        # bundles are checked as a whole, members keep digests of their original package
+        for (bundle_file, expected_digest, members), (hash_digest, member_summaries) in zip(
+                bundle_members, bundle_results):
+            for (key, _, _), summary in zip(members, member_summaries):
+                keys.append(key)
+                files.append(str(bundle_file))
+                expected_digests.append(expected_digest)
+                results.append((hash_digest, summary))
+
+        summaries = collections.defaultdict(lambda: EMPTY_SUMMARY)
+        corrupted = set()
+        for key, file_name, expected_digest, (hash_digest, summary) in zip(keys, files, expected_digests, results):
+            if hash_digest != expected_digest:
+                logging.warning("Package file %s has digest %s", file_name, hash_digest)
+                corrupted.add(key)
+            summaries[key] = add_summaries(summaries[key], summary)
+        return summaries, corrupted
+
+    @staticmethod
+    def database_items(db_session, interval, item_class):
+        """
+        Items of a content type as dicts of checked fields, with one streamed query
+        """
+        import sqlalchemy
+
+        from ..models import Item, Tag, association_item_tag
+
+        items, typed, tags = Item.__table__, item_class.__table__, Tag.__table__
+        columns = [items.c[field] for field in ITEM_FIELDS if field in items.c] \
+            + [typed.c[field] for field in ITEM_FIELDS if field in typed.c and field != "item_id"]
+        query = sqlalchemy.select(columns + [tags.c.name]) \
+            .select_from(items.join(typed).outerjoin(association_item_tag).outerjoin(tags)) \
+            .where(sqlalchemy.and_(interval.min_id <= items.c.item_id, items.c.item_id <= interval.max_id)) \
+            .order_by(items.c.item_id) \
+            .execution_options(stream_results=True)
+        item = None
+        for row in db_session.execute(query):
+            if item is None or item["item_id"] != row[0]:
+                if item is not None:
+                    yield item
+                item = {column.name: value for column, value in zip(columns, row)}
+                item["tags"] = []
+            if row[-1] is not None:
+                item["tags"].append(row[-1])
+        if item is not None:
+            yield item
+
+    @classmethod
+    def database_summaries(cls, db_session, interval):
+        """
+        Computes summaries per (content type, block) with one query per content type
+        """
+        from ..models import Image, Video
+
+        summaries = collections.defaultdict(lambda: EMPTY_SUMMARY)
+        for item_class in (Image, Video):
+            content_type = item_class.__name__.lower()
+            for item in cls.database_items(db_session, interval, item_class):
+                key = (content_type, Block.containing(item["item_id"]))
+                summaries[key] = add_summaries(summaries[key], BlockSummary(1, item_checksum(item)))
+        return dict(summaries)
+
+    def verify(self, db_session, interval):
+        """
+        Returns sorted (content type, block) keys which need to be exported again
+        """
+        package_files = self.package_files()
+        bundle_members = self.bundle_members(package_files)
+        logging.info("Verifying %d package files and %d bundle files",
+                     sum(len(entries) for entries in package_files.values()), len(bundle_members))
+        package_summaries, stale = self.package_summaries(package_files, bundle_members)
+        database_summaries = self.database_summaries(db_session, interval)
+
+        for key in set(package_summaries) | set(database_summaries):
+            expected = database_summaries.get(key, EMPTY_SUMMARY)
+            actual = package_summaries.get(key, EMPTY_SUMMARY)
+            if expected != actual:
+                logging.warning("Block %s %s differs: database %s, packages %s", key[0], key[1], expected, actual)
+                stale.add(key)
+
+        stale = sorted(stale, key=lambda key: (key[1].min_id, key[0]))
+        for content_type, block in stale:
+            logging.info("Needs export: %s %s", content_type, block)
+        logging.info("%d blocks need to be exported again", len(stale))
+        return stale
@@ -0,0 +1,168 @@
+import json
+import logging
+import zlib
+
+from ..compression import LzmaCompression
+from ..filetools import FinalizedTempFile, MustExistDirectory
+
+from .serializers import LzmaJsonlPackageSerializer
+
+
+class SubmitterBucket:
+    """
+    All exported items of the submitters hashed to the same bucket, whatever their type
+    """
+
+    def __init__(self, bucket, submitters, interval):
+        self._bucket = bucket
+        self._submitters = sorted(submitters)
+        self._interval = interval
+
+    def __repr__(self):
+        return "{0}({_bucket}, {1} submitters, {_interval})".format(
+            self.__class__.__name__, len(self._submitters), **self.__dict__)
+
+    def name(self):
+        return "submitters-{0}".format(self._bucket)
+
+    def read_items(self, db_session):
+        """
+        Same form as items of id range packages, plus their content type
+        """
+        import sqlalchemy.orm
+
+        from ..models import Item, Image, Video
+
+        polymorphic_item = sqlalchemy.orm.with_polymorphic(Item, [Image, Video])
+        query = db_session.query(polymorphic_item).filter(
+            polymorphic_item.submitter.in_(self._submitters),
+            self._interval.min_id <= polymorphic_item.item_id,
+            polymorphic_item.item_id <= self._interval.max_id
+        ).options(
+            sqlalchemy.orm.selectinload(polymorphic_item.tags)
+        ).order_by(polymorphic_item.item_id)
+        items = []
+        for db_item in query:
+            item = db_item.export_dict()
+            item['tags'].sort()
+            item['last_updated'] = db_item.last_updated
+            item['content_type'] = db_item.__class__.__name__.lower()
+            items.append(item)
+        return items
+
+
+class SubmitterViews:
+    """
+    Packages grouping items per submitter, submitters being spread over a fixed
+    number of buckets, in their own directory with their own index
+    Only buckets of submitters with new items, or which lost some, are written again
+    """
+
+    DIRECTORY_NAME = "submitters"
+
+    INDEX_NAME = "index.json.xz"
+
+    VERSION = 1
+
+    def __init__(self, destination_directory, bucket_count, compact=False):
+        self._directory = MustExistDirectory(destination_directory.path / self.DIRECTORY_NAME)
+        self._serializer = LzmaJsonlPackageSerializer(self._directory, "wb", compact)
+        self._bucket_count = bucket_count
+        # bucket -> package file name
+        self._packages = {}
+        # submitter -> bucket
+        self._submitters = {}
+
+    def __repr__(self):
+        return "{0}({_directory}, {_bucket_count})".format(self.__class__.__name__, **self.__dict__)
+
+    @property
+    def index_path(self):
+        return self._directory.path / self.INDEX_NAME
+
+    def bucket(self, submitter):
+        # crc32 is stable across runs, unlike hash()
+        return zlib.crc32(submitter.encode()) % self._bucket_count
+
+    def load(self):
+        """
+        Returns whether the existing views can be updated incrementally
+        """
+        if not self.index_path.exists():
+            logging.info("No submitter views found, building them from scratch")
+            return False
+        with open(self.index_path, "rb") as file_obj:
+            with LzmaCompression(file_obj, "rb") as lzma_fileobj:
+                data = json.loads(lzma_fileobj.read().decode())
+        if data["version"] != self.VERSION or data["buckets"] != self._bucket_count:
+            logging.info("Submitter views were built differently, building them from scratch")
+            return False
+        self._packages = {int(bucket): file_name for bucket, file_name in data["packages"].items()}
+        self._submitters = data["submitters"]
+        return True
+
+    def save(self):
+        data = {
+            "version": self.VERSION,
+            "buckets": self._bucket_count,
+            "packages": {str(bucket): file_name for bucket, file_name in self._packages.items()},
+            "submitters": self._submitters,
+        }
+        with FinalizedTempFile(self.index_path, "wb") as tmp_fileobj:
+            with LzmaCompression(tmp_fileobj, "wb") as lzma_fileobj:
+                lzma_fileobj.write(json.dumps(data, sort_keys=True, separators=(',', ':')).encode())
+        logging.info("Generated submitter index file %s", self.index_path)
+
+    @staticmethod
+    def submitters_of(db_session, interval):
+        from ..models import Item
+
+        rows = db_session.query(Item.submitter).filter(
+            interval.min_id <= Item.item_id,
+            Item.item_id <= interval.max_id
+        ).distinct()
+        return {submitter for submitter, in rows}
+
+    def update(self, dirty_intervals, exported_interval, db_session, previous_submitters=()):
+        """
+        Writes again buckets holding submitters with items in dirty intervals, along with
+        buckets of previous submitters of items refreshed since, which may not hold them anymore
+        Submitters left without items are dropped
+        """
+        if self.load():
+            intervals = dirty_intervals
+        else:
+            for package_file in self._directory.path.files("submitters-*"):
+                package_file.remove()
+            self._packages, self._submitters = {}, {}
+            intervals = [exported_interval]
+
+        dirty_buckets = set()
+        for interval in intervals:
+            for submitter in self.submitters_of(db_session, interval):
+                bucket = self.bucket(submitter)
+                self._submitters[submitter] = bucket
+                dirty_buckets.add(bucket)
+        dirty_buckets.update(self._submitters[submitter] for submitter in previous_submitters
+                             if submitter in self._submitters)
+        logging.info("Updating %d submitter buckets", len(dirty_buckets))
+
+        bucket_submitters = {}
+        for submitter, bucket in self._submitters.items():
+            bucket_submitters.setdefault(bucket, []).append(submitter)
+
+        for bucket in sorted(dirty_buckets):
+            package = SubmitterBucket(bucket, bucket_submitters[bucket], exported_interval)
+            items = package.read_items(db_session)
+            for submitter in set(bucket_submitters[bucket]).difference(item['submitter'] for item in items):
+                logging.debug("Submitter %s has no item anymore", submitter)
+                del self._submitters[submitter]
+            previous = self._packages.pop(bucket, None)
+            package_name = None
+            if items:
+                package_name = self._serializer.write(package, items).name
+                self._packages[bucket] = package_name
+            if previous is not None and previous != package_name:
+                (self._directory.path / previous).remove_p()
+
+        self.save()
@@ -1,10 +1,9 @@
 import hashlib
 import logging
 import os
-import shutil
 import tempfile
 
-from path import Path
+from . import profiling
 
 
 class IntegerStateFile:
@@ -37,9 +36,93 @@ class IntegerStateFile:
         os.remove(self.file_name)
 
 
+class ItemIdsStateFile:
+    """
+    Item ids appended by producers, one per line, and taken as a whole by a consumer :
+    taken ids are moved aside, and only dropped once released, so that ids appended
+    meanwhile, or taken by an interrupted consumer, are taken again next time
+    Ids may come with the submitter their item had, after a tab
+    """
+
+    TAKEN_SUFFIX = ".taken"
+
+    SEPARATOR = "\t"
+
+    def __init__(self, file_name, logger=None):
+        self.file_name = file_name
+        self.taken_file_name = file_name + self.TAKEN_SUFFIX
+        self.logger = logger or logging.getLogger('')
+
+    @classmethod
+    def _read(cls, file_name):
+        """
+        Lines as (item id, submitter) pairs, the submitter being None when not given
+        """
+        try:
+            with open(file_name, "rt") as file_obj:
+                fields = [line.rstrip("\n").split(cls.SEPARATOR, 1) for line in file_obj if line.strip()]
+        except FileNotFoundError:
+            return set()
+        return {(int(line[0]), line[1] if len(line) > 1 else None) for line in fields}
+
+    @classmethod
+    def _format(cls, entries):
+        return "".join(
+            "{0}\n".format(item_id) if submitter is None else "{0}{1}{2}\n".format(item_id, cls.SEPARATOR, submitter)
+            for item_id, submitter in entries
+        )
+
+    def add(self, item_ids, submitters=None):
+        """
+        Submitters, by item id, are optional
+        """
+        if not item_ids:
+            return
+        submitters = submitters or {}
+        with open(self.file_name, "at") as file_obj:
+            self.logger.debug("Adding %d ids to state file %s", len(item_ids), self.file_name)
+            file_obj.write(self._format((item_id, submitters.get(item_id)) for item_id in item_ids))
+
+    def pending(self):
+        return any(os.path.exists(file_name) for file_name in (self.file_name, self.taken_file_name))
+
+    def take(self):
+        """
+        Returns ids appended so far, along with ids taken before and not released
+        """
+        entries = self._read(self.taken_file_name)
+        if os.path.exists(self.file_name):
+            # moved first, producers append to a new file from then on
+            incoming_file_name = self.file_name + ".incoming"
+            os.replace(self.file_name, incoming_file_name)
+            entries |= self._read(incoming_file_name)
+            with open(self.taken_file_name, "wt") as file_obj:
+                file_obj.write(self._format(sorted(entries, key=lambda entry: (entry[0], entry[1] or ""))))
+            os.remove(incoming_file_name)
+        item_ids = {item_id for item_id, _ in entries}
+        self.logger.debug("Taking %d ids from state file %s", len(item_ids), self.file_name)
+        return item_ids
+
+    def taken_submitters(self):
+        """
+        Submitters given along with taken ids
+        """
+        return {submitter for _, submitter in self._read(self.taken_file_name) if submitter is not None}
+
+    def release(self):
+        self.logger.debug("Releasing taken ids of state file %s", self.file_name)
+        try:
+            os.remove(self.taken_file_name)
+        except FileNotFoundError:
+            pass
+
+
 class MustExistDirectory:
 
     def __init__(self, desired_path):
+        # path.py is slow to import, and not needed by state files
+        from path import Path
+
         self._full_path = Path(desired_path).expand().abspath()
         self._full_path.mkdir_p()
 
@@ -51,15 +134,49 @@ class MustExistDirectory:
         return self._full_path
 
 
+class HashingWriter:
+    """
+    Binary file object wrapper computing the md5 digest of written data,
+    so that files are not read again to be named after their hash
+    """
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self._hasher = hashlib.md5()
+
+    def write(self, data):
+        with profiling.stage("hash"):
+            self._hasher.update(data)
+        return self._file_obj.write(data)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file_obj, name)
+
+
 class FinalizedTempFile:
+    """
+    Temporary file created next to its final path, hidden, so that finalizing is
+    an atomic rename within the same filesystem
+    The final path may be changed until the context exits, to name files after their content
+    """
 
-    def __init__(self, final_path, file_mode):
+    TEMP_SUFFIX = ".tmp"
+
+    def __init__(self, final_path, file_mode, hashed=False):
         self.final_path = final_path
         self.file_mode = file_mode
+        self._hashed = hashed
         self._temp_fileobj = None
 
     def __enter__(self):
-        self._temp_fileobj = tempfile.NamedTemporaryFile(mode=self.file_mode, delete=False)
+        directory, name = os.path.split(self.final_path)
+        self._temp_fileobj = tempfile.NamedTemporaryFile(mode=self.file_mode, delete=False, dir=directory or ".",
+                                                         prefix=".{0}.".format(name), suffix=self.TEMP_SUFFIX)
+        if self._hashed:
+            return HashingWriter(self._temp_fileobj)
         return self._temp_fileobj
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
@@ -76,8 +193,8 @@ class FinalizedTempFile:
             self._cleanup()
 
     def _finalize(self):
-        logging.debug("Moving %s to %s", self._temp_fileobj.name, self.final_path)
-        shutil.move(self._temp_fileobj.name, self.final_path)
+        logging.debug("Renaming %s to %s", self._temp_fileobj.name, self.final_path)
+        os.replace(self._temp_fileobj.name, self.final_path)
 
     def _cleanup(self):
         if self._temp_fileobj is not None:
@@ -98,6 +215,8 @@ def md5_file(file_path):
 
 
 def delete_file(file_name, swallow_exceptions=True):
+    from path import Path
+
     file_path = Path(file_name).expand().abspath()
     logging.debug("Ensuring that temporary file %s is removed", file_path)
     try:
@@ -2,6 +2,11 @@ from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
 
 import sqlalchemy.ext.declarative
 
+from .filetools import IntegerStateFile
+
+# bump whenever table declarations below change
+SCHEMA_VERSION = 1
+
 DeclarativeBase = sqlalchemy.ext.declarative.declarative_base(
     metadata=sqlalchemy.MetaData(schema='smutty')
 )
@@ -119,3 +124,17 @@ class Video(Item):
 # must be last as it collects info from previous table declarations
 def create_all_tables(engine):
     DeclarativeBase.metadata.create_all(engine)
+
+
+def ensure_all_tables(engine, schema_version_state_file=None):
+    """
+    Only reflects the database schema when the cached schema version is outdated
+    """
+    if schema_version_state_file is None:
+        create_all_tables(engine)
+        return
+    schema_version_state = IntegerStateFile(schema_version_state_file)
+    if schema_version_state.get() == SCHEMA_VERSION:
+        return
+    create_all_tables(engine)
+    schema_version_state.set(SCHEMA_VERSION)
@@ -0,0 +1,202 @@
+"""
+Whole-run profiling of entry points, enabled from the command line (see runner),
+and wall-clock markers of logical stages, which cost nothing when profiling is off
+"""
+import collections
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+
+
+class RunProfiler:
+    """
+    Profiles a run, either deterministically (cProfile, thread running the entry point only)
+    or by sampling stacks of all threads, and accumulates time spent in stages per unit
+    of work (page or block), nested stages being included in enclosing ones
+
+    Reports, prefixed with the output prefix:
+    - .pstats, for deterministic profiles (pstats, snakeviz, gprof2dot)
+    - .collapsed, for sampled profiles, one "frame;frame;frame count" line per stack (flamegraph.pl, speedscope)
+    - .stages.tsv, seconds per unit and stage
+    """
+
+    MODES = ("cpu", "sample")
+
+    DEFAULT_SAMPLE_INTERVAL = 0.005
+
+    def __init__(self, mode, output_prefix, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        assert mode in self.MODES
+        self.mode = mode
+        self.output_prefix = output_prefix
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        self._unit = "run"
+        self._stage_times = collections.OrderedDict()
+        # stage stacks by thread id, so that samples can be labelled with their stage
+        self._stages = collections.defaultdict(list)
+        self._samples = collections.Counter()
+        self._profile = None
+        self._sampler = None
+        self._stopping = threading.Event()
+
+    def __repr__(self):
+        return "{0}({mode}, {output_prefix})".format(self.__class__.__name__, **self.__dict__)
+
+    def set_unit(self, name):
+        with self._lock:
+            self._unit = name
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stages = self._stages[threading.get_ident()]
+        stages.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stages.pop()
+            with self._lock:
+                unit_times = self._stage_times.setdefault(self._unit, collections.Counter())
+                unit_times[name] += duration
+
+    def start(self):
+        logging.info("Profiling run (%s), reports prefixed with %s", self.mode, self.output_prefix)
+        if self.mode == "cpu":
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.output_prefix + ".pstats")
+            self.log_functions()
+        if self._sampler is not None:
+            self._stopping.set()
+            self._sampler.join()
+            self.write_collapsed_stacks()
+        self.write_stage_table()
+
+    @staticmethod
+    def frame_label(frame):
+        code = frame.f_code
+        return "{0}:{1}".format(os.path.basename(code.co_filename), code.co_name)
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        while not self._stopping.wait(self.sample_interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self.frame_label(frame))
+                    frame = frame.f_back
+                labels.reverse()
+                stages = self._stages.get(ident)
+                if stages:
+                    labels.insert(0, "[{0}]".format(stages[-1]))
+                self._samples[";".join(labels)] += 1
+
+    def write_collapsed_stacks(self):
+        file_name = self.output_prefix + ".collapsed"
+        with open(file_name, "wt") as file_obj:
+            for stack, count in sorted(self._samples.items()):
+                file_obj.write("{0} {1}\n".format(stack, count))
+        logging.info("Profile: %d samples of %d stacks written to %s",
+                     sum(self._samples.values()), len(self._samples), file_name)
+
+    def log_functions(self, count=20):
+        import io
+        import pstats
+
+        output = io.StringIO()
+        pstats.Stats(self._profile, stream=output).sort_stats("cumulative").print_stats(count)
+        for line in output.getvalue().splitlines():
+            if line.strip():
+                logging.info("Profile: %s", line)
+
+    def write_stage_table(self):
+        stages = sorted({stage for unit_times in self._stage_times.values() for stage in unit_times})
+        file_name = self.output_prefix + ".stages.tsv"
+        with open(file_name, "wt") as file_obj:
+            file_obj.write("\t".join(["unit"] + stages) + "\n")
+            for unit, unit_times in self._stage_times.items():
+                file_obj.write("\t".join([unit] + ["{0:.6f}".format(unit_times[stage]) for stage in stages]) + "\n")
+        totals = collections.Counter()
+        for unit_times in self._stage_times.values():
+            totals.update(unit_times)
+        for stage in stages:
+            logging.info("Profile: stage %-10s %8.3fs over %d units", stage, totals[stage],
+                         sum(1 for unit_times in self._stage_times.values() if stage in unit_times))
+        logging.info("Profile: stage times per unit written to %s", file_name)
+
+
+_profiler = None
+
+_NO_STAGE = contextlib.suppress()
+
+
+def start(mode, output_prefix):
+    global _profiler
+    _profiler = RunProfiler(mode, output_prefix)
+    _profiler.start()
+    return _profiler
+
+
+def stop():
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler = None
+
+
+def stage(name):
+    """
+    Allows instrumenting code regardless of profiling being enabled
+    """
+    if _profiler is None:
+        return _NO_STAGE
+    return _profiler.stage(name)
+
+
+class TimedWriter:
+    """
+    File object wrapper accounting time spent in writes to a stage
+    """
+
+    def __init__(self, file_obj, name):
+        self._file_obj = file_obj
+        self._name = name
+
+    def write(self, data):
+        with stage(self._name):
+            return self._file_obj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file_obj, name)
+
+
+def timed_writes(file_obj, name):
+    """
+    Returns the file object itself when profiling is off
+    """
+    if _profiler is None:
+        return file_obj
+    return TimedWriter(file_obj, name)
+
+
+def set_unit(name):
+    """
+    Following stage times are accounted to this unit of work
+    """
+    if _profiler is not None:
+        _profiler.set_unit(name)
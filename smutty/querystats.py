@@ -0,0 +1,158 @@
+import contextlib
+import heapq
+import logging
+import threading
+import time
+
+from .exceptions import QueryBudgetExceeded
+
+
+class StageStatistics:
+
+    SLOWEST_COUNT = 5
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_time = 0.0
+        # min-heap of (duration, statement), keeps only the slowest ones
+        self._slowest = []
+
+    def __repr__(self):
+        return "{0}({name}, {count}, {total_time:.3f})".format(self.__class__.__name__, **self.__dict__)
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        entry = (duration, statement)
+        if len(self._slowest) < self.SLOWEST_COUNT:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+
+class QueryProfiler:
+    """
+    Counts and times SQL statements issued through an engine,
+    grouped by the logical stage active in the issuing thread
+    """
+
+    DEFAULT_STAGE = "other"
+
+    START_TIMES_KEY = "smutty_query_start_times"
+
+    def __init__(self, budgets=None, enforce_budgets=False):
+        # budgets are per run, and only checked once it completes, so that
+        # an overrun never interrupts units of work halfway
+        self._budgets = budgets or {}
+        self._enforce_budgets = enforce_budgets
+        self._statistics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, list(self._statistics.values()))
+
+    def __deepcopy__(self, memo):
+        # scrapy copies its settings, statistics must stay shared
+        return self
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a profiler if enabled in the database section, None otherwise
+        """
+        if not config.get_boolean('database', 'profile_queries'):
+            return None
+        budgets = {}
+        if config.has_section('query_budgets'):
+            budgets = {
+                stage: config.get_integer('query_budgets', stage)
+                for stage in config.get('query_budgets')
+            }
+        enforce_budgets = config.get_boolean('database', 'enforce_query_budgets')
+        return cls(budgets, enforce_budgets)
+
+    def attach(self, engine):
+        import sqlalchemy.event
+
+        sqlalchemy.event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        sqlalchemy.event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def current_stage(self):
+        stages = getattr(self._local, "stages", None)
+        return stages[-1] if stages else self.DEFAULT_STAGE
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stages = getattr(self._local, "stages", None)
+        if stages is None:
+            stages = self._local.stages = []
+        stages.append(name)
+        try:
+            yield
+        finally:
+            stages.pop()
+
+    def statistics(self, name):
+        with self._lock:
+            statistics = self._statistics.get(name)
+            if statistics is None:
+                statistics = self._statistics[name] = StageStatistics(name)
+            return statistics
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(self.START_TIMES_KEY, []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info[self.START_TIMES_KEY].pop()
+        statistics = self.statistics(self.current_stage())
+        with self._lock:
+            statistics.record(statement, duration)
+
+    def check_budget(self, name):
+        budget = self._budgets.get(name)
+        statistics = self._statistics.get(name)
+        if budget is None or statistics is None:
+            return
+        if statistics.count > budget:
+            raise QueryBudgetExceeded("Stage '{0}' issued {1} queries, exceeding its budget of {2}".format(
+                name, statistics.count, budget))
+
+    def check_budgets(self):
+        """
+        Called at the end of runs, raises on the first overrun when budgets are enforced
+        """
+        if not self._enforce_budgets:
+            return
+        for name in sorted(self._budgets):
+            self.check_budget(name)
+
+    def log_report(self, logger=None):
+        logger = logger or logging.getLogger('')
+        if not self._statistics:
+            logger.info("Query profile: no statement issued")
+            return
+        for statistics in sorted(self._statistics.values(), key=lambda s: s.total_time, reverse=True):
+            budget = self._budgets.get(statistics.name)
+            logger.info("Query profile: stage '%s' issued %d statements in %.3fs (budget %s)",
+                        statistics.name, statistics.count, statistics.total_time, budget)
+            for duration, statement in statistics.slowest:
+                logger.debug("Query profile: stage '%s' slow statement %.3fs: %s",
+                             statistics.name, duration, " ".join(statement.split()))
+            if budget is not None and statistics.count > budget:
+                logger.warning("Query profile: stage '%s' exceeded its budget of %d statements",
+                               statistics.name, budget)
+
+
+def profiled_stage(profiler, name):
+    """
+    Allows instrumenting code regardless of profiling being enabled
+    """
+    if profiler is None:
+        return contextlib.suppress()
+    return profiler.stage(name)
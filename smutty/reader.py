@@ -0,0 +1,351 @@
+"""
+Client-side access to exported packages, from a local directory or a web server
+"""
+import bisect
+import json
+import logging
+import lzma
+import os
+import re
+import urllib.parse
+import urllib.request
+
+from path import Path
+
+from .bloom import BloomFilter
+from .exceptions import SmuttyException
+from .exporter.serializers import CompactItemEncoder
+
+
+class DirectorySource:
+    """
+    Exporter output directory on the local filesystem
+    """
+
+    def __init__(self, directory):
+        self._directory = Path(directory).expand().abspath()
+
+    def __repr__(self):
+        return "{0}({_directory})".format(self.__class__.__name__, **self.__dict__)
+
+    def read(self, name):
+        try:
+            return (self._directory / name).bytes()
+        except FileNotFoundError as exception:
+            raise SmuttyException("Could not find file: {0}".format(exception))
+
+    def read_range(self, name, offset, length):
+        try:
+            with open(self._directory / name, "rb") as file_obj:
+                file_obj.seek(offset)
+                return file_obj.read(length)
+        except FileNotFoundError as exception:
+            raise SmuttyException("Could not find file: {0}".format(exception))
+
+
+class HttpSource:
+    """
+    Exporter output published on a static web server
+    """
+
+    def __init__(self, base_url):
+        self._base_url = base_url if base_url.endswith("/") else base_url + "/"
+
+    def __repr__(self):
+        return "{0}({_base_url})".format(self.__class__.__name__, **self.__dict__)
+
+    def _request(self, name, headers=None):
+        url = urllib.parse.urljoin(self._base_url, name)
+        request = urllib.request.Request(url, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.read()
+        except OSError as exception:
+            raise SmuttyException("Could not fetch {0}: {1}".format(url, exception))
+
+    def read(self, name):
+        return self._request(name)
+
+    def read_range(self, name, offset, length):
+        return self._request(name, {"Range": "bytes={0}-{1}".format(offset, offset + length - 1)})
+
+
+def open_source(location):
+    if re.match(r"^https?://", location):
+        return HttpSource(location)
+    return DirectorySource(location)
+
+
+class PackageInfo:
+
+    def __init__(self, info):
+        self.content_type = info["content_type"]
+        self.min_id = int(info["min_id"])
+        self.max_id = int(info["max_id"])
+        self.hash_digest = info["hash_digest"]
+        self.frames = info.get("frames")
+        self.bloom = info.get("bloom")
+        # archived packages are a slice of a decompressed bundle
+        self.bundle = info.get("bundle")
+        self.offset = info.get("offset")
+        self.length = info.get("length")
+
+    def __repr__(self):
+        return "{0}({content_type}, {min_id}, {max_id}, {hash_digest})".format(self.__class__.__name__, **self.__dict__)
+
+    @property
+    def file_name(self):
+        return "{0}-{1}-{2}-{3}.jsonl.xz".format(self.content_type, self.min_id, self.max_id, self.hash_digest)
+
+    def overlaps(self, min_id=None, max_id=None):
+        return (min_id is None or min_id <= self.max_id) and (max_id is None or self.min_id <= max_id)
+
+
+class PackageIndex:
+
+    INDEX_NAME = "index.json.xz"
+
+    def __init__(self, packages):
+        # delta packages come after the block package they complete
+        self._packages = sorted(packages, key=lambda p: (p.min_id, -p.max_id, p.content_type))
+
+    def __len__(self):
+        return len(self._packages)
+
+    @classmethod
+    def load(cls, source):
+        data = json.loads(lzma.decompress(source.read(cls.INDEX_NAME)).decode())
+        return cls(PackageInfo(info) for info in data)
+
+    def select(self, min_id=None, max_id=None, content_type=None):
+        return [
+            package for package in self._packages
+            if (content_type is None or package.content_type == content_type)
+            and package.overlaps(min_id, max_id)
+        ]
+
+
+class ShardedPackageIndex:
+    """
+    Two-level index, of which only the shards overlapping a requested id range
+    are fetched, located by binary search in the root
+    """
+
+    DIRECTORY = "shards"
+
+    ROOT_NAME = "root.json.xz"
+
+    def __init__(self, source, shards):
+        self._source = source
+        self._shards = sorted(shards, key=lambda shard: shard["min_id"])
+        self._shard_max_ids = [shard["max_id"] for shard in self._shards]
+        self._loaded = {}
+
+    def __len__(self):
+        return sum(shard["packages"] for shard in self._shards)
+
+    @classmethod
+    def load(cls, source):
+        data = json.loads(lzma.decompress(source.read(cls.DIRECTORY + "/" + cls.ROOT_NAME)).decode())
+        return cls(source, data["shards"])
+
+    def shard_packages(self, shard):
+        if shard["file"] not in self._loaded:
+            data = json.loads(lzma.decompress(self._source.read(self.DIRECTORY + "/" + shard["file"])).decode())
+            self._loaded[shard["file"]] = PackageIndex(PackageInfo(info) for info in data)
+        return self._loaded[shard["file"]]
+
+    def select(self, min_id=None, max_id=None, content_type=None):
+        start = 0 if min_id is None else bisect.bisect_left(self._shard_max_ids, min_id)
+        result = []
+        for shard in self._shards[start:]:
+            if max_id is not None and shard["min_id"] > max_id:
+                break
+            result.extend(self.shard_packages(shard).select(min_id, max_id, content_type))
+        return result
+
+
+class PackageCache:
+    """
+    Decompressed packages on local disk, keyed by hash digest, evicted least recently used first
+    """
+
+    def __init__(self, directory, max_bytes):
+        self._directory = Path(directory).expand().abspath()
+        self._directory.mkdir_p()
+        self._max_bytes = max_bytes
+
+    def __repr__(self):
+        return "{0}({_directory}, {_max_bytes})".format(self.__class__.__name__, **self.__dict__)
+
+    def _path(self, hash_digest):
+        return self._directory / "{0}.jsonl".format(hash_digest)
+
+    def get(self, hash_digest):
+        path = self._path(hash_digest)
+        if not path.exists():
+            return None
+        # modification time tracks last use
+        os.utime(path)
+        return path
+
+    def put(self, hash_digest, data):
+        path = self._path(hash_digest)
+        tmp_path = self._directory / ".{0}.tmp".format(hash_digest)
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = sorted(self._directory.files("*.jsonl"), key=lambda p: p.mtime)
+        total = sum(entry.size for entry in entries)
+        for entry in entries:
+            if total <= self._max_bytes:
+                break
+            logging.debug("Evicting cached package %s", entry)
+            total -= entry.size
+            entry.remove()
+
+
+class Reader:
+    """
+    Streams items lazily, only fetching packages (or frames) matching id range and
+    content type filters, and only decoding lines which may match tag filters
+    """
+
+    DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+    def __init__(self, location, cache_directory=None, cache_size=DEFAULT_CACHE_SIZE):
+        self._source = open_source(location)
+        self._cache = PackageCache(cache_directory, cache_size) if cache_directory else None
+        self._index = None
+        # last decompressed bundle, as (name, data), since consecutive packages share it
+        self._bundle = None
+        self._bloom_filters = {}
+
+    def __repr__(self):
+        return "{0}({_source}, {_cache})".format(self.__class__.__name__, **self.__dict__)
+
+    @property
+    def index(self):
+        if self._index is None:
+            # the sharded index is preferred, when published
+            try:
+                self._index = ShardedPackageIndex.load(self._source)
+            except SmuttyException:
+                self._index = PackageIndex.load(self._source)
+        return self._index
+
+    def packages(self, min_id=None, max_id=None, content_type=None):
+        return self.index.select(min_id, max_id, content_type)
+
+    def _bundle_data(self, package):
+        if self._bundle is None or self._bundle[0] != package.bundle:
+            self._bundle = (package.bundle, lzma.decompress(self._source.read(package.bundle)))
+        return self._bundle[1][package.offset:package.offset + package.length]
+
+    def _package_lines(self, package):
+        cached_path = self._cache.get(package.hash_digest) if self._cache else None
+        if cached_path is None:
+            if package.bundle:
+                data = self._bundle_data(package)
+            else:
+                data = lzma.decompress(self._source.read(package.file_name))
+            if self._cache:
+                self._cache.put(package.hash_digest, data)
+            yield from data.splitlines()
+            return
+        with open(cached_path, "rb") as file_obj:
+            yield from file_obj
+
+    def _frame_lines(self, package, min_id, max_id):
+        table = json.loads(self._source.read(package.frames).decode())
+        # compactly encoded packages start with a header, needed to expand items
+        header = table.get("header")
+        if header is not None:
+            data = self._source.read_range(package.file_name, header["offset"], header["length"])
+            yield from lzma.decompress(data).splitlines()
+        for frame in table["frames"]:
+            if (min_id is None or min_id <= frame["max_id"]) and (max_id is None or frame["min_id"] <= max_id):
+                data = self._source.read_range(package.file_name, frame["offset"], frame["length"])
+                yield from lzma.decompress(data).splitlines()
+
+    def lines(self, package, min_id=None, max_id=None):
+        """
+        Raw json lines of a package, only fetching matching frames of seekable packages
+        """
+        partial = (min_id is not None and package.min_id < min_id) or (max_id is not None and max_id < package.max_id)
+        whole_cached = self._cache and self._cache.get(package.hash_digest)
+        if package.frames and partial and not whole_cached:
+            return self._frame_lines(package, min_id, max_id)
+        return self._package_lines(package)
+
+    def bloom_filter(self, package):
+        if package.bloom not in self._bloom_filters:
+            self._bloom_filters[package.bloom] = BloomFilter.from_bytes(self._source.read(package.bloom))
+        return self._bloom_filters[package.bloom]
+
+    def may_contain(self, item_id=None, url=None):
+        """
+        Packages which may hold the item id or media url, only downloading their bloom filters
+        Packages without bloom filter are always returned
+        """
+        result = []
+        for package in self.packages(item_id, item_id):
+            if package.bloom is None:
+                result.append(package)
+                continue
+            bloom_filter = self.bloom_filter(package)
+            if (item_id is None or item_id in bloom_filter) and (url is None or url in bloom_filter):
+                result.append(package)
+        return result
+
+    def submitter_items(self, submitter):
+        """
+        Items of one submitter, from its submitter view bucket
+        """
+        index = json.loads(lzma.decompress(self._source.read("submitters/index.json.xz")).decode())
+        bucket = index["submitters"].get(submitter)
+        if bucket is None:
+            return
+        data = lzma.decompress(self._source.read("submitters/" + index["packages"][str(bucket)]))
+        header = None
+        for line in data.splitlines():
+            item = json.loads(line.decode())
+            if CompactItemEncoder.HEADER_KEY in item:
+                header = item[CompactItemEncoder.HEADER_KEY]
+                continue
+            if item["submitter"] != submitter:
+                continue
+            if header is not None:
+                CompactItemEncoder.expand_item(header, item)
+            yield item
+
+    def items(self, min_id=None, max_id=None, content_type=None, tags=None):
+        """
+        Items holding all requested tags, in package order
+        """
+        tags = set(tags or [])
+        # cheap substring test before decoding, may give false positives
+        needles = [json.dumps(tag).encode() for tag in tags]
+        header_start = '{{"{0}":'.format(CompactItemEncoder.HEADER_KEY).encode()
+        for package in self.packages(min_id, max_id, content_type):
+            header = None
+            for line in self.lines(package, min_id, max_id):
+                if line.startswith(header_start):
+                    header = json.loads(line.decode())[CompactItemEncoder.HEADER_KEY]
+                    continue
+                if not all(needle in line for needle in needles):
+                    continue
+                item = json.loads(line.decode())
+                if header is not None:
+                    CompactItemEncoder.expand_item(header, item)
+                if min_id is not None and item["item_id"] < min_id:
+                    continue
+                if max_id is not None and item["item_id"] > max_id:
+                    continue
+                if not tags.issubset(item["tags"]):
+                    continue
+                item["content_type"] = package.content_type
+                yield item
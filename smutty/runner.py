@@ -1,14 +1,43 @@
+import argparse
 import logging
+import sys
+import time
 
-from .exceptions import SmuttyException
+from . import profiling
+from .exceptions import SmuttyException, QueryBudgetExceeded
+
+
+def profiling_arguments():
+    """
+    Profiling options are common to entry points, and removed before applications parse theirs
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--profile", choices=profiling.RunProfiler.MODES,
+                        help="cpu: deterministic, sample: stack sampling of all threads")
+    parser.add_argument("--profile-output", metavar="PREFIX",
+                        help="prefix of profile reports, entry point and start time by default")
+    args, remaining = parser.parse_known_args()
+    sys.argv[1:] = remaining
+    return args
 
 
 def run(runnable_cls):
+    args = profiling_arguments()
+    if args.profile:
+        entry_point = runnable_cls.__module__.rsplit(".", 1)[0]
+        output_prefix = args.profile_output or "{0}-{1}".format(entry_point, time.strftime("%Y%m%d-%H%M%S"))
+        profiling.start(args.profile, output_prefix)
     try:
         runnable = runnable_cls()
         runnable.run()
+    except QueryBudgetExceeded as exception:
+        # raised once the run completed, which must still fail
+        logging.error("%s", exception)
+        sys.exit(1)
     except SmuttyException as exception:
         logging.error("%s", exception)
     except Exception as exception:
         logging.critical("%s: %s", exception.__class__.__name__, exception)
         raise
+    finally:
+        profiling.stop()
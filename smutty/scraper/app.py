@@ -2,20 +2,70 @@
 foo
 """
 import argparse
+import logging
 import sys
 
-import scrapy
-import scrapy.crawler
-import scrapy.utils.project
-
 from ..config import ConfigurationFile
-from ..db import DatabaseConfiguration
 from ..exceptions import SmuttyException
-from ..filetools import IntegerStateFile
-
-import smutty.scraper.settings
-
-from .spiders import SmuttySpider
+from ..filetools import IntegerStateFile, ItemIdsStateFile
+
+# scrapy, twisted and sqlalchemy are only imported once there is work to do,
+# so that no-op invocations (from cron) stay cheap
+
+
+def load_blacklisted_tags(file_name):
+    if not file_name:
+        return set()
+    try:
+        with open(file_name) as file_obj:
+            return {tag.lower() for line in file_obj for tag in line.split()}
+    except FileNotFoundError as exc:
+        raise SmuttyException(exc)
+
+
+def build_settings(config, page_count=None, blacklisted_tags=None, locate_id=None, refresh_start_page=None,
+                   walk_min_id=None):
+    import scrapy.utils.project
+
+    import smutty.scraper.settings
+
+    from ..db import DatabaseConfiguration
+    from ..querystats import QueryProfiler
+
+    from .throttle import AdaptiveThrottle
+
+    database_configuration = DatabaseConfiguration(config.get('database'))
+
+    settings = scrapy.utils.project.get_project_settings()
+    settings.setmodule(smutty.scraper.settings)
+
+    settings.set("SMUTTY_PAGE_COUNT", page_count)
+    settings.set("SMUTTY_BLACKLIST_TAGS", blacklisted_tags or set())
+    settings.set("SMUTTY_LOCATE_ID", locate_id)
+    settings.set("SMUTTY_REFRESH_START_PAGE", refresh_start_page)
+    settings.set("SMUTTY_WALK_MIN_ID", walk_min_id)
+    settings.set("SMUTTY_REFRESH_BATCH_SIZE", config.get_integer('scraper', 'refresh_batch_size', 100))
+    if refresh_start_page is not None:
+        settings.set("ITEM_PIPELINES", {'smutty.scraper.pipelines.SmuttyRefreshPipeline': 300})
+    settings.set("SMUTTY_PAGE_URL", config.get('scraper').get('page_url'))
+    settings.set("SMUTTY_PAGE_ARCHIVE", config.get('scraper').get('page_archive'))
+    settings.set("SMUTTY_THROTTLE_ENABLED", config.get_boolean('scraper', 'throttle'))
+    # otherwise dropped before reaching the spider, retries being delayed by the throttling extension
+    retry_http_codes = set(settings.getlist("RETRY_HTTP_CODES")) | AdaptiveThrottle.BACKOFF_STATUSES
+    settings.set("RETRY_HTTP_CODES", sorted(retry_http_codes))
+    settings.set("SMUTTY_THROTTLE_MIN_DELAY", config.get_float('scraper', 'throttle_min_delay', 0.5))
+    settings.set("SMUTTY_THROTTLE_MAX_DELAY", config.get_float('scraper', 'throttle_max_delay', 60.0))
+    settings.set("SMUTTY_THROTTLE_MAX_COMMIT_LATENCY", config.get_float('scraper', 'throttle_max_commit_latency', 0.5))
+    settings.set("SMUTTY_DATABASE_CONFIGURATION_URL", database_configuration.url)
+    settings.set("SMUTTY_DATABASE_ENGINE_OPTIONS", database_configuration.engine_options)
+    settings.set("SMUTTY_QUERY_PROFILER", QueryProfiler.from_config(config))
+    settings.set("SMUTTY_STATE_FILE_CURRENT_SCRAPER_PAGE", config.get('scraper', 'current_scraper_page'))
+    settings.set("SMUTTY_STATE_FILE_HIGHEST_SCRAPER_ID", config.get('scraper', 'highest_scraper_id'))
+    settings.set("SMUTTY_STATE_FILE_LOWEST_SCRAPER_ID", config.get('scraper', 'lowest_scraper_id'))
+    settings.set("SMUTTY_STATE_FILE_SCHEMA_VERSION", config.get('database').get('schema_version'))
+    settings.set("SMUTTY_STATE_FILE_LOWEST_ITEM_ID", config.get('database').get('lowest_item_id'))
+    settings.set("SMUTTY_STATE_FILE_REFRESHED_ITEMS", config.get('scraper').get('refreshed_items'))
+    return settings
 
 
 class App:
@@ -26,10 +76,17 @@ class App:
     def __init__(self):
         # analyze commande line arguments
         parser = argparse.ArgumentParser(description="Smutty metadata scrapper")
-        parser.add_argument("-s", "--start-page", metavar="START_PAGE", type=int)
+        start = parser.add_mutually_exclusive_group()
+        start.add_argument("-s", "--start-page", metavar="START_PAGE", type=int)
+        start.add_argument("-l", "--locate-id", metavar="ITEM_ID", type=int,
+                           help="search the page listing this id, and backfill from there")
         parser.add_argument("-c", "--page-count", metavar="PAGE_COUNT", type=int)
         parser.add_argument("-m", "--min-id", metavar="MIN_ID", type=int)
         parser.add_argument("-b", "--blacklist-tag-file", metavar="BLACKLIST_FILE")
+        parser.add_argument("-r", "--refresh", action="store_true",
+                            help="update fields and tags of known items, leaving crawl states untouched")
+        parser.add_argument("--reingest", action="store_true", help="parse archived pages instead of crawling")
+        parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, help="parser processes when reingesting")
         parser.add_argument("config", metavar="CONFIG", nargs='?', default=ConfigurationFile.DEFAULT_CONFIG_FILE)
         args = parser.parse_args()
 
@@ -40,11 +97,34 @@ class App:
         # load configuration
         self._config = ConfigurationFile(args.config)
 
+        # reingestion and refresh leave crawl states untouched
+        self._reingest = args.reingest
+        self._refresh = args.refresh
+        self._jobs = args.jobs
+        if self._reingest and not self._config.get('scraper').get('page_archive'):
+            raise SmuttyException("Reingesting requires a page_archive in the scraper configuration")
+
+        # load blacklist tags
+        self._blacklisted_tags = load_blacklisted_tags(args.blacklist_tag_file)
+        if self._reingest:
+            # scrapy is not there to configure logging
+            logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+            return
+
+        self._page_count = args.page_count
+        self._locate_id = args.locate_id
+        self._refresh_start_page = None
+        if self._refresh:
+            self._refresh_start_page = args.start_page or 1
+        # refresh and backfill walks are bounded by the minimum id given, if any
+        self._walk_min_id = args.min_id
+        if self._refresh or self._locate_id is not None:
+            return
+
         # process configuration
         self._current_scraper_page_state = IntegerStateFile(self._config.get('scraper', 'current_scraper_page'))
         self._highest_scraper_id_state = IntegerStateFile(self._config.get('scraper', 'highest_scraper_id'))
         self._lowest_scraper_id_state = IntegerStateFile(self._config.get('scraper', 'lowest_scraper_id'))
-        self._database_url = DatabaseConfiguration(self._config.get('database')).url
 
         # manage start page :
         # - start based on state file
@@ -67,30 +147,52 @@ class App:
         if min_id is not None:
             self._lowest_scraper_id_state.set(min_id)
 
-        # load blacklist tags
-        blacklisted_tags = set()
-        if args.blacklist_tag_file:
-            try:
-                with open(args.blacklist_tag_file) as file_obj:
-                    blacklisted_tags = {tag.lower() for line in file_obj for tag in line.split()}
-            except FileNotFoundError as exc:
-                raise SmuttyException(exc)
-
-        # manage settings
-        self._settings = scrapy.utils.project.get_project_settings()
-        self._settings.setmodule(smutty.scraper.settings)
-
-        self._settings.set("SMUTTY_PAGE_COUNT", args.page_count)
-        self._settings.set("SMUTTY_BLACKLIST_TAGS", blacklisted_tags)
-        self._settings.set("SMUTTY_DATABASE_CONFIGURATION_URL", self._database_url)
-        self._settings.set("SMUTTY_STATE_FILE_CURRENT_SCRAPER_PAGE", self._current_scraper_page_state.file_name)
-        self._settings.set("SMUTTY_STATE_FILE_HIGHEST_SCRAPER_ID", self._highest_scraper_id_state.file_name)
-        self._settings.set("SMUTTY_STATE_FILE_LOWEST_SCRAPER_ID", self._lowest_scraper_id_state.file_name)
+    def build_settings(self):
+        return build_settings(self._config, self._page_count, self._blacklisted_tags, self._locate_id,
+                              self._refresh_start_page, self._walk_min_id)
+
+    def reingest(self):
+        from ..db import DatabaseConfiguration
+        from ..querystats import QueryProfiler
+
+        from .archive import PageArchive, reingest
+        from .pipelines import SmuttyRefreshPipeline
+
+        # items already stored are updated, to recover fields of a fixed parser
+        archive = PageArchive(self._config.get('scraper', 'page_archive'))
+        database_configuration = DatabaseConfiguration(self._config.get('database'))
+        profiler = QueryProfiler.from_config(self._config)
+        pipeline = SmuttyRefreshPipeline(database_configuration.url,
+                                         database_configuration.engine_options,
+                                         profiler,
+                                         self._config.get('database').get('schema_version'),
+                                         lowest_item_id_state_file=self._config.get('database').get('lowest_item_id'))
+        pipeline.batch_size = self._config.get_integer('scraper', 'refresh_batch_size', 100)
+        # known items which gained a blacklisted tag are deleted by the pipeline, rather than skipped
+        pipeline.blacklisted_tags = self._blacklisted_tags
+        if self._config.get('scraper').get('refreshed_items'):
+            pipeline.refreshed_items = ItemIdsStateFile(self._config.get('scraper').get('refreshed_items'))
+        page_count, item_count = reingest(archive, pipeline, processes=self._jobs)
+        logging.info("Reingested %d items from %d archived pages", item_count, page_count)
+        return profiler
 
     def run(self):
         """
         foo
         """
-        process = scrapy.crawler.CrawlerProcess(self._settings)
-        process.crawl(SmuttySpider)
-        process.start()  # it blocks here until finished
+        if self._reingest:
+            profiler = self.reingest()
+        else:
+            import scrapy.crawler
+
+            from .spiders import SmuttySpider
+
+            settings = self.build_settings()
+            process = scrapy.crawler.CrawlerProcess(settings)
+            process.crawl(SmuttySpider)
+            process.start()  # it blocks here until finished
+            profiler = settings.get("SMUTTY_QUERY_PROFILER")
+
+        # checked once the run is complete, reported by the pipeline
+        if profiler is not None:
+            profiler.check_budgets()
@@ -0,0 +1,128 @@
+import datetime
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import pytz
+import scrapy.exceptions
+import scrapy.http
+
+from ..exceptions import SmuttyException
+
+from .spiders import SmuttySpider
+
+
+class PageArchive:
+    """
+    Append-only archive of fetched page bodies, each one an independent gzip member,
+    so that the data file remains a valid gzip file, and an index of json lines
+    giving url, page number, fetch time, body encoding, offset and length of every record
+    """
+
+    INDEX_SUFFIX = ".idx"
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.index_file_name = file_name + self.INDEX_SUFFIX
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.file_name)
+
+    # of records written before encodings were archived
+    DEFAULT_ENCODING = "utf-8"
+
+    def append(self, url, page_number, body, fetched_at, encoding=None):
+        data = gzip.compress(body)
+        with open(self.file_name, "ab") as file_obj:
+            offset = file_obj.seek(0, os.SEEK_END)
+            file_obj.write(data)
+        # data is written first, so that the index never references missing bytes
+        record = {"url": url, "page": page_number, "fetched_at": fetched_at,
+                  "encoding": encoding or self.DEFAULT_ENCODING, "offset": offset, "length": len(data)}
+        with open(self.index_file_name, "at") as file_obj:
+            file_obj.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def records(self):
+        try:
+            with open(self.index_file_name, "rt") as file_obj:
+                for line in file_obj:
+                    # an interrupted append may leave a truncated last line
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logging.warning("Ignoring truncated archive index line")
+        except FileNotFoundError as exception:
+            raise SmuttyException("Could not find file: {0}".format(exception))
+
+    def read(self, record):
+        with open(self.file_name, "rb") as file_obj:
+            file_obj.seek(record["offset"])
+            return gzip.decompress(file_obj.read(record["length"]))
+
+
+class PageArchiveMiddleware:
+    """
+    Downloader middleware appending every fetched page to the archive
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        file_name = crawler.settings.get("SMUTTY_PAGE_ARCHIVE")
+        if not file_name:
+            raise scrapy.exceptions.NotConfigured()
+        return cls(PageArchive(file_name), crawler.stats)
+
+    def __init__(self, archive, stats):
+        self._archive = archive
+        self._stats = stats
+
+    def process_response(self, request, response, spider):
+        if response.status == 200:
+            # as found from headers, or the body, which are not archived
+            encoding = getattr(response, "encoding", None)
+            self._archive.append(response.url, request.meta.get("page_number"), response.body, time.time(), encoding)
+            self._stats.inc_value("page_archive/pages")
+            self._stats.inc_value("page_archive/bytes", len(response.body))
+        return response
+
+
+def parse_record(arguments):
+    """
+    Items of one archived page, dated with its fetch time
+    Module-level so that it can run in worker processes
+    """
+    file_name, record, blacklisted_tags = arguments
+    body = PageArchive(file_name).read(record)
+    encoding = record.get("encoding", PageArchive.DEFAULT_ENCODING)
+    response = scrapy.http.HtmlResponse(url=record["url"], body=body, encoding=encoding)
+    last_updated = datetime.datetime.fromtimestamp(record["fetched_at"], pytz.UTC)
+    items = []
+    for block in SmuttySpider.page_blocks(response):
+        item = SmuttySpider.parse_block(block, last_updated)
+        if not blacklisted_tags.intersection(item.tags):
+            items.append(item)
+    return items
+
+
+def reingest(archive, pipeline, blacklisted_tags=None, processes=None):
+    """
+    Parses archived pages in worker processes, and feeds items to the pipeline
+    Returns (page count, item count)
+    """
+    blacklisted_tags = blacklisted_tags or set()
+    tasks = ((archive.file_name, record, blacklisted_tags) for record in archive.records())
+    page_count, item_count = 0, 0
+    with multiprocessing.Pool(processes) as pool:
+        # ordered, so that the pipeline sees pages as they were crawled
+        for items in pool.imap(parse_record, tasks, chunksize=16):
+            page_count += 1
+            for item in items:
+                pipeline.process_item(item, None)
+                item_count += 1
+            if page_count % 1000 == 0:
+                logging.info("Reingested %d pages, %d items", page_count, item_count)
+    pipeline.close_spider(None)
+    return page_count, item_count
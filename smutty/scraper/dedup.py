@@ -0,0 +1,96 @@
+import scrapy
+
+
+class ItemIdBitmap:
+    """
+    Set of item ids, one bit per id below the highest one seen
+    Crawls walk ids downwards, so the bitmap mostly grows at its end
+    """
+
+    def __init__(self):
+        self._top = None
+        self._bits = bytearray()
+        self._count = 0
+
+    def __repr__(self):
+        return "{0}({1}, {2})".format(self.__class__.__name__, self._top, self._count)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def byte_size(self):
+        return len(self._bits)
+
+    def _position(self, item_id):
+        index = self._top - item_id
+        return index >> 3, 1 << (index & 7)
+
+    def __contains__(self, item_id):
+        if self._top is None or item_id > self._top:
+            return False
+        offset, mask = self._position(item_id)
+        return offset < len(self._bits) and bool(self._bits[offset] & mask)
+
+    def add(self, item_id):
+        """
+        Returns whether the id was not already there
+        """
+        # the top is the last id of its byte, so that moving it shifts whole bytes
+        top = item_id | 7
+        if self._top is None:
+            self._top = top
+        elif top > self._top:
+            self._bits[0:0] = bytearray((top - self._top) >> 3)
+            self._top = top
+        offset, mask = self._position(item_id)
+        if offset >= len(self._bits):
+            # grow geometrically, to keep appends amortized
+            self._bits.extend(bytearray(max(offset + 1 - len(self._bits), len(self._bits))))
+        if self._bits[offset] & mask:
+            return False
+        self._bits[offset] |= mask
+        self._count += 1
+        return True
+
+
+class SeenItemsMiddleware:
+    """
+    Spider middleware dropping items already seen during the run, which new
+    submissions push from one page to the next while crawling, before they
+    cost a database lookup in the pipeline
+
+    Duplicates per page measure the drift since the previous page. They are not
+    used to skip pages: ids below the lowest one seen are not fetched yet, so
+    the items of a skipped page could not be known as seen
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def __init__(self, stats):
+        self._stats = stats
+        self._seen = ItemIdBitmap()
+
+    def process_spider_output(self, response, result, spider):
+        items = 0
+        duplicates = 0
+        for element in result:
+            if isinstance(element, scrapy.Request) or "item_id" not in element:
+                yield element
+                continue
+            items += 1
+            if not self._seen.add(element["item_id"]):
+                duplicates += 1
+                continue
+            yield element
+
+        if items:
+            self._stats.inc_value("dedup/items", items)
+            self._stats.inc_value("dedup/duplicates", duplicates)
+            self._stats.max_value("dedup/page_drift_max", duplicates)
+            self._stats.set_value("dedup/seen_bitmap_bytes", self._seen.byte_size)
+            if duplicates:
+                spider.logger.info("Dropped {0} of {1} items already seen, drifted from previous page".format(
+                    duplicates, items))
@@ -1,3 +1,6 @@
+import operator
+import sys
+
 import scrapy
 
 
@@ -17,3 +20,58 @@ class SmuttyVideo(SmuttyItem):
     poster_url = scrapy.Field()
     video_url = scrapy.Field()
     video_mime = scrapy.Field()
+
+
+class SmuttyRecord(dict):
+    """
+    Compact item, a plain dictionary without per-instance attribute storage,
+    and tags as a tuple of interned names, so that tags shared by many items
+    are stored once
+    Fields are readable by name, as for scrapy items, and as attributes
+    """
+
+    __slots__ = ()
+
+    FIELDS = ("item_id", "submitter", "sub_page", "tags", "last_updated")
+
+    item_id = property(operator.itemgetter("item_id"))
+    submitter = property(operator.itemgetter("submitter"))
+    sub_page = property(operator.itemgetter("sub_page"))
+    tags = property(operator.itemgetter("tags"))
+    last_updated = property(operator.itemgetter("last_updated"))
+
+    def __init__(self, item_id, submitter, sub_page, tags, last_updated, **fields):
+        super().__init__(item_id=item_id, submitter=submitter, sub_page=sub_page,
+                         tags=tuple(sorted(sys.intern(tag) for tag in set(tags))),
+                         last_updated=last_updated, **fields)
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, ", ".join(
+            "{0}={1!r}".format(field, self[field]) for field in self.FIELDS))
+
+
+class SmuttyImageRecord(SmuttyRecord):
+
+    __slots__ = ()
+
+    FIELDS = SmuttyRecord.FIELDS + ("image_url",)
+
+    image_url = property(operator.itemgetter("image_url"))
+
+    def __init__(self, item_id, submitter, sub_page, tags, last_updated, image_url):
+        super().__init__(item_id, submitter, sub_page, tags, last_updated, image_url=image_url)
+
+
+class SmuttyVideoRecord(SmuttyRecord):
+
+    __slots__ = ()
+
+    FIELDS = SmuttyRecord.FIELDS + ("poster_url", "video_url", "video_mime")
+
+    poster_url = property(operator.itemgetter("poster_url"))
+    video_url = property(operator.itemgetter("video_url"))
+    video_mime = property(operator.itemgetter("video_mime"))
+
+    def __init__(self, item_id, submitter, sub_page, tags, last_updated, poster_url, video_url, video_mime):
+        super().__init__(item_id, submitter, sub_page, tags, last_updated,
+                         poster_url=poster_url, video_url=video_url, video_mime=video_mime)
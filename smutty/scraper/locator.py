@@ -0,0 +1,42 @@
+class PageLocator:
+    """
+    Finds the page listing a target id, pages listing ids from newest to oldest,
+    by exponential probing then binary search on the ids of probed pages
+
+    Invariant: every item of page low is above the target (page 0 standing for none),
+    and page high reaches the target or is empty
+    """
+
+    def __init__(self, target_id):
+        self.target_id = target_id
+        self.low = 0
+        self.high = None
+        self.probes = 0
+
+    def __repr__(self):
+        return "{0}({target_id}, {low}, {high})".format(self.__class__.__name__, **self.__dict__)
+
+    def next_page(self):
+        """
+        Next page to probe, None once the target page is known
+        """
+        if self.high is None:
+            return max(1, self.low * 2)
+        if self.high - self.low <= 1:
+            return None
+        return (self.low + self.high) // 2
+
+    def observe(self, page_number, item_ids):
+        """
+        Returns whether the page became the upper bound
+        """
+        self.probes += 1
+        if item_ids and min(item_ids) > self.target_id:
+            self.low = page_number
+            return False
+        self.high = page_number
+        return True
+
+    @property
+    def page(self):
+        return self.high
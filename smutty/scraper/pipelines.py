@@ -1,30 +1,93 @@
 import logging
+import time
 
+import sqlalchemy
+
+from .. import profiling
 from ..db import DatabaseSession
-from ..models import Tag, Item, Image, Video, create_all_tables
+from ..filetools import IntegerStateFile, ItemIdsStateFile
+from ..models import Tag, Item, Image, Video, association_item_tag, ensure_all_tables
+from ..querystats import profiled_stage
 
-from .items import SmuttyImage, SmuttyVideo
+from .items import SmuttyImage, SmuttyVideo, SmuttyImageRecord, SmuttyVideoRecord
 
 
 class SmuttyDatabasePipeline:
 
+    # weight of the latest commit in the average latency seen by the throttling extension
+    COMMIT_LATENCY_SMOOTHING = 0.2
+
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.settings.get("SMUTTY_DATABASE_CONFIGURATION_URL"))
+        pipeline = cls(crawler.settings.get("SMUTTY_DATABASE_CONFIGURATION_URL"),
+                       crawler.settings.get("SMUTTY_DATABASE_ENGINE_OPTIONS"),
+                       crawler.settings.get("SMUTTY_QUERY_PROFILER"),
+                       crawler.settings.get("SMUTTY_STATE_FILE_SCHEMA_VERSION"),
+                       crawler.settings.get("SMUTTY_DATABASE"),
+                       crawler.stats,
+                       crawler.settings.get("SMUTTY_STATE_FILE_LOWEST_ITEM_ID"))
+        # backfills from a located page may store items into already exported blocks
+        refreshed_items_state_file = crawler.settings.get("SMUTTY_STATE_FILE_REFRESHED_ITEMS")
+        if refreshed_items_state_file and crawler.settings.get("SMUTTY_LOCATE_ID") is not None:
+            pipeline.refreshed_items = ItemIdsStateFile(refreshed_items_state_file, pipeline.logger)
+        return pipeline
 
-    def __init__(self, database_configuration_url):
+    def __init__(self, database_configuration_url, engine_options=None, profiler=None, schema_version_state_file=None,
+                 database=None, stats=None, lowest_item_id_state_file=None):
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.debug("Using database url: %s", database_configuration_url)
-        self._database = DatabaseSession(database_configuration_url)
+        self._stats = stats
+        # lowered when items are stored below, for the exporter to notice without a query
+        self._lowest_item_id_state = None
+        if lowest_item_id_state_file:
+            self._lowest_item_id_state = IntegerStateFile(lowest_item_id_state_file, self.logger)
+        self._lowest_saved_id = None
+        self._commit_latency = None
+        # ids of items stored or changed outside regular crawls
+        self.refreshed_items = None
+        if database is None:
+            self.logger.debug("Using database url: %s", database_configuration_url)
+            database = DatabaseSession(database_configuration_url, engine_options, profiler)
+        else:
+            self.logger.debug("Using shared database connection pool")
+        self._database = database
         # initialize tables if they do not exist
-        create_all_tables(self._database.engine)
+        ensure_all_tables(self._database.engine, schema_version_state_file)
+
+    def close_spider(self, spider):
+        if self._lowest_item_id_state is not None and self._lowest_saved_id is not None:
+            lowest_item_id = self._lowest_item_id_state.get()
+            if lowest_item_id is not None and self._lowest_saved_id < lowest_item_id:
+                self._lowest_item_id_state.set(self._lowest_saved_id)
+        if self._database.profiler is not None:
+            self._database.profiler.log_report(self.logger)
+        self._database.release()
+
+    def record_commit_latency(self, seconds):
+        """
+        Exponential moving average of per item commit latency, exposed to the throttling extension
+        """
+        if self._commit_latency is None:
+            self._commit_latency = seconds
+        else:
+            self._commit_latency += self.COMMIT_LATENCY_SMOOTHING * (seconds - self._commit_latency)
+        if self._stats is not None:
+            self._stats.set_value("pipeline/commit_latency_ms", self._commit_latency * 1000)
+
+    def record_refreshed(self, submitters):
+        """
+        Once committed, exported blocks holding these items are outdated : their ids are recorded
+        for the exporter to write them again, along with the submitters they had
+        """
+        if self.refreshed_items is not None:
+            self.refreshed_items.add(sorted(submitters), submitters)
 
     def get_tags(self, session, tags):
         # fetch existing tags
-        existing = {
-            name: session.query(Tag).filter_by(name=name).first()
-            for name in tags
-        }
+        with profiled_stage(self._database.profiler, "tag lookup"):
+            existing = {
+                name: session.query(Tag).filter_by(name=name).first()
+                for name in tags
+            }
         # instanciate new ones
         existing = set(
             Tag(name=k) if v is None else v
@@ -51,37 +114,286 @@ class SmuttyDatabasePipeline:
         video = Video(**tagged_item)
         return video
 
+    def process_image_record(self, session, record):
+        return Image(item_id=record.item_id, submitter=record.submitter, sub_page=record.sub_page,
+                     tags=self.get_tags(session, record.tags), last_updated=record.last_updated,
+                     image_url=record.image_url)
+
+    def process_video_record(self, session, record):
+        return Video(item_id=record.item_id, submitter=record.submitter, sub_page=record.sub_page,
+                     tags=self.get_tags(session, record.tags), last_updated=record.last_updated,
+                     poster_url=record.poster_url, video_url=record.video_url, video_mime=record.video_mime)
+
     def save_item(self, session, orm_item):
-        try:
+        # commit is done by the enclosing unit of work
+        with profiled_stage(self._database.profiler, "item insert"):
             session.add(orm_item)
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+            session.flush()
+        if self._lowest_saved_id is None or orm_item.item_id < self._lowest_saved_id:
+            self._lowest_saved_id = orm_item.item_id
 
     def process_item(self, item, spider):
-        # create session
-        session = self._database.session
+        # one transaction per item, on the session of the current thread
+        start = time.perf_counter()
+        with profiling.stage("db"), self._database.unit_of_work() as session:
+            # item already exists
+            item_id = item["item_id"]
+            with profiled_stage(self._database.profiler, "existence check"):
+                exists = session.query(Item).filter_by(item_id=item_id).first()
+            if exists:
+                self.logger.debug("Item %d already exists, skipping", item_id)
+                return item
 
-        # item already exists
-        item_id = item["item_id"]
-        if session.query(Item).filter_by(item_id=item_id).first():
-            self.logger.debug("Item %d already exists, skipping", item_id)
-            return item
+            # persist items, compact records being built by the spider
+            orm_item = None
+            if isinstance(item, SmuttyImageRecord):
+                orm_item = self.process_image_record(session, item)
+                self.logger.debug("Saving image id %d", item_id)
+                self.save_item(session, orm_item)
+            elif isinstance(item, SmuttyVideoRecord):
+                orm_item = self.process_video_record(session, item)
+                self.logger.debug("Saving video id %d", item_id)
+                self.save_item(session, orm_item)
+            elif isinstance(item, SmuttyImage):
+                orm_item = self.process_image(session, item)
+                self.logger.debug("Saving image id %d", item_id)
+                self.save_item(session, orm_item)
+            elif isinstance(item, SmuttyVideo):
+                orm_item = self.process_video(session, item)
+                self.logger.debug("Saving video id %d", item_id)
+                self.save_item(session, orm_item)
+            else:
+                self.logger.warning("Not processing unknown element: %s", item)
 
-        # persist items
-        if isinstance(item, SmuttyImage):
-            orm_item = self.process_image(session, item)
-            self.logger.debug("Saving image id %d", item_id)
-            self.save_item(session, orm_item)
-        elif isinstance(item, SmuttyVideo):
-            orm_item = self.process_video(session, item)
-            self.logger.debug("Saving video id %d", item_id)
-            self.save_item(session, orm_item)
-        else:
-            self.logger.warning("Not processing unknown element: %s", item)
+        self.record_commit_latency(time.perf_counter() - start)
+        if orm_item is not None:
+            self.record_refreshed({item_id: item["submitter"]})
 
         # feed to other pipelines
         return item
+
+
+class SmuttyRefreshPipeline(SmuttyDatabasePipeline):
+    """
+    Updates already known items, by batches of items compared at once with
+    stored rows and tag associations: only changed fields, added and removed
+    associations are written, along with last_updated of changed items,
+    unchanged items cost no write
+
+    Unknown items are inserted as usual, known ones which gained a blacklisted
+    tag are deleted as they would not have been stored, and ids of inserted,
+    changed or deleted items are recorded for the exporter to write their blocks
+    again, along with the submitters they had
+    """
+
+    # fields compared, by table
+    ITEM_FIELDS = ("submitter", "sub_page")
+    IMAGE_FIELDS = ("image_url",)
+    VIDEO_FIELDS = ("poster_url", "video_url", "video_mime")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = super().from_crawler(crawler)
+        pipeline.batch_size = crawler.settings.getint("SMUTTY_REFRESH_BATCH_SIZE", pipeline.batch_size)
+        pipeline.blacklisted_tags = crawler.settings.get("SMUTTY_BLACKLIST_TAGS") or set()
+        refreshed_items_state_file = crawler.settings.get("SMUTTY_STATE_FILE_REFRESHED_ITEMS")
+        if refreshed_items_state_file:
+            pipeline.refreshed_items = ItemIdsStateFile(refreshed_items_state_file, pipeline.logger)
+        return pipeline
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = 100
+        self.blacklisted_tags = set()
+        self._batch = []
+
+    def close_spider(self, spider):
+        self.flush()
+        super().close_spider(spider)
+
+    def _inc_stat(self, key, count):
+        if self._stats is not None and count:
+            self._stats.inc_value(key, count)
+
+    def stored_items(self, session, item_ids):
+        """
+        Known items, as {item_id: (item type, {field: value}, {tag name: tag id})}, in one query
+        """
+        items, images, videos, tags = Item.__table__, Image.__table__, Video.__table__, Tag.__table__
+        columns = [items.c.item_id, items.c.item_type] \
+            + [items.c[field] for field in self.ITEM_FIELDS] \
+            + [images.c[field] for field in self.IMAGE_FIELDS] \
+            + [videos.c[field] for field in self.VIDEO_FIELDS] \
+            + [tags.c.tag_id, tags.c.name]
+        query = sqlalchemy.select(columns) \
+            .select_from(items.outerjoin(images).outerjoin(videos).outerjoin(association_item_tag).outerjoin(tags)) \
+            .where(items.c.item_id.in_(item_ids))
+        fields = self.ITEM_FIELDS + self.IMAGE_FIELDS + self.VIDEO_FIELDS
+        stored = {}
+        with profiled_stage(self._database.profiler, "refresh lookup"):
+            for row in session.execute(query):
+                item_id, item_type = row[0], row[1]
+                if item_id not in stored:
+                    stored[item_id] = (item_type, dict(zip(fields, row[2:-2])), {})
+                tag_id, name = row[-2:]
+                if tag_id is not None:
+                    stored[item_id][2][name] = tag_id
+        return stored
+
+    def tag_ids(self, session, names):
+        """
+        Ids of tags by name, creating missing ones
+        """
+        tags = Tag.__table__
+        with profiled_stage(self._database.profiler, "tag lookup"):
+            query = sqlalchemy.select([tags.c.name, tags.c.tag_id]).where(tags.c.name.in_(names))
+            existing = dict(session.execute(query).fetchall())
+            missing = set(names) - set(existing)
+            if missing:
+                session.execute(tags.insert(), [{"name": name} for name in sorted(missing)])
+                query = sqlalchemy.select([tags.c.name, tags.c.tag_id]).where(tags.c.name.in_(missing))
+                existing.update(session.execute(query).fetchall())
+        return existing
+
+    @staticmethod
+    def _update(session, table, fields, rows):
+        # executemany, values bound by name
+        if not rows:
+            return
+        statement = table.update() \
+            .where(table.c.item_id == sqlalchemy.bindparam("b_item_id")) \
+            .values({field: sqlalchemy.bindparam("b_" + field) for field in fields})
+        session.execute(statement, rows)
+
+    def delete_items(self, session, item_ids):
+        """
+        Deletes known items among the given ones
+        Returns their submitters, by id
+        """
+        items = Item.__table__
+        with profiled_stage(self._database.profiler, "refresh delete"):
+            query = sqlalchemy.select([items.c.item_id, items.c.submitter]).where(items.c.item_id.in_(item_ids))
+            deleted = dict(session.execute(query).fetchall())
+            if deleted:
+                for table in (association_item_tag, Image.__table__, Video.__table__, items):
+                    session.execute(table.delete().where(table.c.item_id.in_(deleted)))
+        for item_id in sorted(deleted):
+            self.logger.info("Deleting item id %d due to blacklisted tag", item_id)
+        self._inc_stat("refresh/deleted_items", len(deleted))
+        return deleted
+
+    def refresh(self, session, records):
+        """
+        Applies differences of known items
+        Returns unknown items, and previous submitters of changed ones, by id
+        """
+        stored = self.stored_items(session, list(records))
+        unknown = [record for item_id, record in records.items() if item_id not in stored]
+
+        added, removed, changed = [], [], []
+        changed_images, changed_videos = [], []
+        for item_id, record in records.items():
+            if item_id not in stored:
+                continue
+            item_type, current_fields, current_tags = stored[item_id]
+            if "image_url" in record:
+                type_fields, identity = self.IMAGE_FIELDS, Image.__mapper__.polymorphic_identity
+                changed_typed = changed_images
+            else:
+                type_fields, identity = self.VIDEO_FIELDS, Video.__mapper__.polymorphic_identity
+                changed_typed = changed_videos
+            if item_type != identity:
+                self.logger.warning("Item %d changed type, not refreshing it", item_id)
+                self._inc_stat("refresh/type_changes", 1)
+                continue
+
+            item_fields = [field for field in self.ITEM_FIELDS if record[field] != current_fields[field]]
+            typed_fields = [field for field in type_fields if record[field] != current_fields[field]]
+            new_names = set(record["tags"]) - set(current_tags)
+            old_names = set(current_tags) - set(record["tags"])
+            if not item_fields and not typed_fields and not new_names and not old_names:
+                continue
+            self.logger.debug("Item %d changed fields %s, tags +%s -%s", item_id,
+                              item_fields + typed_fields, sorted(new_names), sorted(old_names))
+            added.extend((item_id, name) for name in new_names)
+            removed.extend({"b_item_id": item_id, "b_tag_id": current_tags[name]} for name in old_names)
+            row = {"b_item_id": item_id, "b_last_updated": record["last_updated"]}
+            row.update(("b_" + field, record[field]) for field in self.ITEM_FIELDS)
+            changed.append(row)
+            if typed_fields:
+                row = {"b_item_id": item_id}
+                row.update(("b_" + field, record[field]) for field in type_fields)
+                changed_typed.append(row)
+            self._inc_stat("refresh/changed_fields", len(item_fields) + len(typed_fields))
+
+        changed_submitters = {row["b_item_id"]: stored[row["b_item_id"]][1]["submitter"] for row in changed}
+        if not changed:
+            return unknown, changed_submitters
+
+        # executemany statements, one per kind of change
+        with profiled_stage(self._database.profiler, "refresh write"):
+            if added:
+                tag_ids = self.tag_ids(session, {name for _, name in added})
+                session.execute(association_item_tag.insert(),
+                                [{"item_id": item_id, "tag_id": tag_ids[name]} for item_id, name in added])
+            if removed:
+                session.execute(association_item_tag.delete().where(sqlalchemy.and_(
+                    association_item_tag.c.item_id == sqlalchemy.bindparam("b_item_id"),
+                    association_item_tag.c.tag_id == sqlalchemy.bindparam("b_tag_id"))), removed)
+            self._update(session, Item.__table__, self.ITEM_FIELDS + ("last_updated",), changed)
+            self._update(session, Image.__table__, self.IMAGE_FIELDS, changed_images)
+            self._update(session, Video.__table__, self.VIDEO_FIELDS, changed_videos)
+
+        self._inc_stat("refresh/changed_items", len(changed))
+        self._inc_stat("refresh/added_tags", len(added))
+        self._inc_stat("refresh/removed_tags", len(removed))
+        return unknown, changed_submitters
+
+    def flush(self):
+        if not self._batch:
+            return
+        # later occurrences of an item win
+        records = {record["item_id"]: record for record in self._batch}
+        item_count = len(records)
+        self._batch = []
+        blacklisted = sorted(item_id for item_id, record in records.items()
+                             if self.blacklisted_tags.intersection(record["tags"]))
+        for item_id in blacklisted:
+            del records[item_id]
+
+        start = time.perf_counter()
+        deleted, unknown, changed = {}, [], {}
+        with profiling.stage("db"), self._database.unit_of_work() as session:
+            if blacklisted:
+                deleted = self.delete_items(session, blacklisted)
+            if records:
+                unknown, changed = self.refresh(session, records)
+            for record in unknown:
+                if isinstance(record, SmuttyImageRecord):
+                    self.save_item(session, self.process_image_record(session, record))
+                elif isinstance(record, SmuttyVideoRecord):
+                    self.save_item(session, self.process_video_record(session, record))
+                elif isinstance(record, SmuttyImage):
+                    self.save_item(session, self.process_image(session, record))
+                elif isinstance(record, SmuttyVideo):
+                    self.save_item(session, self.process_video(session, record))
+        self.logger.info("Refreshed %d items, %d new, %d deleted", item_count, len(unknown), len(deleted))
+        self._inc_stat("refresh/items", item_count)
+        self._inc_stat("refresh/new_items", len(unknown))
+
+        refreshed = dict(changed)
+        refreshed.update(deleted)
+        refreshed.update((record["item_id"], record["submitter"]) for record in unknown)
+        self.record_refreshed(refreshed)
+
+        # per item as for insertions
+        self.record_commit_latency((time.perf_counter() - start) / item_count)
+
+    def process_item(self, item, spider):
+        if "item_id" not in item:
+            self.logger.warning("Not processing unknown element: %s", item)
+            return item
+        self._batch.append(item)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        return item
@@ -43,21 +43,22 @@ DOWNLOAD_DELAY = 3
 
 # Enable or disable spider middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#     'smutty.middlewares.MyCustomSpiderMiddleware': 543,
-# }
+SPIDER_MIDDLEWARES = {
+    'smutty.scraper.dedup.SeenItemsMiddleware': 543,
+}
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#     'smutty.middlewares.MyCustomDownloaderMiddleware': 543,
-# }
+# The page archive sits below HttpCompressionMiddleware (590), to store decompressed bodies
+DOWNLOADER_MIDDLEWARES = {
+    'smutty.scraper.archive.PageArchiveMiddleware': 500,
+}
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#     'scrapy.telnet.TelnetConsole': None,
-# }
+EXTENSIONS = {
+    'smutty.scraper.throttle.AdaptiveThrottle': 500,
+}
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
@@ -3,10 +3,13 @@ import datetime
 import pytz
 import scrapy
 import time
+import urllib.parse
 
+from .. import profiling
 from ..filetools import IntegerStateFile
 
-from .items import SmuttyImage, SmuttyVideo
+from .items import SmuttyImageRecord, SmuttyVideoRecord
+from .locator import PageLocator
 
 
 class SmuttySpider(scrapy.Spider):
@@ -23,36 +26,88 @@ class SmuttySpider(scrapy.Spider):
                    crawler.settings.get("SMUTTY_STATE_FILE_HIGHEST_SCRAPER_ID"),
                    crawler.settings.get("SMUTTY_STATE_FILE_LOWEST_SCRAPER_ID"),
                    crawler.settings.get("SMUTTY_PAGE_COUNT"),
-                   crawler.settings.get("SMUTTY_BLACKLIST_TAGS"))
-
-    def __init__(self, current_scraper_page_state_file, highest_scraper_id_state_file, lowest_scraper_id_state_file, page_count, blacklist_tags):
+                   crawler.settings.get("SMUTTY_BLACKLIST_TAGS"),
+                   crawler.settings.get("SMUTTY_PAGE_URL"),
+                   crawler.settings.get("SMUTTY_LOCATE_ID"),
+                   crawler.settings.get("SMUTTY_REFRESH_START_PAGE"),
+                   crawler.settings.get("SMUTTY_WALK_MIN_ID"))
+
+    def __init__(self, current_scraper_page_state_file, highest_scraper_id_state_file, lowest_scraper_id_state_file,
+                 page_count, blacklist_tags, page_url=None, locate_id=None, refresh_start_page=None, walk_min_id=None):
         # init
+        if page_url:
+            # another site serving the same markup, a local mock one for example
+            self._page_url = page_url
+            self.allowed_domains = [urllib.parse.urlparse(page_url).hostname]
         self._current_scraper_page_state = IntegerStateFile(current_scraper_page_state_file, self.logger)
         self._highest_scraper_id_state = IntegerStateFile(highest_scraper_id_state_file, self.logger)
         self._lowest_scraper_id_state = IntegerStateFile(lowest_scraper_id_state_file, self.logger)
         self._highest_scraper_id = self._highest_scraper_id_state.get()
         self._lowest_scraper_id = self._lowest_scraper_id_state.get()
         current_page = self._current_scraper_page_state.get()
+        # refreshing known items, and backfilling from a located page, walk pages
+        # without touching crawl states, down to their own minimum id
+        self._track_states = refresh_start_page is None and locate_id is None
+        self._refreshing = refresh_start_page is not None
+        if not self._track_states:
+            self._lowest_scraper_id = walk_min_id
+        if refresh_start_page is not None:
+            current_page = refresh_start_page
+            self.logger.info("Refreshing from page {0}".format(current_page))
+        self._start_page = current_page
         self.logger.info("State: highest_scraper_id={0} lowest_scraper_id={1} current_scraper_page={2}".format(self._highest_scraper_id, self._lowest_scraper_id, current_page))
         self._tag_blacklist = blacklist_tags
         self.logger.info("Blacklisted tags: {0}".format(self._tag_blacklist))
         # limit
+        self._page_count = page_count
         self._end_page = None
         if page_count:
             self._end_page = current_page + page_count
+        # start page search
+        self._locator = None
+        self._located_response = None
+        if locate_id is not None:
+            self._locator = PageLocator(locate_id)
 
     def get_page_url(self, page_number):
         return self._page_url.format(page_number)
 
-    def _request_page(self, page_number):
-        # queue page for download
+    def _request_page(self, page_number, callback=None):
+        # queue page for download, pages probed while locating may be requested again
         meta = {"page_number": page_number}
         return scrapy.Request(url=self.get_page_url(page_number),
-                              callback=self.parse,
-                              meta=meta)
+                              callback=callback or self.parse,
+                              meta=meta,
+                              dont_filter=True)
 
     def start_requests(self):
-        yield self._request_page(self._current_scraper_page_state.get())
+        if self._locator is not None:
+            self.logger.info("Locating page of item id {0}".format(self._locator.target_id))
+            yield self._request_page(self._locator.next_page(), self.locate)
+            return
+        yield self._request_page(self._start_page)
+
+    def locate(self, response):
+        page_number = response.meta["page_number"]
+        item_ids = [self.block_item_id(block) for block in self.page_blocks(response)]
+        if self._locator.observe(page_number, item_ids):
+            # keep the bounding page, to avoid downloading it again once found
+            self._located_response = response
+        self.logger.info("Probed page {0} with ids {1} to {2}".format(
+            page_number, max(item_ids, default=None), min(item_ids, default=None)))
+
+        next_page = self._locator.next_page()
+        if next_page is not None:
+            yield self._request_page(next_page, self.locate)
+            return
+
+        # crawl normally from there
+        page_number = self._locator.page
+        self.logger.info("Item id {0} is on page {1}, found in {2} requests".format(
+            self._locator.target_id, page_number, self._locator.probes))
+        if self._page_count:
+            self._end_page = page_number + self._page_count
+        yield from self.parse(self._located_response)
 
     def finalize_run(self):
         self.logger.info("Finalizing states")
@@ -77,35 +132,95 @@ class SmuttySpider(scrapy.Spider):
         cur_page = self._current_scraper_page_state.get()
         self.logger.info("After: highest_scraper_id={0} lowest_scraper_id={1} current_scraper_page={2}".format(high, low, cur_page))
 
+    def end_run(self):
+        if self._track_states:
+            self.finalize_run()
+        else:
+            self.logger.info("Walk finished, crawl states left untouched")
+
+    @staticmethod
+    def page_blocks(response):
+        return response.css("#container_chart").xpath("./div[@id]")
+
+    @staticmethod
+    def block_item_id(block):
+        return int(block.xpath(".//a/@onclick").re_first(r"^App\.txtr\((\d+)\)"))
+
+    @classmethod
+    def parse_block(cls, block, last_updated):
+        """
+        Builds the item of a page block, independently of any crawl state
+        """
+        # id
+        item_id = cls.block_item_id(block)
+        # tags
+        tags = map(str.lower, block.xpath(
+            ".//a/@href").re("^/h/(.*)/"))
+        # subitter
+        submitter = block.xpath('.//img[@onclick]/@alt').extract_first()
+        # content
+        content = block.css("div.center a")
+        sub_page = content.xpath("./@href").extract_first()
+        # image
+        image = content.xpath(".//img/@src").extract_first()
+        # finalize item
+        if image is None:
+            video = content.xpath(".//video")
+            return SmuttyVideoRecord(
+                # SmuttyRecord
+                item_id=item_id,
+                submitter=submitter,
+                sub_page=sub_page,
+                tags=tags,
+                last_updated=last_updated,
+                # SmuttyVideoRecord
+                poster_url=video.xpath("./@poster").extract_first(),
+                video_url=video.xpath("./source/@src").extract_first(),
+                video_mime=video.xpath("./source/@type").extract_first()
+            )
+        return SmuttyImageRecord(
+            # SmuttyRecord
+            item_id=item_id,
+            submitter=submitter,
+            sub_page=sub_page,
+            tags=tags,
+            last_updated=last_updated,
+            # SmuttyImageRecord
+            image_url=image
+        )
+
     def parse(self, response):
         self.logger.info("Parsing page {0}".format(response.meta["page_number"]))
+        profiling.set_unit("page {0}".format(response.meta["page_number"]))
 
         # save progression
-        self._current_scraper_page_state.set(response.meta["page_number"])
+        if self._track_states:
+            self._current_scraper_page_state.set(response.meta["page_number"])
 
         # find content
-        divs = response.css("#container_chart").xpath("./div[@id]")
+        divs = self.page_blocks(response)
 
         # if nothing on page, consider we reached the end of the archive
         if not len(divs):
-            self.finalize_run()
+            self.end_run()
             return
 
+        # timestamp
+        last_updated = datetime.datetime.fromtimestamp(time.time(), pytz.UTC)
+
         # handle content
         for block in divs:
-            # id
-            item_id = int(block.xpath(".//a/@onclick").re_first("^App\.txtr\((\d+)\)"))
-
-            # tags
-            tags = set(map(str.lower, block.xpath(
-                ".//a/@href").re("^/h/(.*)/")))
-            # skip unwanted items
-            if tags is not None and tags & self._tag_blacklist:
+            with profiling.stage("parse"):
+                item = self.parse_block(block, last_updated)
+            item_id = item.item_id
+
+            # skip unwanted items, the refresh pipeline deletes known ones instead
+            if not self._refreshing and self._tag_blacklist.intersection(item.tags):
                 self.logger.info("Ignoring item id {0} due to blacklisted tag".format(item_id))
                 continue
 
             # set highest id if not already set
-            if self._highest_scraper_id is None:
+            if self._track_states and self._highest_scraper_id is None:
                 self.logger.info("Memorizing {0} as highest id".format(item_id))
                 self._highest_scraper_id = item_id
                 self._highest_scraper_id_state.set(item_id)
@@ -113,44 +228,10 @@ class SmuttySpider(scrapy.Spider):
             # check for minimum bound
             if self._lowest_scraper_id and item_id <= self._lowest_scraper_id:
                 self.logger.info("Reached id {0} which is below lowest id {1} as highest id".format(item_id, self._lowest_scraper_id))
-                self.finalize_run()
+                self.end_run()
                 return
 
-            # subitter
-            submitter = block.xpath('.//img[@onclick]/@alt').extract_first()
-            # content
-            content = block.css("div.center a")
-            sub_page = content.xpath("./@href").extract_first()
-            # image
-            image = content.xpath(".//img/@src").extract_first()
-            # timestamp
-            last_updated = datetime.datetime.fromtimestamp(time.time(), pytz.UTC)
-            # finalize item
-            if image is None:
-                video = content.xpath(".//video")
-                yield SmuttyVideo(
-                    # SmuttyItem
-                    item_id=item_id,
-                    submitter=submitter,
-                    sub_page=sub_page,
-                    tags=tags,
-                    last_updated=last_updated,
-                    # SmuttyVideo
-                    poster_url=video.xpath("./@poster").extract_first(),
-                    video_url=video.xpath("./source/@src").extract_first(),
-                    video_mime=video.xpath("./source/@type").extract_first()
-                )
-            else:
-                yield SmuttyImage(
-                    # SmuttyItem
-                    item_id=item_id,
-                    submitter=submitter,
-                    sub_page=sub_page,
-                    tags=tags,
-                    last_updated=last_updated,
-                    # SmuttyImage
-                    image_url=image
-                )
+            yield item
 
         # go on if necessary
         if self._end_page is None or response.meta["page_number"] < self._end_page - 1:
@@ -0,0 +1,85 @@
+import logging
+
+import scrapy.exceptions
+import scrapy.signals
+
+
+class AdaptiveThrottle:
+    """
+    Extension adjusting the download delay after every page, from what the site
+    and the database can sustain :
+
+    - error responses (429, 5xx) double the delay, or apply Retry-After
+    - a database falling behind, by its average commit latency, raises it by half
+    - otherwise it shrinks by a fifth, towards the response latency, and the minimum delay
+
+    Decisions are counted in the throttle/* crawl stats
+    """
+
+    BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("SMUTTY_THROTTLE_ENABLED"):
+            raise scrapy.exceptions.NotConfigured()
+        extension = cls(crawler,
+                        settings.getfloat("SMUTTY_THROTTLE_MIN_DELAY"),
+                        settings.getfloat("SMUTTY_THROTTLE_MAX_DELAY"),
+                        settings.getfloat("SMUTTY_THROTTLE_MAX_COMMIT_LATENCY"))
+        crawler.signals.connect(extension.response_downloaded, signal=scrapy.signals.response_downloaded)
+        return extension
+
+    def __init__(self, crawler, min_delay, max_delay, max_commit_latency):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._crawler = crawler
+        self._stats = crawler.stats
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._max_commit_latency = max_commit_latency
+
+    def _slot(self, request):
+        key = request.meta.get("download_slot")
+        return self._crawler.engine.downloader.slots.get(key)
+
+    def _commit_latency(self):
+        # moving average published by the database pipeline, items of a page are
+        # committed before the next page is requested so nothing else piles up
+        return self._stats.get_value("pipeline/commit_latency_ms", 0) / 1000
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def decide(self, delay, latency, response, commit_latency):
+        """
+        Returns the new delay, and the reason of the change
+        """
+        if response.status in self.BACKOFF_STATUSES:
+            return max(delay * 2, self._retry_after(response) or 0, self._min_delay), "server"
+        if commit_latency > self._max_commit_latency:
+            return delay * 1.5, "database"
+        return max(delay * 0.8, latency), "speedup"
+
+    def response_downloaded(self, response, request, spider):
+        slot = self._slot(request)
+        latency = request.meta.get("download_latency")
+        if slot is None or latency is None:
+            return
+
+        commit_latency = self._commit_latency()
+        delay, reason = self.decide(slot.delay, latency, response, commit_latency)
+        delay = min(max(delay, self._min_delay), self._max_delay)
+        if delay != slot.delay:
+            self.logger.debug("Delay %.2fs -> %.2fs (%s) latency=%.2fs commit=%.3fs",
+                              slot.delay, delay, reason, latency, commit_latency)
+        slot.delay = delay
+
+        self._stats.inc_value("throttle/decisions/{0}".format(reason))
+        self._stats.set_value("throttle/delay_ms", int(delay * 1000))
+        self._stats.set_value("throttle/latency_ms", int(latency * 1000))
+        self._stats.max_value("throttle/delay_max_ms", int(delay * 1000))
+        self._stats.max_value("throttle/commit_latency_max_ms", int(commit_latency * 1000))
@@ -0,0 +1,83 @@
+"""
+SQLite databases for tests, the smutty schema being an attached database
+"""
+import datetime
+import os
+
+import pytz
+import sqlalchemy
+
+from smutty.db import DatabaseSession
+from smutty.models import ensure_all_tables
+from smutty.scraper.items import SmuttyImageRecord, SmuttyVideoRecord
+from smutty.scraper.pipelines import SmuttyDatabasePipeline
+
+
+LAST_UPDATED = datetime.datetime(2018, 1, 2, 3, 4, 5, tzinfo=pytz.UTC)
+
+
+def sqlite_database(directory):
+    database = DatabaseSession("sqlite:///" + os.path.join(directory, "main.db"))
+    schema_file = os.path.join(directory, "smutty.db")
+
+    @sqlalchemy.event.listens_for(database.engine, "connect")
+    def attach_schema(connection, record):
+        connection.execute("ATTACH DATABASE '{0}' AS smutty".format(schema_file))
+
+    ensure_all_tables(database.engine)
+    return database
+
+
+def record(item_id, tags=("a", "b"), last_updated=LAST_UPDATED, **fields):
+    """
+    Videos for ids multiple of 3, images otherwise
+    """
+    common = dict(item_id=item_id, submitter="user{0}".format(item_id % 7), sub_page="/s/{0}/".format(item_id),
+                  tags=tags, last_updated=last_updated)
+    if item_id % 3:
+        common.update(image_url="https://example.com/i/{0}.jpg".format(item_id))
+        common.update(fields)
+        return SmuttyImageRecord(**common)
+    common.update(poster_url="https://example.com/p/{0}.jpg".format(item_id),
+                  video_url="https://example.com/v/{0}.mp4".format(item_id), video_mime="video/mp4")
+    common.update(fields)
+    return SmuttyVideoRecord(**common)
+
+
+def fill(database, item_ids, **fields):
+    pipeline = SmuttyDatabasePipeline(None, database=database)
+    for item_id in item_ids:
+        pipeline.process_item(record(item_id, **fields), None)
+    database.release()
+
+
+CONFIGURATION = """[database]
+dialect = postgres
+host = localhost
+port = 5432
+username = smutty
+password = smutty
+database = smutty
+lowest_item_id = {0}/lowest_item_id.state
+[scraper]
+current_scraper_page = {0}/current_scraper_page.state
+highest_scraper_id = {0}/highest_scraper_id.state
+lowest_scraper_id = {0}/lowest_scraper_id.state
+refreshed_items = {0}/refreshed_items.state
+[exporter]
+output_directory = {0}/output
+highest_exporter_id = {0}/highest_exporter_id.state
+lowest_exporter_id = {0}/lowest_exporter_id.state
+"""
+
+
+def configuration(directory, exporter_options=""):
+    """
+    Configuration file with states and output in the directory, the database being given apart
+    """
+    from smutty.config import ConfigurationFile
+
+    file_name = os.path.join(directory, "smutty.conf")
+    with open(file_name, "w") as file_obj:
+        file_obj.write(CONFIGURATION.format(directory) + exporter_options)
+    return ConfigurationFile(file_name)
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from smutty.benchmarks.mocksite import MockSite
+from smutty.models import Item, association_item_tag
+from smutty.scraper.archive import PageArchive, parse_record, reingest
+from smutty.scraper.pipelines import SmuttyDatabasePipeline, SmuttyRefreshPipeline
+
+from database import sqlite_database
+
+
+class ReingestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        self.site = MockSite(page_count=3, items_per_page=10, top_id=1000)
+        self.archive = PageArchive(os.path.join(self.directory, "pages.archive"))
+        for page_number in range(1, 5):
+            self.archive.append("http://mock.example.com/?page={0}".format(page_number), page_number,
+                                self.site.page_html(page_number), time.time())
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_archive_records(self):
+        records = list(self.archive.records())
+        self.assertEqual([record["page"] for record in records], [1, 2, 3, 4])
+        self.assertEqual(self.archive.read(records[0]), self.site.page_html(1))
+
+    def snapshot(self):
+        session = self.database.session
+        items = {item.item_id: (item.submitter, {tag.name for tag in item.tags}) for item in session.query(Item)}
+        self.database.release()
+        return items
+
+    def test_updates_stored_items(self):
+        reingest(self.archive, SmuttyDatabasePipeline(None, database=self.database))
+        expected = self.snapshot()
+        # as stored by a parser which missed submitters and tags
+        with self.database.unit_of_work() as session:
+            session.execute(Item.__table__.update().values(submitter=""))
+            session.execute(association_item_tag.delete().where(association_item_tag.c.item_id > 990))
+
+        pipeline = SmuttyRefreshPipeline(None, database=self.database)
+        page_count, item_count = reingest(self.archive, pipeline, processes=2)
+        self.assertEqual((page_count, item_count), (4, 30))
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_pages_are_decoded_with_their_encoding(self):
+        body = self.site.page_html(1).decode().replace('alt="user', 'alt="josé').encode("cp1252")
+        self.archive.append("http://mock.example.com/?page=1", 1, body, time.time(), "cp1252")
+        record = list(self.archive.records())[-1]
+        self.assertEqual(record["encoding"], "cp1252")
+        items = parse_record((self.archive.file_name, record, set()))
+        self.assertEqual(len(items), 10)
+        self.assertTrue(all(item.submitter.startswith("josé") for item in items))
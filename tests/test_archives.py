@@ -0,0 +1,112 @@
+import hashlib
+import lzma
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from smutty.exporter.archives import ArchiveBundler, load_manifest
+from smutty.exporter.indexers import LzmaJsonIndexer
+from smutty.exporter.segments import Interval, Block
+from smutty.filetools import MustExistDirectory
+from smutty.reader import DirectorySource, PackageIndex
+
+
+class ArchiveBundlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = MustExistDirectory(self.directory)
+        self.bundler = ArchiveBundler(self.output, "wb", 1, bundle_blocks=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def package(self, content_type, min_id, data, age_days=2):
+        name = "{0}-{1}-{2}-{3}.jsonl.xz".format(content_type, min_id, min_id + Block.SIZE - 1,
+                                                 hashlib.md5(data).hexdigest())
+        path = self.output.path / name
+        path.write_bytes(lzma.compress(data))
+        mtime = time.time() - age_days * 24 * 3600
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def members(self):
+        """
+        Decompressed members by (content type, min id), of the only bundle
+        """
+        (interval, (bundle_file, manifest)), = self.bundler.bundles().items()
+        self.assertEqual(interval, Interval(0, 99999))
+        self.assertEqual(manifest, load_manifest(bundle_file))
+        data = lzma.decompress(bundle_file.bytes())
+        return {(member["content_type"], member["min_id"]): data[member["offset"]:member["offset"] + member["length"]]
+                for member in manifest}
+
+    def test_old_packages_of_closed_blocks_are_bundled(self):
+        images = self.package("image", 0, b'{"item_id":1}\n' * 1000)
+        videos = self.package("video", 0, b'{"item_id":3}\n' * 100)
+        frames = images + ".frames.json"
+        frames.write_text("{}")
+        later_images = self.package("image", 10000, b'{"item_id":10001}\n' * 10)
+        self.package("image", 20000, b'{"item_id":20001}\n', age_days=0)
+        self.package("image", 30000, b'{"item_id":30001}\n')
+
+        retired = self.bundler.archive(29999)
+        self.assertEqual(set(retired), {images, frames, videos, later_images})
+        self.assertEqual(self.members(), {
+            ("image", 0): b'{"item_id":1}\n' * 1000,
+            ("video", 0): b'{"item_id":3}\n' * 100,
+            ("image", 10000): b'{"item_id":10001}\n' * 10,
+        })
+
+    def test_members_are_replaced_by_packages_written_again(self):
+        self.package("image", 0, b'{"item_id":1}\n' * 1000)
+        self.package("image", 10000, b'{"item_id":10001}\n' * 10)
+        self.package("video", 10000, b'{"item_id":10002}\n' * 10)
+        for retired_file in self.bundler.archive(29999):
+            retired_file.remove()
+        (previous_file, _), = self.bundler.bundles().values()
+
+        # members are copied by chunks smaller than them
+        self.bundler.COPY_SIZE = 100
+        self.package("image", 10000, b'{"item_id":10001,"tags":["new"]}\n' * 10)
+        retired = self.bundler.archive(29999)
+        self.assertIn(previous_file, retired)
+        self.assertIn(previous_file + ArchiveBundler.MANIFEST_SUFFIX, retired)
+        for retired_file in retired:
+            retired_file.remove()
+        self.assertEqual(self.members(), {
+            ("image", 0): b'{"item_id":1}\n' * 1000,
+            ("image", 10000): b'{"item_id":10001,"tags":["new"]}\n' * 10,
+            ("video", 10000): b'{"item_id":10002}\n' * 10,
+        })
+
+    def test_kept_sidecars_stay_referenced_by_bundled_packages(self):
+        bundler = ArchiveBundler(self.output, "wb", 1, bundle_blocks=10, kept_suffixes=[".bloom"])
+        images = self.package("image", 0, b'{"item_id":1}\n')
+        bloom = images + ".bloom"
+        bloom.write_bytes(b"filter")
+        frames = images + ".frames.json"
+        frames.write_text("{}")
+        retired = bundler.archive(29999)
+        self.assertEqual(set(retired), {images, frames})
+
+        indexer = LzmaJsonIndexer(self.output, "wb")
+        indexer.attach_sidecar("bloom", ".bloom")
+        indexer.attach_sidecar("frames", ".frames.json")
+        indexer.attach_bundles(ArchiveBundler.FILE_PATTERN, load_manifest)
+        indexer.generate(retired)
+        for retired_file in retired:
+            retired_file.remove()
+        package, = PackageIndex.load(DirectorySource(self.directory)).select()
+        self.assertIsNotNone(package.bundle)
+        self.assertEqual((package.bloom, package.frames), (str(bloom.name), None))
+
+        # until the member is replaced
+        new_images = self.package("image", 0, b'{"item_id":2}\n')
+        new_bloom = new_images + ".bloom"
+        new_bloom.write_bytes(b"other filter")
+        retired = bundler.archive(29999)
+        self.assertIn(bloom, retired)
+        self.assertNotIn(new_bloom, retired)
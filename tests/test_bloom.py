@@ -0,0 +1,32 @@
+import unittest
+
+from smutty.bloom import BloomFilter
+from smutty.exceptions import SmuttyException
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = list(range(1000, 3000)) + ["https://example.com/i/{0}.jpg".format(i) for i in range(1000)]
+        self.bloom_filter = BloomFilter.for_capacity(len(self.keys), 0.01)
+        for key in self.keys:
+            self.bloom_filter.add(key)
+
+    def test_no_false_negatives(self):
+        self.assertTrue(all(key in self.bloom_filter for key in self.keys))
+
+    def test_false_positive_rate(self):
+        absent = range(100000, 110000)
+        false_positives = sum(1 for key in absent if key in self.bloom_filter)
+        self.assertLess(false_positives / len(absent), 0.02)
+
+    def test_serialization(self):
+        loaded = BloomFilter.from_bytes(self.bloom_filter.to_bytes())
+        self.assertTrue(all(key in loaded for key in self.keys))
+        self.assertEqual(loaded.to_bytes(), self.bloom_filter.to_bytes())
+
+    def test_invalid_input(self):
+        with self.assertRaises(SmuttyException):
+            BloomFilter.for_capacity(10, 1)
+        with self.assertRaises(SmuttyException):
+            BloomFilter.from_bytes(b"XXXX" + self.bloom_filter.to_bytes()[4:])
@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from smutty.daemon.app import App
+
+from database import configuration
+
+
+class FailingRunner:
+
+    def __init__(self, failing_step):
+        self._failing_step = failing_step
+
+    def create_crawler(self, spider_class):
+        if self._failing_step == "create":
+            raise RuntimeError("could not create crawler")
+        return spider_class
+
+    def crawl(self, crawler):
+        raise RuntimeError("could not crawl")
+
+
+class CycleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        configuration(self.directory)
+        with unittest.mock.patch.object(sys, "argv", ["smutty.daemon", os.path.join(self.directory, "smutty.conf")]):
+            self.app = App()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_failing_cycles_are_counted(self):
+        self.app._runner = FailingRunner("create")
+        self.app.cycle()
+        self.app.cycle()
+        self.assertEqual(self.app._metrics.cycle_failures, 2)
+        self.assertEqual(self.app._metrics.last_error, "could not create crawler")
+
+    def test_failed_crawl_start_does_not_block_next_cycles(self):
+        self.app._runner = FailingRunner("crawl")
+        self.app.cycle()
+        self.assertFalse(self.app._crawling)
+        self.app.cycle()
+        self.assertEqual(self.app._metrics.skipped_cycles, 0)
+        self.assertEqual(self.app._metrics.cycle_failures, 2)
@@ -0,0 +1,73 @@
+import random
+import unittest
+
+from scrapy.utils.test import get_crawler
+
+from smutty.benchmarks.mocksite import MockSite
+from smutty.scraper.dedup import ItemIdBitmap, SeenItemsMiddleware
+
+from test_spiders import SpiderTestCase
+
+
+class ItemIdBitmapTest(unittest.TestCase):
+
+    def test_add_and_contains(self):
+        bitmap = ItemIdBitmap()
+        self.assertNotIn(10, bitmap)
+        self.assertTrue(bitmap.add(10))
+        self.assertFalse(bitmap.add(10))
+        self.assertIn(10, bitmap)
+        self.assertNotIn(9, bitmap)
+        self.assertNotIn(11, bitmap)
+        self.assertEqual(len(bitmap), 1)
+
+    def test_matches_a_set(self):
+        rnd = random.Random(0)
+        bitmap, reference = ItemIdBitmap(), set()
+        # mostly downwards, with newer ids arriving above the top
+        for item_id in [rnd.randrange(100000, 101000) for _ in range(3000)] + [100500, 200000, 0]:
+            self.assertEqual(bitmap.add(item_id), item_id not in reference)
+            reference.add(item_id)
+        self.assertEqual(len(bitmap), len(reference))
+        for item_id in range(99000, 102000):
+            self.assertEqual(item_id in bitmap, item_id in reference)
+
+    def test_one_bit_per_id(self):
+        bitmap = ItemIdBitmap()
+        for item_id in range(1000000, 900000, -1):
+            bitmap.add(item_id)
+        self.assertLessEqual(bitmap.byte_size, 2 * 100000 // 8)
+
+
+class DriftingSite(MockSite):
+    """
+    One new item per page served, pushing one seen item onto every next page
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.arrivals = 0
+
+    @property
+    def top_id(self):
+        return self._initial_top_id + self.arrivals
+
+    def page_html(self, page_number):
+        self.arrivals += 1
+        return super().page_html(page_number)
+
+
+class SeenItemsMiddlewareTest(SpiderTestCase):
+
+    def test_drops_drifted_items(self):
+        self.site = DriftingSite(page_count=20, items_per_page=10, top_id=1000000)
+        crawler = get_crawler()
+        self.state("current").set(1)
+        items, pages = self.crawl(self.spider(page_count=5), SeenItemsMiddleware(crawler.stats))
+        item_ids = [item.item_id for item in items]
+        self.assertEqual(len(item_ids), len(set(item_ids)))
+        # nothing skipped: every page was fetched, and ids are contiguous
+        self.assertEqual(pages, [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(item_ids), list(range(min(item_ids), max(item_ids) + 1)))
+        self.assertEqual(crawler.stats.get_value("dedup/duplicates"), 4)
+        self.assertEqual(crawler.stats.get_value("dedup/page_drift_max"), 1)
@@ -0,0 +1,198 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import sqlalchemy
+from path import Path
+
+from smutty.exceptions import SmuttyException
+from smutty.exporter.checkpoints import ExportCheckpoint
+from smutty.exporter.exporters import Exporter
+from smutty.exporter.segments import Interval, Block
+from smutty.exporter.statistics import TagStatistics
+from smutty.exporter.views import SubmitterViews
+from smutty.filetools import IntegerStateFile, ItemIdsStateFile, MustExistDirectory
+from smutty.reader import Reader
+from smutty.scraper.pipelines import SmuttyDatabasePipeline, SmuttyRefreshPipeline
+
+from database import sqlite_database, fill, configuration, record
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        fill(self.database, range(101, 131))
+        self.config = configuration(self.directory)
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(130)
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def state(self, name):
+        return IntegerStateFile(os.path.join(self.directory, name + ".state")).get()
+
+    def test_first_export_caches_lowest_item_id(self):
+        self.assertEqual(self.state("lowest_exporter_id"), 101)
+        self.assertEqual(self.state("highest_exporter_id"), 130)
+        self.assertEqual(self.state("lowest_item_id"), 101)
+
+    def test_up_to_date_export_is_decided_from_states(self):
+        # no database given or configured, any query would fail
+        exporter = Exporter(self.config)
+        self.assertEqual(exporter.plan(), [])
+        self.assertIsNone(exporter.profiler)
+
+    def test_backfilled_items_expand_lower_range(self):
+        lowest_item_id_state_file = os.path.join(self.directory, "lowest_item_id.state")
+        pipeline = SmuttyDatabasePipeline(None, database=self.database,
+                                          lowest_item_id_state_file=lowest_item_id_state_file)
+        for item_id in range(91, 96):
+            pipeline.process_item(record(item_id), None)
+        pipeline.close_spider(None)
+        self.assertEqual(self.state("lowest_item_id"), 91)
+
+        exporter = Exporter(self.config, None, self.database)
+        self.assertEqual(exporter.plan(), [Interval(91, 100)])
+
+    def test_failed_plan_releases_its_connection(self):
+        connections = []
+        sqlalchemy.event.listen(self.database.engine, "checkout", lambda *args: connections.append(args))
+        sqlalchemy.event.listen(self.database.engine, "checkin", lambda *args: connections.pop())
+        exporter = Exporter(self.config, None, self.database)
+        with self.assertRaises(SmuttyException):
+            exporter.plan(51, 60)
+        self.assertEqual(connections, [])
+
+    def test_missing_cache_queries_database(self):
+        os.remove(os.path.join(self.directory, "lowest_item_id.state"))
+        fill(self.database, range(91, 96))
+        exporter = Exporter(self.config, None, self.database)
+        self.assertEqual(exporter.plan(), [Interval(91, 100)])
+        self.assertEqual(self.state("lowest_item_id"), 91)
+
+
+class RefreshedExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        fill(self.database, range(101, 131))
+        self.checkpoint_file = os.path.join(self.directory, "checkpoint.json")
+        exporter_options = "tag_statistics = true\ncheckpoint_file = {0}\nsubmitter_buckets = 3\n".format(
+            self.checkpoint_file)
+        self.config = configuration(self.directory, exporter_options)
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(130)
+        self.export()
+        self.refreshed_items = ItemIdsStateFile(os.path.join(self.directory, "refreshed_items.state"))
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def export(self):
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+
+    def refresh(self, records):
+        pipeline = SmuttyRefreshPipeline(None, database=self.database)
+        pipeline.refreshed_items = self.refreshed_items
+        pipeline.blacklisted_tags = {"deleted"}
+        for item in records:
+            pipeline.process_item(item, None)
+        pipeline.close_spider(None)
+
+    def test_refreshed_blocks_are_exported_again(self):
+        self.refresh([record(105, tags=("a", "c"))])
+        exporter = Exporter(self.config, None, self.database)
+        self.assertEqual(exporter.verify(1), [("video", Block(0, 9999))])
+
+        self.assertEqual(exporter.plan(), [Interval(0, 130)])
+        exporter.export(exporter.plan())
+        self.assertEqual(exporter.verify(1), [])
+        self.assertFalse(self.refreshed_items.pending())
+        self.assertEqual(Exporter(self.config).plan(), [])
+
+    def test_checkpointed_blocks_are_exported_again(self):
+        # interrupted run, which exported the block before its items were refreshed
+        output = MustExistDirectory(os.path.join(self.directory, "output"))
+        checkpoint = ExportCheckpoint(self.checkpoint_file, output)
+        package_files = [Path(file_name) for file_name in glob.glob(os.path.join(output.path, "*-0-9999-*.jsonl.xz"))]
+        checkpoint.record(Block(0, 9999), 130, 30, package_files)
+        self.refresh([record(105, tags=("a", "c"))])
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        self.assertEqual(exporter.verify(1), [])
+
+    def test_tag_statistics_are_computed_again(self):
+        self.refresh([record(105, tags=("a", "c")), record(106, tags=("banned",))])
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        statistics = TagStatistics(MustExistDirectory(os.path.join(self.directory, "output")), "rb")
+        statistics.load()
+        self.assertEqual(statistics.tag_counts, {"a": 29, "b": 28, "c": 1, "banned": 1})
+
+    def submitter_item_ids(self, submitter):
+        reader = Reader(os.path.join(self.directory, "output"))
+        return [item["item_id"] for item in reader.submitter_items(submitter)]
+
+    def test_moved_items_leave_their_submitter_view(self):
+        self.assertIn(105, self.submitter_item_ids("user0"))
+        self.refresh([record(105, submitter="newcomer")])
+        self.export()
+        self.assertEqual(self.submitter_item_ids("newcomer"), [105])
+        self.assertEqual(self.submitter_item_ids("user0"), [112, 119, 126])
+
+    def test_submitters_without_items_are_dropped(self):
+        self.refresh([record(105, submitter="newcomer")])
+        self.export()
+        self.refresh([record(105, tags=("deleted",))])
+        self.export()
+        self.assertEqual(self.submitter_item_ids("newcomer"), [])
+        views = SubmitterViews(MustExistDirectory(os.path.join(self.directory, "output")), 3)
+        self.assertTrue(views.load())
+        self.assertNotIn("newcomer", views._submitters)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        fill(self.database, [item_id for item_id in range(101, 131) if item_id != 115])
+        self.checkpoint_file = os.path.join(self.directory, "checkpoint.json")
+        self.config = configuration(self.directory, "checkpoint_file = {0}\n".format(self.checkpoint_file))
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(130)
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        # as left by an interrupted first run, which exported the block already
+        output = MustExistDirectory(os.path.join(self.directory, "output"))
+        package_files = [Path(file_name) for file_name in glob.glob(os.path.join(output.path, "*-0-9999-*.jsonl.xz"))]
+        checkpoint = ExportCheckpoint(self.checkpoint_file, output)
+        checkpoint.record(Block(0, 9999), 130, 29, package_files)
+        for name in ("lowest_exporter_id", "highest_exporter_id"):
+            IntegerStateFile(os.path.join(self.directory, name + ".state")).delete()
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def exported_ids(self):
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        self.assertEqual(exporter.verify(1), [])
+        reader = Reader(os.path.join(self.directory, "output"))
+        return sorted(item["item_id"] for item in reader.items())
+
+    def test_checkpointed_blocks_are_skipped(self):
+        self.assertNotIn(115, self.exported_ids())
+
+    def test_blocks_with_items_stored_since_are_exported_again(self):
+        fill(self.database, [115])
+        self.assertEqual(self.exported_ids(), list(range(101, 131)))
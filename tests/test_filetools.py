@@ -0,0 +1,75 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from smutty.filetools import FinalizedTempFile, ItemIdsStateFile, md5_file
+
+
+class ItemIdsStateFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state = ItemIdsStateFile(os.path.join(self.directory, "ids.state"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_take_and_release(self):
+        self.assertFalse(self.state.pending())
+        self.assertEqual(self.state.take(), set())
+        self.state.add([3, 1])
+        self.state.add([1, 2])
+        self.assertTrue(self.state.pending())
+        self.assertEqual(self.state.take(), {1, 2, 3})
+        self.state.release()
+        self.assertFalse(self.state.pending())
+        self.assertEqual(self.state.take(), set())
+
+    def test_unreleased_ids_are_taken_again(self):
+        self.state.add([1, 2])
+        self.assertEqual(self.state.take(), {1, 2})
+        # appended while the first consumer was running, then interrupted
+        self.state.add([5])
+        self.assertEqual(self.state.take(), {1, 2, 5})
+        self.state.release()
+        self.assertEqual(self.state.take(), set())
+
+    def test_submitters_are_kept_along_with_ids(self):
+        self.state.add([1, 2], {1: "user1", 2: "user with spaces"})
+        self.state.add([1, 3], {1: "user2"})
+        self.assertEqual(self.state.take(), {1, 2, 3})
+        self.assertEqual(self.state.taken_submitters(), {"user1", "user2", "user with spaces"})
+        self.state.release()
+        self.assertEqual(self.state.taken_submitters(), set())
+
+
+class FinalizedTempFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hashed_file_named_after_its_content(self):
+        data = b"some package content\n" * 1000
+        temp_file = FinalizedTempFile(os.path.join(self.directory, "package-INTERMEDIATE"), "wb", hashed=True)
+        with temp_file as tmp_fileobj:
+            tmp_fileobj.write(data[:100])
+            tmp_fileobj.write(data[100:])
+            # written next to the destination, hidden
+            self.assertEqual(os.path.dirname(tmp_fileobj.name), self.directory)
+            self.assertTrue(os.path.basename(tmp_fileobj.name).startswith("."))
+            temp_file.final_path = os.path.join(self.directory, "package-{0}".format(tmp_fileobj.hexdigest()))
+        digest = hashlib.md5(data).hexdigest()
+        self.assertEqual(os.listdir(self.directory), ["package-{0}".format(digest)])
+        self.assertEqual(md5_file(temp_file.final_path), digest)
+
+    def test_failed_write_leaves_nothing(self):
+        with self.assertRaises(ValueError):
+            with FinalizedTempFile(os.path.join(self.directory, "package"), "wb", hashed=True) as tmp_fileobj:
+                tmp_fileobj.write(b"partial")
+                raise ValueError()
+        self.assertEqual(os.listdir(self.directory), [])
@@ -0,0 +1,27 @@
+import importlib
+import os
+import unittest
+
+import smutty
+
+
+# smutty is a namespace package, without __file__
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(list(smutty.__path__)[0]))
+
+
+def module_names():
+    for directory, _, file_names in os.walk(os.path.join(PACKAGE_DIRECTORY, "smutty")):
+        for file_name in sorted(file_names):
+            # entry points run on import
+            if not file_name.endswith(".py") or file_name == "__main__.py":
+                continue
+            relative = os.path.relpath(os.path.join(directory, file_name[:-3]), PACKAGE_DIRECTORY)
+            yield relative.replace(os.sep, ".")
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_modules_import(self):
+        for name in module_names():
+            with self.subTest(module=name):
+                importlib.import_module(name)
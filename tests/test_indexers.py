@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from smutty.exporter.indexers import ShardedIndexWriter
+from smutty.filetools import MustExistDirectory
+from smutty.reader import DirectorySource, PackageIndex, PackageInfo, ShardedPackageIndex
+
+
+def package_info(content_type, min_id, max_id, hash_digest="0" * 32):
+    return {"content_type": content_type, "min_id": min_id, "max_id": max_id, "hash_digest": hash_digest}
+
+
+class ShardedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # six blocks of both types, the last one completed by a delta package
+        self.infos = [package_info(content_type, min_id, min_id + 9999)
+                      for content_type in ("image", "video") for min_id in range(0, 60000, 10000)]
+        self.infos.append(package_info("image", 55000, 55999))
+        self.writer = ShardedIndexWriter(MustExistDirectory(self.directory), 2)
+        self.writer.write(self.infos)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def shard_files(self):
+        return sorted(name for name in os.listdir(os.path.join(self.directory, "shards")) if name.startswith("shard-"))
+
+    def selected(self, index, *args, **kwargs):
+        return [(package.content_type, package.min_id, package.max_id) for package in index.select(*args, **kwargs)]
+
+    def test_select_matches_flat_index(self):
+        flat = PackageIndex(PackageInfo(info) for info in self.infos)
+        sharded = ShardedPackageIndex.load(DirectorySource(self.directory))
+        self.assertEqual(len(sharded), len(self.infos))
+        for arguments in ((), (15000, 25000), (19999, 20000), (55500, None), (None, 9999), (60000, None)):
+            for content_type in (None, "image"):
+                with self.subTest(arguments=arguments, content_type=content_type):
+                    self.assertEqual(self.selected(sharded, *arguments, content_type=content_type),
+                                     self.selected(flat, *arguments, content_type=content_type))
+
+    def test_only_overlapping_shards_are_loaded(self):
+        sharded = ShardedPackageIndex.load(DirectorySource(self.directory))
+        self.assertEqual(self.selected(sharded, 21000, 22000, "video"), [("video", 20000, 29999)])
+        loaded = [name for name in self.shard_files() if name.startswith("shard-20000-")]
+        self.assertEqual(list(sharded._loaded), loaded)
+
+    def test_unchanged_shards_are_kept(self):
+        before = self.shard_files()
+        self.infos[-1] = package_info("image", 55000, 55999, "1" * 32)
+        self.writer.write(self.infos)
+        after = self.shard_files()
+        self.assertEqual(len(after), 3)
+        self.assertEqual(before[:2], after[:2])
+        self.assertNotEqual(before[2], after[2])
@@ -0,0 +1,41 @@
+import datetime
+import pickle
+import unittest
+
+import pytz
+
+from smutty.scraper.items import SmuttyImageRecord, SmuttyVideoRecord
+
+
+LAST_UPDATED = datetime.datetime(2018, 1, 2, 3, 4, 5, tzinfo=pytz.UTC)
+
+
+class RecordTest(unittest.TestCase):
+
+    def video(self):
+        return SmuttyVideoRecord(12, "user", "/s/12/", ["b", "a", "b"], LAST_UPDATED,
+                                 "https://example.com/p.jpg", "https://example.com/v.mp4", "video/mp4")
+
+    def test_fields_by_name_and_attribute(self):
+        record = self.video()
+        self.assertEqual(record["item_id"], 12)
+        self.assertEqual(record.video_mime, "video/mp4")
+        self.assertIn("poster_url", record)
+        self.assertNotIn("image_url", record)
+        self.assertEqual(set(record), set(SmuttyVideoRecord.FIELDS))
+
+    def test_tags_are_sorted_unique(self):
+        self.assertEqual(self.video().tags, ("a", "b"))
+
+    def test_no_instance_dictionary(self):
+        record = SmuttyImageRecord(1, "user", "/s/1/", [], LAST_UPDATED, "https://example.com/i.jpg")
+        self.assertFalse(hasattr(record, "__dict__"))
+        with self.assertRaises(AttributeError):
+            record.other = None
+
+    def test_pickle(self):
+        # records cross process boundaries when reingesting
+        record = self.video()
+        copy = pickle.loads(pickle.dumps(record))
+        self.assertIs(type(copy), SmuttyVideoRecord)
+        self.assertEqual(copy, record)
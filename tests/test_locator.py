@@ -0,0 +1,41 @@
+import unittest
+
+from smutty.scraper.locator import PageLocator
+
+
+def listing(page_number, top_id=1000, per_page=10, lowest_id=0):
+    first_id = top_id - (page_number - 1) * per_page
+    return [item_id for item_id in range(first_id, first_id - per_page, -1) if item_id > lowest_id]
+
+
+def locate(target_id, **site):
+    locator = PageLocator(target_id)
+    page_number = locator.next_page()
+    while page_number is not None:
+        locator.observe(page_number, listing(page_number, **site))
+        page_number = locator.next_page()
+    return locator
+
+
+class PageLocatorTest(unittest.TestCase):
+
+    def test_finds_page_of_target(self):
+        for target_id in (1000, 999, 991, 990, 500, 1):
+            with self.subTest(target_id=target_id):
+                locator = locate(target_id)
+                self.assertIn(target_id, listing(locator.page))
+
+    def test_logarithmic_probes(self):
+        locator = locate(7, top_id=100000)
+        self.assertIn(7, listing(locator.page, top_id=100000))
+        # 10000 pages, two logarithmic phases
+        self.assertLessEqual(locator.probes, 2 * 15)
+
+    def test_target_below_listed_items(self):
+        # the first empty page bounds the search
+        locator = locate(10, lowest_id=500)
+        self.assertEqual(listing(locator.page, lowest_id=500), [])
+        self.assertNotEqual(listing(locator.page - 1, lowest_id=500), [])
+
+    def test_target_above_newest_item(self):
+        self.assertEqual(locate(5000).page, 1)
@@ -0,0 +1,120 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytz
+import sqlalchemy
+
+from smutty.filetools import ItemIdsStateFile
+from smutty.models import Item
+from smutty.scraper.pipelines import SmuttyRefreshPipeline
+
+from database import sqlite_database, record, fill
+
+
+LATER = datetime.datetime(2019, 1, 1, tzinfo=pytz.UTC)
+
+
+class Stats(dict):
+
+    def inc_value(self, key, count=1):
+        self[key] = self.get(key, 0) + count
+
+    def set_value(self, key, value):
+        self[key] = value
+
+
+class RefreshPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        fill(self.database, range(1, 11))
+        self.stats = Stats()
+        self.pipeline = SmuttyRefreshPipeline(None, database=self.database, stats=self.stats)
+        self.statements = []
+        sqlalchemy.event.listen(self.database.engine, "before_cursor_execute", self.count_statement)
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def count_statement(self, connection, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split()[0].upper())
+
+    def refresh(self, records):
+        for item in records:
+            self.pipeline.process_item(item, None)
+        self.pipeline.flush()
+
+    def stored(self, item_id):
+        item = self.database.session.query(Item).get(item_id)
+        self.database.session.refresh(item)
+        return item
+
+    def test_unchanged_items_cost_no_write(self):
+        self.refresh([record(item_id, last_updated=LATER) for item_id in range(1, 11)])
+        self.assertEqual(self.statements, ["SELECT"])
+        self.assertEqual(self.stored(1).last_updated.replace(tzinfo=pytz.UTC), record(1).last_updated)
+
+    def test_tag_differences(self):
+        self.refresh([record(1, tags=("a", "c"), last_updated=LATER),
+                      record(2, tags=(), last_updated=LATER),
+                      record(3, last_updated=LATER)])
+        self.assertEqual({tag.name for tag in self.stored(1).tags}, {"a", "c"})
+        self.assertEqual(self.stored(2).tags, set())
+        self.assertEqual(self.stored(1).last_updated.replace(tzinfo=pytz.UTC), LATER)
+        self.assertNotEqual(self.stored(3).last_updated.replace(tzinfo=pytz.UTC), LATER)
+        self.assertEqual(self.stats["refresh/changed_items"], 2)
+        self.assertEqual(self.stats["refresh/added_tags"], 1)
+        self.assertEqual(self.stats["refresh/removed_tags"], 3)
+        # one lookup, tag creation, then one statement per kind of change
+        self.assertEqual(self.statements.count("DELETE"), 1)
+        self.assertEqual(self.statements.count("UPDATE"), 1)
+
+    def test_field_differences(self):
+        self.refresh([record(1, image_url="https://example.com/fixed/1.jpg"),
+                      record(3, submitter="fixed", video_mime="video/webm")])
+        self.assertEqual(self.stored(1).image_url, "https://example.com/fixed/1.jpg")
+        self.assertEqual(self.stored(3).submitter, "fixed")
+        self.assertEqual(self.stored(3).video_mime, "video/webm")
+        self.assertEqual(self.stored(3).video_url, record(3).video_url)
+        self.assertEqual(self.stats["refresh/changed_fields"], 3)
+
+    def test_unknown_items_are_inserted(self):
+        self.refresh([record(11, tags=("new",)), record(1)])
+        self.assertEqual({tag.name for tag in self.stored(11).tags}, {"new"})
+        self.assertEqual(self.stats["refresh/new_items"], 1)
+
+    def test_blacklisted_items_are_deleted(self):
+        self.pipeline.blacklisted_tags = {"banned"}
+        self.refresh([record(1, tags=("a", "banned")), record(11, tags=("banned",)), record(2)])
+        self.assertIsNone(self.database.session.query(Item).get(1))
+        self.assertIsNone(self.database.session.query(Item).get(11))
+        self.assertIsNotNone(self.database.session.query(Item).get(2))
+        self.assertEqual(self.stats["refresh/deleted_items"], 1)
+        self.assertEqual(self.stats.get("refresh/new_items", 0), 0)
+
+    def test_changed_deleted_and_inserted_ids_are_recorded(self):
+        self.pipeline.blacklisted_tags = {"banned"}
+        self.pipeline.refreshed_items = ItemIdsStateFile(os.path.join(self.directory, "refreshed_items.state"))
+        self.refresh([record(1, submitter="moved"), record(2), record(3, tags=("banned",)), record(11)])
+        self.assertEqual(self.pipeline.refreshed_items.take(), {1, 3, 11})
+        # submitters the items had before
+        self.assertEqual(self.pipeline.refreshed_items.taken_submitters(), {"user1", "user3", "user4"})
+
+    def test_later_occurrence_wins(self):
+        self.refresh([record(1, tags=("x",)), record(1, tags=("y",))])
+        self.assertEqual({tag.name for tag in self.stored(1).tags}, {"y"})
+
+    def test_commit_latency_moving_average(self):
+        self.pipeline.record_commit_latency(0.1)
+        self.assertAlmostEqual(self.stats["pipeline/commit_latency_ms"], 100)
+        # a single slow commit does not slow the crawl down
+        self.pipeline.record_commit_latency(1.1)
+        self.assertAlmostEqual(self.stats["pipeline/commit_latency_ms"], 300)
+        for _ in range(20):
+            self.pipeline.record_commit_latency(1.1)
+        self.assertGreater(self.stats["pipeline/commit_latency_ms"], 1000)
@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+import unittest
+
+from smutty.db import DatabaseSession
+from smutty.exceptions import QueryBudgetExceeded
+from smutty.querystats import QueryProfiler, profiled_stage
+
+
+class QueryProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def database(self, profiler):
+        return DatabaseSession("sqlite:///{0}/main.db".format(self.directory), profiler=profiler)
+
+    def query(self, database, stage, count):
+        with database.engine.connect() as connection:
+            for _ in range(count):
+                with profiled_stage(database.profiler, stage):
+                    connection.execute("SELECT 1")
+
+    def test_counts_statements_per_stage(self):
+        profiler = QueryProfiler()
+        database = self.database(profiler)
+        self.query(database, "tag lookup", 3)
+        self.query(database, "existence check", 2)
+        database.engine.connect().execute("SELECT 1")
+        self.assertEqual(profiler.statistics("tag lookup").count, 3)
+        self.assertEqual(profiler.statistics("existence check").count, 2)
+        self.assertEqual(profiler.statistics(QueryProfiler.DEFAULT_STAGE).count, 1)
+        self.assertEqual(len(profiler.statistics("tag lookup").slowest), 3)
+
+    def test_overrun_does_not_interrupt_the_run(self):
+        profiler = QueryProfiler({"tag lookup": 2}, enforce_budgets=True)
+        # stages keep running past their budget
+        self.query(self.database(profiler), "tag lookup", 5)
+        self.assertEqual(profiler.statistics("tag lookup").count, 5)
+        with self.assertRaises(QueryBudgetExceeded):
+            profiler.check_budgets()
+
+    def test_budgets_within_limits(self):
+        profiler = QueryProfiler({"tag lookup": 5, "package query": 1}, enforce_budgets=True)
+        self.query(self.database(profiler), "tag lookup", 5)
+        profiler.check_budgets()
+
+    def test_budgets_not_enforced(self):
+        profiler = QueryProfiler({"tag lookup": 2})
+        self.query(self.database(profiler), "tag lookup", 5)
+        profiler.check_budgets()
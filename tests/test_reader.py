@@ -0,0 +1,150 @@
+import hashlib
+import lzma
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from smutty.exporter.archives import ArchiveBundler, load_manifest
+from smutty.exporter.exporters import Exporter
+from smutty.exporter.indexers import LzmaJsonIndexer
+from smutty.exporter.segments import Block
+from smutty.filetools import IntegerStateFile, MustExistDirectory
+from smutty.reader import DirectorySource, PackageCache, Reader
+
+from database import sqlite_database, fill, configuration
+
+
+class RecordingSource(DirectorySource):
+    """
+    Local source keeping track of the files, and ranges, it was asked for
+    """
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.reads = []
+
+    def read(self, name):
+        self.reads.append((name, None))
+        return super().read(name)
+
+    def read_range(self, name, offset, length):
+        self.reads.append((name, (offset, length)))
+        return super().read_range(name, offset, length)
+
+
+class ExportedReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(130)
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def reader(self, exporter_options=""):
+        exporter = Exporter(configuration(self.directory, exporter_options), None, self.database)
+        exporter.export(exporter.plan())
+        reader = Reader(os.path.join(self.directory, "output"))
+        reader._source = RecordingSource(os.path.join(self.directory, "output"))
+        return reader
+
+    def test_tags_found_in_other_fields_are_filtered_out(self):
+        fill(self.database, range(101, 111))
+        fill(self.database, range(111, 116), tags=("user1",))
+        # submitters hold the tag needle, but not the tag
+        fill(self.database, range(116, 121), submitter="user1")
+        reader = self.reader()
+        self.assertEqual([item["item_id"] for item in reader.items(tags=["user1"]) if item["content_type"] == "image"],
+                         [112, 113, 115])
+        self.assertEqual(list(reader.items(tags=["a", "user1"])), [])
+
+    def test_id_ranges_only_fetch_overlapping_frames(self):
+        fill(self.database, range(101, 131))
+        reader = self.reader("seekable_frame_lines = 5\n")
+        image_package, = reader.packages(content_type="image")
+        self.assertEqual([item["item_id"] for item in reader.items(106, 110, "image")], [106, 107, 109, 110])
+        package_reads = [read_range for name, read_range in reader._source.reads if name == image_package.file_name]
+        # images 101 to 107, then 109 to 115, are the first two of four frames of five lines
+        self.assertEqual(len(package_reads), 2)
+        self.assertTrue(all(read_range is not None for read_range in package_reads))
+
+        # whole packages are read when the range covers them
+        self.assertEqual(len(list(reader.items(content_type="image"))), 20)
+        self.assertIn((image_package.file_name, None), reader._source.reads)
+
+    def test_items_absent_from_bloom_filters_skip_their_package(self):
+        fill(self.database, [item_id for item_id in range(101, 131) if item_id != 115])
+        reader = self.reader("bloom_false_positive_rate = 0.0001\n")
+        self.assertEqual({package.content_type for package in reader.may_contain(item_id=116)}, {"image"})
+        self.assertEqual(reader.may_contain(item_id=115), [])
+        self.assertEqual({package.content_type for package in reader.may_contain(url="https://example.com/v/120.mp4")},
+                         {"video"})
+        self.assertFalse(any(name.endswith(".jsonl.xz") for name, _ in reader._source.reads
+                             if name != "index.json.xz"))
+
+    def test_packages_without_bloom_filter_may_contain_anything(self):
+        fill(self.database, range(101, 131))
+        reader = self.reader()
+        self.assertEqual({package.content_type for package in reader.may_contain(item_id=5000)}, {"image", "video"})
+
+
+class BundledReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = MustExistDirectory(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def package(self, content_type, min_id, item_ids):
+        data = b"".join('{{"item_id":{0},"tags":["a"]}}\n'.format(item_id).encode() for item_id in item_ids)
+        name = "{0}-{1}-{2}-{3}.jsonl.xz".format(content_type, min_id, min_id + Block.SIZE - 1,
+                                                 hashlib.md5(data).hexdigest())
+        path = self.output.path / name
+        path.write_bytes(lzma.compress(data))
+        mtime = time.time() - 2 * 24 * 3600
+        os.utime(path, (mtime, mtime))
+
+    def test_bundled_packages_are_read_from_their_slice(self):
+        self.package("image", 0, [1, 2])
+        self.package("video", 0, [3])
+        self.package("image", 10000, [10001])
+        self.package("image", 30000, [30001])
+        retired = ArchiveBundler(self.output, "wb", 1, bundle_blocks=2).archive(29999)
+        indexer = LzmaJsonIndexer(self.output, "wb")
+        indexer.attach_bundles(ArchiveBundler.FILE_PATTERN, load_manifest)
+        indexer.generate(retired)
+        for retired_file in retired:
+            retired_file.remove()
+
+        reader = Reader(self.directory)
+        self.assertEqual([package.bundle is not None for package in reader.packages()], [True, True, True, False])
+        self.assertEqual([item["item_id"] for item in reader.items()], [1, 2, 3, 10001, 30001])
+        self.assertEqual([item["item_id"] for item in reader.items(min_id=10000, max_id=10001)], [10001])
+
+
+class PackageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_least_recently_used_packages_are_evicted(self):
+        cache = PackageCache(self.directory, 25)
+        for age, hash_digest in enumerate(("a", "b"), 1):
+            path = cache.put(hash_digest, b"0123456789")
+            mtime = time.time() - age * 60
+            os.utime(path, (mtime, mtime))
+        # "b" is older, but was read since
+        self.assertIsNotNone(cache.get("b"))
+        cache.put("c", b"0123456789")
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
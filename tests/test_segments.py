@@ -0,0 +1,28 @@
+import unittest
+
+from smutty.exporter.segments import Interval, Block, merge_intervals
+
+
+class IntervalTest(unittest.TestCase):
+
+    def test_intersection(self):
+        interval = Interval(10, 20)
+        self.assertEqual(interval.intersection(Interval(15, 30)), Interval(15, 20))
+        self.assertEqual(interval.intersection(Interval(0, 12)), Interval(10, 12))
+        self.assertEqual(interval.intersection(Interval(12, 18)), Interval(12, 18))
+        self.assertEqual(interval.intersection(Interval(0, 30)), interval)
+        # bounds are inclusive
+        self.assertEqual(interval.intersection(Interval(20, 25)), Interval(20, 20))
+        self.assertIsNone(interval.intersection(Interval(21, 25)))
+        self.assertIsNone(interval.intersection(Interval(0, 9)))
+
+    def test_block_intersection(self):
+        block = Block.containing(12345)
+        self.assertEqual(block, Block(10000, 19999))
+        self.assertEqual(block.intersection(Interval(19000, 25000)), Interval(19000, 19999))
+        self.assertIsNone(block.intersection(Interval(20000, 25000)))
+
+    def test_merge_intervals(self):
+        self.assertEqual(merge_intervals([]), [])
+        self.assertEqual(merge_intervals([Interval(50, 60), Interval(0, 130), Interval(131, 140), Interval(200, 210)]),
+                         [Interval(0, 140), Interval(200, 210)])
@@ -0,0 +1,41 @@
+import io
+import json
+import unittest
+
+from smutty.benchmarks.packages import export_items, read_package
+from smutty.exporter.serializers import CompactItemEncoder, JsonlPackageSerializer, LzmaJsonlPackageSerializer
+
+
+class CompactEncodingTest(unittest.TestCase):
+
+    def setUp(self):
+        # dates with microseconds, several url prefixes and mime types
+        self.items = export_items(2000, 50)
+
+    def test_expanded_items_match_regular_ones(self):
+        encoder = CompactItemEncoder(self.items)
+        header = json.loads(encoder.encode_header().decode())[CompactItemEncoder.HEADER_KEY]
+        for item in self.items:
+            regular = json.loads(JsonlPackageSerializer.encode_item(item).decode())
+            compact = json.loads(encoder.encode_item(item).decode())
+            self.assertEqual(CompactItemEncoder.expand_item(header, compact), regular)
+
+    def test_packages_round_trip(self):
+        packages = {}
+        for compact in (False, True):
+            file_obj = io.BytesIO()
+            LzmaJsonlPackageSerializer(None, "wb", compact).serialize_to_file(None, self.items, file_obj)
+            packages[compact] = file_obj.getvalue()
+        self.assertEqual(read_package(packages[True]), read_package(packages[False]))
+        self.assertEqual(len(read_package(packages[True])), len(self.items))
+
+    def test_header_tables(self):
+        header = CompactItemEncoder(self.items).header()
+        self.assertEqual(set(header["enums"]["video_mime"]), {"video/mp4", "video/webm"})
+        self.assertEqual(header["prefixes"][:2], ["https://cdn.example.com/images/2018/01/01/", "/s/"])
+        self.assertEqual(len(header["prefixes"]), 3 * 2 + 1)
+
+    def test_split_url(self):
+        self.assertEqual(CompactItemEncoder.split_url("/s/123/"), ("/s/", "123/"))
+        self.assertEqual(CompactItemEncoder.split_url("https://a.com/i/1.jpg"), ("https://a.com/i/", "1.jpg"))
+        self.assertEqual(CompactItemEncoder.split_url("name"), ("", "name"))
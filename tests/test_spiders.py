@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import scrapy.http
+
+from smutty.benchmarks.mocksite import MockSite
+from smutty.filetools import IntegerStateFile
+from smutty.scraper.spiders import SmuttySpider
+
+
+class SpiderTestCase(unittest.TestCase):
+    """
+    Drives the spider with pages generated by the mock site, without network
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.site = MockSite(page_count=20, items_per_page=10, top_id=1000000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def state(self, name):
+        return IntegerStateFile(os.path.join(self.directory, name))
+
+    def spider(self, **kwargs):
+        return SmuttySpider(self.state("current").file_name, self.state("highest").file_name,
+                            self.state("lowest").file_name, kwargs.pop("page_count", None),
+                            kwargs.pop("blacklist_tags", set()), "http://mock.example.com/?page={0}", **kwargs)
+
+    def response(self, request):
+        page_number = request.meta["page_number"]
+        return scrapy.http.HtmlResponse(url=request.url, body=self.site.page_html(page_number), request=request)
+
+    def crawl(self, spider, middleware=None):
+        """
+        Returns items, and pages parsed or probed
+        """
+        items, pages = [], []
+        requests = list(spider.start_requests())
+        while requests:
+            request = requests.pop(0)
+            pages.append(request.meta["page_number"])
+            response = self.response(request)
+            output = request.callback(response)
+            if middleware is not None:
+                output = middleware.process_spider_output(response, output, spider)
+            for element in output:
+                if isinstance(element, scrapy.Request):
+                    requests.append(element)
+                else:
+                    items.append(element)
+        return items, pages
+
+
+class BackfillTest(SpiderTestCase):
+
+    def test_walks_from_located_page_down_to_minimum_id(self):
+        items, _ = self.crawl(self.spider(locate_id=999900, walk_min_id=999850))
+        self.assertEqual([item.item_id for item in items], list(range(999900, 999850, -1)))
+
+    def test_leaves_crawl_states_untouched(self):
+        self.state("current").set(7)
+        self.state("lowest").set(999990)
+        self.crawl(self.spider(locate_id=999900, walk_min_id=999850))
+        self.assertEqual(self.state("current").get(), 7)
+        self.assertEqual(self.state("lowest").get(), 999990)
+        self.assertIsNone(self.state("highest").get())
+
+    def test_crawl_updates_states(self):
+        self.state("current").set(1)
+        self.state("lowest").set(999950)
+        items, _ = self.crawl(self.spider())
+        self.assertEqual(len(items), 50)
+        # finalized: highest id seen becomes the next lower bound
+        self.assertEqual(self.state("lowest").get(), 1000000)
+        self.assertIsNone(self.state("current").get())
+
+
+class BlacklistTest(SpiderTestCase):
+
+    def test_crawl_skips_blacklisted_items(self):
+        self.state("current").set(1)
+        tag = MockSite.TAGS[0]
+        items, _ = self.crawl(self.spider(page_count=3, blacklist_tags={tag}))
+        self.assertTrue(items)
+        self.assertFalse([item for item in items if tag in item.tags])
+
+    def test_refresh_passes_blacklisted_items(self):
+        # for the refresh pipeline to delete known ones
+        tag = MockSite.TAGS[0]
+        items, _ = self.crawl(self.spider(page_count=3, blacklist_tags={tag}, refresh_start_page=1))
+        self.assertEqual(len(items), 30)
+        self.assertTrue([item for item in items if tag in item.tags])
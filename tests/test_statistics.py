@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from smutty.exporter.exporters import Exporter
+from smutty.exporter.segments import Interval
+from smutty.exporter.statistics import TagStatistics
+from smutty.filetools import IntegerStateFile, MustExistDirectory
+
+from database import sqlite_database, fill, configuration
+
+
+class TagStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        self.config = configuration(self.directory, "tag_statistics = true\n")
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(130)
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def statistics(self):
+        statistics = TagStatistics(MustExistDirectory(os.path.join(self.directory, "output")), "rb")
+        statistics.load()
+        return statistics
+
+    def test_overlaps(self):
+        statistics = TagStatistics(None, "rb")
+        self.assertFalse(statistics.overlaps([Interval(0, 10)]))
+        statistics.min_id, statistics.max_id = 100, 200
+        self.assertFalse(statistics.overlaps([Interval(0, 99), Interval(201, 300)]))
+        self.assertTrue(statistics.overlaps([Interval(0, 99), Interval(200, 300)]))
+        self.assertTrue(statistics.overlaps([Interval(150, 160)]))
+
+    def test_new_items_are_counted(self):
+        fill(self.database, range(101, 121))
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(120)
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        fill(self.database, range(121, 131), tags=("a", "c"))
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(130)
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        statistics = self.statistics()
+        self.assertEqual((statistics.min_id, statistics.max_id), (101, 130))
+        self.assertEqual(statistics.tag_counts, {"a": 30, "b": 20, "c": 10})
+
+    def test_items_exported_again_are_counted_again(self):
+        fill(self.database, [item_id for item_id in range(101, 131) if item_id != 115])
+        exporter = Exporter(self.config, None, self.database)
+        exporter.export(exporter.plan())
+        # backfilled into the covered range, then exported again from given limits
+        fill(self.database, [115], tags=("c",))
+        exporter = Exporter(self.config, None, self.database)
+        intervals = exporter.plan(101, 110)
+        self.assertEqual(intervals, [Interval(111, 130)])
+        exporter.export(intervals)
+        statistics = self.statistics()
+        self.assertEqual(statistics.tag_counts, {"a": 29, "b": 29, "c": 1})
@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+import unittest
+
+import scrapy
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.utils.test import get_crawler
+
+from smutty.scraper.app import build_settings
+from smutty.scraper.throttle import AdaptiveThrottle
+
+from database import configuration
+
+
+class Response:
+
+    def __init__(self, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+class AdaptiveThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.throttle = AdaptiveThrottle(get_crawler(), 0.5, 60.0, 0.5)
+
+    def test_server_errors_back_off(self):
+        self.assertEqual(self.throttle.decide(2.0, 0.1, Response(503), 0.0), (4.0, "server"))
+        self.assertEqual(self.throttle.decide(2.0, 0.1, Response(429, {"Retry-After": "30"}), 0.0), (30.0, "server"))
+
+    def test_slow_commits_back_off(self):
+        self.assertEqual(self.throttle.decide(2.0, 0.1, Response(), 0.6), (3.0, "database"))
+
+    def test_speedup_towards_latency(self):
+        self.assertEqual(self.throttle.decide(2.0, 0.1, Response(), 0.1), (1.6, "speedup"))
+        self.assertEqual(self.throttle.decide(2.0, 1.8, Response(), 0.1), (1.8, "speedup"))
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_back_off_statuses_are_retried(self):
+        settings = build_settings(configuration(self.directory))
+        middleware = RetryMiddleware(settings)
+        spider = scrapy.Spider("smutty")
+        spider.crawler = get_crawler(settings_dict=settings.copy_to_dict())
+        for status in sorted(AdaptiveThrottle.BACKOFF_STATUSES):
+            request = scrapy.Request("http://mock.example.com/?page=2", meta={"page_number": 2})
+            response = scrapy.http.Response(request.url, status=status, request=request)
+            retried = middleware.process_response(request, response, spider)
+            self.assertIsInstance(retried, scrapy.Request)
+            self.assertEqual(retried.meta["retry_times"], 1)
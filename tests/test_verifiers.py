@@ -0,0 +1,69 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from smutty.exporter.exporters import Exporter
+from smutty.filetools import IntegerStateFile
+from smutty.models import Item, Image, Tag
+
+from database import sqlite_database, fill, configuration
+
+
+class VerifierTest(unittest.TestCase):
+
+    EXPORTER_OPTIONS = ""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = sqlite_database(self.directory)
+        fill(self.database, list(range(1, 31)) + list(range(10001, 10021)))
+        config = configuration(self.directory, self.EXPORTER_OPTIONS)
+        IntegerStateFile(os.path.join(self.directory, "lowest_scraper_id.state")).set(10020)
+        self.exporter = Exporter(config, None, self.database)
+        self.exporter.export(self.exporter.plan())
+
+    def tearDown(self):
+        self.database.dispose()
+        shutil.rmtree(self.directory)
+
+    def stale(self):
+        return [(content_type, block.min_id) for content_type, block in self.exporter.verify(1)]
+
+    def test_exported_output_is_valid(self):
+        self.assertEqual(self.stale(), [])
+
+    def test_changed_field(self):
+        with self.database.unit_of_work() as session:
+            session.query(Image).get(10001).image_url = "https://example.com/changed.jpg"
+        self.assertEqual(self.stale(), [("image", 10000)])
+
+    def test_changed_submitter(self):
+        with self.database.unit_of_work() as session:
+            session.query(Item).get(3).submitter = "other"
+        self.assertEqual(self.stale(), [("video", 0)])
+
+    def test_replaced_tag(self):
+        # same item counts, ids and tag counts
+        with self.database.unit_of_work() as session:
+            item = session.query(Item).get(1)
+            item.tags.remove(session.query(Tag).filter_by(name="a").one())
+            item.tags.add(Tag(name="c"))
+        self.assertEqual(self.stale(), [("image", 0)])
+
+    def test_renamed_tag(self):
+        with self.database.unit_of_work() as session:
+            session.query(Tag).filter_by(name="b").one().name = "renamed"
+        self.assertEqual(self.stale(), [("image", 0), ("video", 0), ("image", 10000), ("video", 10000)])
+
+    def test_corrupted_package(self):
+        package_file = glob.glob(os.path.join(self.directory, "output", "video-10000-*.jsonl.xz"))[0]
+        with open(package_file, "ab") as file_obj:
+            file_obj.write(b"\0")
+        self.assertEqual(self.stale(), [("video", 10000)])
+
+
+class CompactVerifierTest(VerifierTest):
+
+    EXPORTER_OPTIONS = "compact_encoding = true\nseekable_frame_lines = 7\n"